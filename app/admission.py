@@ -0,0 +1,203 @@
+# in app/admission.py
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from fastapi import HTTPException, status
+from app import group_commit
+
+# Admission control. Requests are sorted into route classes (auth, reads,
+# writes); each class lets a fixed number of requests run at once and keeps a
+# bounded queue of waiters. A request that finds the queue full, or waits
+# longer than ADMISSION_QUEUE_TIMEOUT_MS, gets an immediate 503 with
+# Retry-After instead of piling up on the threadpool and the DB pool, so
+# latency for admitted requests stays flat during a burst.
+#
+# On top of that, an optional per-user token bucket (RATE_LIMIT_PER_SECOND,
+# RATE_LIMIT_BURST) answers 429 with Retry-After to a user sending too fast.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true") == "true"
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+ADMISSION_RETRY_AFTER_SECONDS = os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1")
+
+# auth + reads + writes + exports defaults add up to the default DB pool (DB_POOL_SIZE + DB_MAX_OVERFLOW = 20)
+CLASS_LIMITS = {
+    "auth": (int(os.getenv("AUTH_CONCURRENCY", "4")), int(os.getenv("AUTH_QUEUE", "50"))),
+    "reads": (int(os.getenv("READ_CONCURRENCY", "8")), int(os.getenv("READ_QUEUE", "200"))),
+    "writes": (int(os.getenv("WRITE_CONCURRENCY", "6")), int(os.getenv("WRITE_QUEUE", "200"))),
+    # GET /calculations/export holds its slot (and a connection) until the last
+    # chunk is sent, at the client's pace: slow downloads only wait on each other
+    "exports": (int(os.getenv("EXPORT_CONCURRENCY", "2")), int(os.getenv("EXPORT_QUEUE", "20"))),
+    # POST /calculations/ with CALC_COMMIT_MODE=group: these wait on the flusher
+    # without holding a connection, and a group can only be as big as this limit
+    "grouped": (int(os.getenv("GROUPED_WRITE_CONCURRENCY", "500")), int(os.getenv("GROUPED_WRITE_QUEUE", "1000"))),
+}
+
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))  # 0 = no per-user limit
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", str(max(1.0, RATE_LIMIT_PER_SECOND * 2))))
+
+# Path prefix -> class; GET/HEAD count as reads (exports apart), other methods as writes.
+# Anything else (static files, /metrics, /) is not limited.
+_AUTH_PREFIXES = ("/users/",)
+_DATA_PREFIXES = ("/calculations", "/stats", "/analytics")
+
+# Long-lived, mostly idle streams: holding a slot would starve everything else
+_UNLIMITED_PATHS = ("/calculations/events",)
+_EXPORT_PATH = "/calculations/export"
+
+def classify(method: str, path: str):
+    if path in _UNLIMITED_PATHS:
+        return None
+    if path.startswith(_AUTH_PREFIXES):
+        return "auth"
+    if path.startswith(_DATA_PREFIXES):
+        if method in ("GET", "HEAD"):
+            return "exports" if path == _EXPORT_PATH else "reads"
+        if method == "POST" and path == "/calculations/" and group_commit.CALC_COMMIT_MODE == "group":
+            return "grouped"
+        return "writes"
+    return None
+
+class Rejected(Exception):
+    """The class is at its limit and its wait queue is full, or the wait timed out."""
+
+class Gate:
+    """At most `limit` holders at once; at most `queue_limit` waiters, served in arrival order."""
+
+    def __init__(self, limit: int, queue_limit: int, timeout: float):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue_limit:
+            self.rejected += 1
+            raise Rejected()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release() hands the slot over by resolving the future (active stays counted)
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return  # got the slot at the last moment
+            self._waiters.remove(waiter)
+            waiter.cancel()
+            self.rejected += 1
+            raise Rejected()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # slot was handed over, but the caller went away
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+class TokenBucket:
+    """Per-key token buckets refilled at `rate` per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, last refill time]
+
+    def take(self, key) -> float:
+        """Takes one token. Returns 0 on success, else the seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.clear()  # idle users just start again with a full bucket
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+gates = {
+    name: Gate(limit, queue_limit, ADMISSION_QUEUE_TIMEOUT_MS / 1000)
+    for name, (limit, queue_limit) in CLASS_LIMITS.items()
+}
+rate_limiter = TokenBucket(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST) if RATE_LIMIT_PER_SECOND > 0 else None
+
+def check_rate(user_id):
+    """Raises 429 with Retry-After when the user is over RATE_LIMIT_PER_SECOND."""
+    if rate_limiter is None:
+        return
+    wait = rate_limiter.take(user_id)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, int(wait + 0.999)))},
+        )
+
+_BUSY_BODY = json.dumps({"detail": "Server is busy, please retry"}).encode()
+
+class AdmissionMiddleware:
+    """Holds a slot of the request's route class for the whole response (including streamed bodies)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        gate = gates[route_class]
+        try:
+            await gate.acquire()
+        except Rejected:
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_BUSY_BODY)).encode()),
+                    (b"retry-after", ADMISSION_RETRY_AFTER_SECONDS.encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _BUSY_BODY})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+def render() -> str:
+    """Gate state in the Prometheus text format, appended to /metrics."""
+    lines = [
+        "# HELP admission_active Requests holding a slot, by route class.",
+        "# TYPE admission_active gauge",
+    ]
+    lines += [f'admission_active{{class="{name}"}} {gate.active}' for name, gate in gates.items()]
+    lines += ["# HELP admission_waiting Requests queued for a slot, by route class.", "# TYPE admission_waiting gauge"]
+    lines += [f'admission_waiting{{class="{name}"}} {gate.waiting}' for name, gate in gates.items()]
+    lines += ["# HELP admission_rejected_total Requests answered 503 by admission control.", "# TYPE admission_rejected_total counter"]
+    lines += [f'admission_rejected_total{{class="{name}"}} {gate.rejected}' for name, gate in gates.items()]
+    return "\n".join(lines) + "\n"
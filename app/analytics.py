@@ -0,0 +1,168 @@
+# in app/analytics.py
+
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.orm import Session
+from app import models
+
+# Analytics over a user's whole history, never through ORM objects.
+#
+# Time series are a GROUP BY in Postgres (date_trunc per hour/day and type),
+# served by the (user_id, created_at, id) index, so only one row per bucket
+# comes back. Distributions need every result: count/min/max come from one
+# aggregate query, then the result column is streamed in fixed-size chunks
+# into NumPy. Memory is bounded either way:
+#   - up to ANALYTICS_EXACT_MAX_ROWS results are kept in one float64 array
+#     and percentiles are exact (np.percentile, linear interpolation);
+#   - beyond that each chunk is folded into a fixed ANALYTICS_SKETCH_BINS
+#     histogram and percentiles are interpolated from it, off by at most
+#     (max - min) / ANALYTICS_SKETCH_BINS.
+# The histogram in the response is exact in both cases.
+# Results of inf or NaN (Postgres float8 stores both) are left out of every
+# statistic and only counted, since they have no place on a histogram.
+
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", "50000"))
+ANALYTICS_EXACT_MAX_ROWS = int(os.getenv("ANALYTICS_EXACT_MAX_ROWS", "1000000"))
+ANALYTICS_SKETCH_BINS = int(os.getenv("ANALYTICS_SKETCH_BINS", "65536"))
+MAX_TIME_BUCKETS = 10000
+MAX_HISTOGRAM_BINS = 1000
+
+BUCKETS = ("hour", "day")
+
+def _filters(user_id: int, op_type: str = None, start: datetime = None, end: datetime = None):
+    Calc = models.Calculation
+    conditions = [Calc.user_id == user_id]
+    if op_type is not None:
+        conditions.append(Calc.type == op_type)
+    if start is not None:
+        conditions.append(Calc.created_at >= start)
+    if end is not None:
+        conditions.append(Calc.created_at < end)
+    return conditions
+
+def _finite(column):
+    # Postgres orders NaN above every number, so this excludes NaN, inf and -inf
+    return column.between(-sys.float_info.max, sys.float_info.max)
+
+def time_series(db: Session, user_id: int, bucket: str = "hour", op_type: str = None,
+                start: datetime = None, end: datetime = None):
+    """
+    Count of calculations and sum/min/max of their finite results per UTC
+    hour or day and operation type.
+    Returns (points, truncated); at most MAX_TIME_BUCKETS points, oldest first.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+    Calc = models.Calculation
+    # Literal SQL (bucket is whitelisted above) so the SELECT and GROUP BY
+    # expressions are identical, which bind parameters would not be
+    bucket_expr = func.date_trunc(literal_column(f"'{bucket}'"), Calc.created_at, literal_column("'UTC'"))
+    finite = _finite(Calc.result)
+    query = (
+        select(
+            bucket_expr.label("bucket"), Calc.type, func.count().label("count"),
+            func.sum(Calc.result).filter(finite).label("result_sum"),
+            func.min(Calc.result).filter(finite).label("result_min"),
+            func.max(Calc.result).filter(finite).label("result_max"),
+        )
+        .where(*_filters(user_id, op_type, start, end))
+        .group_by(bucket_expr, Calc.type)
+        .order_by(bucket_expr, Calc.type)
+        .limit(MAX_TIME_BUCKETS + 1)
+    )
+    rows = db.execute(query).all()
+    points = [row._asdict() for row in rows[:MAX_TIME_BUCKETS]]
+    return points, len(rows) > MAX_TIME_BUCKETS
+
+def _result_chunks(db: Session, conditions):
+    """Yields the result column as float64 arrays of up to ANALYTICS_CHUNK_SIZE values."""
+    import numpy as np
+    query = select(models.Calculation.result).where(*conditions)
+    result = db.execute(query.execution_options(yield_per=ANALYTICS_CHUNK_SIZE))
+    for rows in result.partitions():
+        yield np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+
+def _sketch_percentiles(counts, edges, total: int, percentiles):
+    """
+    Percentiles from a fine histogram. Like np.percentile's default, each one
+    interpolates between the two order statistics around its rank; each of
+    those is placed inside the bin that holds it, so the error stays below
+    one bin width.
+    """
+    import numpy as np
+    cumulative = np.cumsum(counts)
+
+    def order_statistic(k: int) -> float:
+        i = int(np.searchsorted(cumulative, k, side="right"))
+        before = cumulative[i - 1] if i else 0
+        return float(edges[i] + (edges[i + 1] - edges[i]) * (k - before + 0.5) / counts[i])
+
+    values = []
+    for q in percentiles:
+        rank = q / 100 * (total - 1)
+        low = int(rank)
+        value = order_statistic(low)
+        if rank > low:
+            value += (order_statistic(low + 1) - value) * (rank - low)
+        values.append(value)
+    return values
+
+def distribution(db: Session, user_id: int, percentiles=(50, 90, 99), bins: int = 20,
+                 op_type: str = None, start: datetime = None, end: datetime = None):
+    """
+    Count, min, max, mean, percentiles and a `bins`-bucket histogram of the
+    user's finite results, plus how many results were inf or NaN.
+    """
+    import numpy as np
+    Calc = models.Calculation
+    conditions = _filters(user_id, op_type, start, end)
+    finite = _finite(Calc.result)
+    everything, count, low, high, total = db.execute(
+        select(func.count(), func.count().filter(finite), func.min(Calc.result).filter(finite),
+               func.max(Calc.result).filter(finite), func.sum(Calc.result).filter(finite)).where(*conditions)
+    ).one()
+    non_finite = everything - count
+    conditions.append(finite)
+    if not count:
+        return {"count": 0, "non_finite": non_finite, "result_min": None, "result_max": None, "mean": None,
+                "percentiles": {}, "histogram": {"edges": [], "counts": []}, "exact": True}
+
+    # Equal min and max: widen the range like np.histogram does
+    span = (low - 0.5, high + 0.5) if low == high else (low, high)
+    edges = np.linspace(span[0], span[1], bins + 1)
+    histogram = np.zeros(bins, dtype=np.int64)
+    exact = count <= ANALYTICS_EXACT_MAX_ROWS
+
+    if exact:
+        values = np.empty(count, dtype=np.float64)
+        filled = 0
+        for chunk in _result_chunks(db, conditions):
+            values[filled:filled + len(chunk)] = chunk[:count - filled]  # rows added since the count are ignored
+            filled = min(count, filled + len(chunk))
+        values = values[:filled]
+        histogram += np.histogram(values, bins=edges)[0]
+        points = np.percentile(values, percentiles).tolist() if filled else []
+    else:
+        sketch_edges = np.linspace(span[0], span[1], ANALYTICS_SKETCH_BINS + 1)
+        sketch = np.zeros(ANALYTICS_SKETCH_BINS, dtype=np.int64)
+        filled = 0
+        for chunk in _result_chunks(db, conditions):
+            # Values outside [min, max] (written since the aggregate query) go to the end bins
+            chunk = np.clip(chunk, span[0], span[1])
+            histogram += np.histogram(chunk, bins=edges)[0]
+            sketch += np.histogram(chunk, bins=sketch_edges)[0]
+            filled += len(chunk)
+        points = _sketch_percentiles(sketch, sketch_edges, int(sketch.sum()), percentiles) if filled else []
+
+    return {
+        "count": count,
+        "non_finite": non_finite,
+        "result_min": low,
+        "result_max": high,
+        "mean": total / count,
+        "percentiles": {f"p{q:g}": value for q, value in zip(percentiles, points)},
+        "histogram": {"edges": edges.tolist(), "counts": histogram.tolist()},
+        "exact": exact,
+    }
@@ -0,0 +1,431 @@
+# in app/archive.py
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from itertools import repeat
+from typing import TYPE_CHECKING
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select, tuple_
+from app import encoding, models
+
+# NumPy is imported on first use, like in app/logic.py
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tiered storage: calculations older than ARCHIVE_AFTER_DAYS move out of the
+# calculations table into compressed columnar files, one directory per user
+# under ARCHIVE_DIR (shared by every worker and shard):
+#
+#   <ARCHIVE_DIR>/<user_id>/00000001.seg, 00000002.seg, ...
+#
+# A segment is immutable once written. It holds the rows of one archive run in
+# (created_at, id) order, in blocks of ARCHIVE_BLOCK_ROWS rows; each block
+# stores every column as a zlib-compressed typed array (id int64, a/b/result
+# float64, type uint8 code, created_at int64 microseconds since the epoch),
+# plus the expression/variables/exact digits of the rows that have them, as
+# JSON. A JSON footer describes the blocks (offsets, key and id ranges, types
+# present) and keeps per-type count/sum/min/max for the stats. Readers mmap
+# the file and decompress only the blocks a request needs.
+#
+# Every archived row comes before every hot row in (created_at, id) order, so
+# a user's history is their segments followed by the calculations table read
+# after the last archived key. The archive run commits a segment (rename)
+# before deleting its rows, and readers list the segments before and after
+# their query (see app/history.py), so a run in between can neither hide nor
+# duplicate rows. Archived calculations are read-only.
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "8192"))
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", "1000000"))  # per archive run and user
+ARCHIVE_OPEN_SEGMENTS = int(os.getenv("ARCHIVE_OPEN_SEGMENTS", "1024"))     # mmapped footers kept per process
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+MAGIC = b"CALCSEG1"
+_TRAILER = struct.Struct("<Q8s")  # footer length, magic
+COLUMNS = (("id", "<i8"), ("a", "<f8"), ("b", "<f8"), ("type", "u1"), ("result", "<f8"), ("created_at", "<i8"))
+_DTYPES = dict(COLUMNS)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Same fields (and order) as the hot rows the list routes encode
+ArchivedRow = namedtuple("ArchivedRow", encoding.CALCULATION_COLUMNS)
+
+def to_micros(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // _MICROSECOND
+
+def from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+def user_dir(user_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, str(user_id))
+
+# --- Reading ---
+
+class Segment:
+    """One mmapped segment file. Blocks are decompressed on demand."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        length, magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a calculation archive segment")
+        end = len(self._map) - _TRAILER.size
+        footer = json.loads(self._map[end - length:end])
+        self.types = footer["types"]
+        self.blocks = footer["blocks"]
+        self.aggregates = footer["aggregates"]  # type -> [count, sum, min, max]
+        self.rows = footer["rows"]
+        self.last_key = tuple(footer["last_key"])  # (created_at micros, id)
+
+    def _array(self, block: dict, name: str):
+        import numpy as np
+        offset, length = block["columns"][name]
+        with memoryview(self._map)[offset:offset + length] as view:
+            return np.frombuffer(zlib.decompress(view), dtype=_DTYPES[name])
+
+    def read(self, block: dict) -> dict:
+        columns = {name: self._array(block, name) for name, _ in COLUMNS}
+        columns["extras"] = {}
+        if block["extras"] is not None:
+            offset, length = block["extras"]
+            with memoryview(self._map)[offset:offset + length] as view:
+                columns["extras"] = {int(i): extra for i, extra in json.loads(zlib.decompress(view)).items()}
+        return columns
+
+    def build_rows(self, columns: dict, indexes, user_id: int) -> list:
+        """ArchivedRows for the given positions of a decoded block."""
+        import numpy as np
+        n = len(indexes)
+        types = np.array(self.types, dtype=object)[columns["type"][indexes]].tolist()
+        # datetime64 -> datetime in C; only the time zone is set per row
+        created = [value.replace(tzinfo=timezone.utc)
+                   for value in columns["created_at"][indexes].astype("datetime64[us]").tolist()]
+        expressions, variables, exact = [None] * n, [None] * n, [None] * n
+        extras = columns["extras"]
+        if extras:
+            for k, i in enumerate(indexes.tolist()):
+                if i in extras:
+                    # Older segments have no exact digits: [expression, variables]
+                    expressions[k], variables[k], exact[k] = (extras[i] + [None])[:3]
+        return list(map(ArchivedRow._make, zip(
+            columns["a"][indexes].tolist(), columns["b"][indexes].tolist(), types, expressions, variables,
+            columns["id"][indexes].tolist(), columns["result"][indexes].tolist(), exact, repeat(user_id, n), created,
+        )))
+
+_open = OrderedDict()  # path -> Segment, least recently used first
+_open_lock = threading.Lock()
+
+def _segment(path: str) -> Segment:
+    with _open_lock:
+        segment = _open.get(path)
+        if segment is not None:
+            _open.move_to_end(path)
+            return segment
+    segment = Segment(path)
+    with _open_lock:
+        _open[path] = segment
+        while len(_open) > ARCHIVE_OPEN_SEGMENTS:
+            # Not closed here: a reader may still use it; the mmap goes with the last reference
+            _open.popitem(last=False)
+    return segment
+
+def segment_names(user_id: int) -> tuple:
+    try:
+        return tuple(sorted(name for name in os.listdir(user_dir(user_id)) if name.endswith(".seg")))
+    except FileNotFoundError:
+        return ()
+
+class Snapshot:
+    """A user's committed segments at one moment; reads see exactly these."""
+
+    def __init__(self, user_id: int, names: tuple):
+        self.user_id = user_id
+        self.names = names
+        self.segments = [_segment(os.path.join(user_dir(user_id), name)) for name in names]
+        self.count = sum(segment.rows for segment in self.segments)
+        last = self.segments[-1].last_key if self.segments else None
+        # Hot rows are read strictly after this (created_at, id)
+        self.last_key = (from_micros(last[0]), last[1]) if last else None
+
+    def __bool__(self):
+        return bool(self.segments)
+
+    def changed(self) -> bool:
+        """True when an archive run committed a segment since this snapshot was taken."""
+        return segment_names(self.user_id) != self.names
+
+    def batches(self, after: tuple = None, op_type: str = None, created_after: datetime = None,
+                created_before: datetime = None, skip: int = 0, batch_rows: int = 512):
+        """
+        Yields lists of ArchivedRows in (created_at, id) order, for rows after
+        the (created_at, id) key `after` and within the filters, leaving out
+        the first `skip` of them. Blocks outside the range are not decompressed.
+        """
+        import numpy as np
+        after_key = (to_micros(after[0]), after[1]) if after is not None else None
+        low = to_micros(created_after) if created_after is not None else None
+        high = to_micros(created_before) if created_before is not None else None
+        filtered = after_key is not None or low is not None or high is not None or op_type is not None
+        for segment in self.segments:
+            code = segment.types.index(op_type) if op_type in segment.types else None
+            if op_type is not None and code is None:
+                continue
+            for block in segment.blocks:
+                # 1. Whole blocks out of range, by their footer entry only
+                if after_key is not None and tuple(block["last"]) <= after_key:
+                    continue
+                if low is not None and block["last"][0] < low:
+                    continue
+                if high is not None and block["first"][0] >= high:
+                    return
+                if code is not None and code not in block["types"]:
+                    continue
+                if not filtered and skip >= block["rows"]:
+                    skip -= block["rows"]
+                    continue
+                # 2. Row-level filters on the decoded columns
+                columns = segment.read(block)
+                mask = np.ones(block["rows"], dtype=bool)
+                created, ids = columns["created_at"], columns["id"]
+                if after_key is not None:
+                    mask &= (created > after_key[0]) | ((created == after_key[0]) & (ids > after_key[1]))
+                if low is not None:
+                    mask &= created >= low
+                if high is not None:
+                    mask &= created < high
+                if code is not None:
+                    mask &= columns["type"] == code
+                indexes = np.flatnonzero(mask)
+                if skip:
+                    taken = min(skip, len(indexes))
+                    indexes, skip = indexes[taken:], skip - taken
+                for start in range(0, len(indexes), batch_rows):
+                    yield segment.build_rows(columns, indexes[start:start + batch_rows], self.user_id)
+
+    def take(self, limit: int, **filters) -> list:
+        """The first `limit` rows of batches(**filters)."""
+        rows = []
+        if limit <= 0:
+            return rows
+        for batch in self.batches(batch_rows=min(limit, 512), **filters):
+            rows.extend(batch)
+            if len(rows) >= limit:
+                return rows[:limit]
+        return rows
+
+    def get(self, calc_id: int):
+        """One archived row by id, or None. Only blocks whose id range covers it are read."""
+        import numpy as np
+        for segment in self.segments:
+            for block in segment.blocks:
+                if block["min_id"] <= calc_id <= block["max_id"]:
+                    columns = segment.read(block)
+                    found = np.flatnonzero(columns["id"] == calc_id)
+                    if len(found):
+                        return segment.build_rows(columns, found[:1], self.user_id)[0]
+        return None
+
+    def aggregates(self) -> dict:
+        """type -> [count, sum, min, max] over every archived row, from the footers."""
+        return merge_aggregates(segment.aggregates for segment in self.segments)
+
+def snapshot(user_id: int) -> Snapshot:
+    return Snapshot(user_id, segment_names(user_id))
+
+def merge_aggregates(parts) -> dict:
+    merged = {}
+    for part in parts:
+        for op_type, (count, total, low, high) in part.items():
+            g = merged.setdefault(op_type, [0, 0.0, None, None])
+            g[0] += count
+            g[1] += total
+            g[2] = low if g[2] is None else min(g[2], low)
+            g[3] = high if g[3] is None else max(g[3], high)
+    return merged
+
+def archived_users() -> list:
+    try:
+        return sorted(int(name) for name in os.listdir(ARCHIVE_DIR) if name.isdigit())
+    except FileNotFoundError:
+        return []
+
+# --- Writing ---
+
+class SegmentWriter:
+    """Writes one segment to a temporary file; commit() makes it visible."""
+
+    def __init__(self, user_id: int, name: str, block_rows: int = None):
+        directory = user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name)
+        self.tmp_path = self.path + ".tmp"
+        self.block_rows = block_rows or ARCHIVE_BLOCK_ROWS
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.types, self._codes = [], {}
+        self.blocks, self.aggregates = [], {}
+        self.pending = []
+        self.count = 0
+        self.last_key = None  # (created_at, id) of the last row written
+
+    def add(self, rows):
+        """Rows with the CALCULATION_COLUMNS attributes, in (created_at, id) order."""
+        for row in rows:
+            self.pending.append(row)
+            if len(self.pending) >= self.block_rows:
+                self._write_block()
+
+    def _code(self, op_type: str) -> int:
+        code = self._codes.get(op_type)
+        if code is None:
+            code = self._codes[op_type] = len(self.types)
+            self.types.append(op_type)
+        return code
+
+    def _write(self, data: bytes) -> list:
+        data = zlib.compress(data, ARCHIVE_COMPRESSION_LEVEL)
+        self.file.write(data)
+        location = [self.offset, len(data)]
+        self.offset += len(data)
+        return location
+
+    def _write_block(self):
+        import numpy as np
+        rows, self.pending = self.pending, []
+        if not rows:
+            return
+        n = len(rows)
+        arrays = {
+            "id": np.fromiter((row.id for row in rows), _DTYPES["id"], n),
+            "a": np.fromiter((row.a for row in rows), _DTYPES["a"], n),
+            "b": np.fromiter((row.b for row in rows), _DTYPES["b"], n),
+            "type": np.fromiter((self._code(row.type) for row in rows), _DTYPES["type"], n),
+            "result": np.fromiter((row.result for row in rows), _DTYPES["result"], n),
+            "created_at": np.fromiter((to_micros(row.created_at) for row in rows), _DTYPES["created_at"], n),
+        }
+        extras = {i: [row.expression, row.variables, row.exact] for i, row in enumerate(rows)
+                  if row.expression is not None or row.variables is not None or row.exact is not None}
+        ids, created = arrays["id"], arrays["created_at"]
+        self.blocks.append({
+            "rows": n,
+            "first": [int(created[0]), int(ids[0])],
+            "last": [int(created[-1]), int(ids[-1])],
+            "min_id": int(ids.min()),
+            "max_id": int(ids.max()),
+            "types": sorted(set(arrays["type"].tolist())),
+            "columns": {name: self._write(arrays[name].tobytes()) for name, _ in COLUMNS},
+            "extras": self._write(json.dumps(extras).encode()) if extras else None,
+        })
+        self.aggregates = merge_aggregates([self.aggregates, {
+            op_type: [len(values), float(values.sum()), float(values.min()), float(values.max())]
+            for op_type, values in (
+                (self.types[code], arrays["result"][arrays["type"] == code]) for code in set(arrays["type"].tolist())
+            )
+        }])
+        self.count += n
+        self.last_key = (rows[-1].created_at, rows[-1].id)
+
+    def close(self):
+        """Writes the last block and the footer, and syncs the file."""
+        self._write_block()
+        footer = json.dumps({
+            "types": self.types,
+            "blocks": self.blocks,
+            "aggregates": self.aggregates,
+            "rows": self.count,
+            "last_key": [to_micros(self.last_key[0]), self.last_key[1]] if self.last_key else None,
+        }).encode()
+        self.file.write(footer)
+        self.file.write(_TRAILER.pack(len(footer), MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def commit(self):
+        os.replace(self.tmp_path, self.path)
+        directory = os.open(os.path.dirname(self.path), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+# --- Archive runs (archive_calculations.py) ---
+
+def archive_user(engine, user_id: int, cutoff: datetime, segment_rows: int = None, attempts: int = 3) -> int:
+    """
+    Moves the user's calculations created before `cutoff` from the database
+    behind `engine` (their shard) into new segments. Returns the number of rows archived.
+
+    1. Read up to `segment_rows` rows after the last archived key into a new
+       segment, remembering the user's calc_version.
+    2. Lock the user's row. If calc_version moved (they edited or deleted
+       something meanwhile), drop the segment and read again.
+    3. Commit the segment, then delete its rows in the same locked transaction.
+    """
+    segment_rows = segment_rows or ARCHIVE_SEGMENT_ROWS
+    calcs, users = models.Calculation.__table__, models.User.__table__
+    columns = [calcs.c[name] for name in encoding.CALCULATION_COLUMNS]
+    key = tuple_(calcs.c.created_at, calcs.c.id)
+    archived = 0
+    while attempts:
+        current = snapshot(user_id)
+        if current.last_key is not None:
+            # Left over by a run that stopped between its commit and its delete
+            with engine.begin() as conn:
+                conn.execute(delete(calcs).where(calcs.c.user_id == user_id, key <= tuple_(*current.last_key)))
+
+        # 1. Read into a new segment
+        name = f"{int(current.names[-1].split('.')[0]) + 1 if current.names else 1:08d}.seg"
+        writer = SegmentWriter(user_id, name)
+        try:
+            with engine.connect() as conn:
+                version = conn.execute(select(users.c.calc_version).where(users.c.id == user_id)).scalar()
+                query = select(*columns).where(calcs.c.user_id == user_id, calcs.c.created_at < cutoff)
+                if current.last_key is not None:
+                    query = query.where(key > tuple_(*current.last_key))
+                result = conn.execute(query.order_by(calcs.c.created_at, calcs.c.id).limit(segment_rows)
+                                      .execution_options(yield_per=ARCHIVE_BLOCK_ROWS))
+                for rows in result.partitions():
+                    writer.add(rows)
+            if not writer.count and not writer.pending:
+                writer.abort()
+                return archived
+            writer.close()
+
+            # 2. + 3. Check, commit, delete
+            with engine.begin() as conn:
+                locked = conn.execute(select(users.c.calc_version).where(users.c.id == user_id).with_for_update()).scalar()
+                if locked != version:
+                    writer.abort()
+                    attempts -= 1
+                    continue
+                writer.commit()
+                conn.execute(delete(calcs).where(calcs.c.user_id == user_id, key <= tuple_(*writer.last_key)))
+        except BaseException:
+            writer.abort()
+            raise
+        archived += writer.count
+        if writer.count < segment_rows:
+            return archived
+    logger.warning("User %s kept changing their history; archived %s rows, the rest next run", user_id, archived)
+    return archived
@@ -0,0 +1,121 @@
+# in app/compute.py
+
+import asyncio
+import math
+import os
+import threading
+import time
+from app.process_pools import spawn_context
+
+try:
+    import resource
+except ImportError:  # Windows: only the wall-clock timeout applies there
+    resource = None
+
+# Heavy operations (logic.HEAVY_OPERATIONS) run in a small process pool, like
+# bcrypt in app/hashing.py, so a slow one never holds up a request worker.
+# Each job may use COMPUTE_CPU_SECONDS of CPU time: past that the kernel
+# sends its worker SIGXCPU, which ends the process, and the pool starts a
+# fresh one. Callers stop waiting after COMPUTE_TIMEOUT_SECONDS and get
+# ComputeTimeout, so a runaway job costs one worker for a bounded time.
+# This module is also what the pool processes import, so it stays small.
+
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Most jobs allowed to be running or waiting at once; beyond that callers get
+# ComputeBusy right away instead of queueing.
+COMPUTE_QUEUE_LIMIT = int(os.getenv("COMPUTE_QUEUE_LIMIT", str(COMPUTE_WORKERS * 4)))
+COMPUTE_CPU_SECONDS = int(os.getenv("COMPUTE_CPU_SECONDS", "2"))
+# Wall-clock limit on the caller's wait, time spent queued included
+COMPUTE_TIMEOUT_SECONDS = float(os.getenv("COMPUTE_TIMEOUT_SECONDS", str(COMPUTE_CPU_SECONDS * 2 + 1)))
+
+# --- Inside the pool processes ---
+
+def _init_worker():
+    if resource is not None:
+        # A worker killed by SIGXCPU would otherwise leave a core file behind
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+def _run(deadline: float, cpu_seconds: int, fn, args):
+    """Runs one job under its CPU-time limit. Skipped if its caller has given up already."""
+    if time.time() > deadline:
+        return None
+    if resource is not None:
+        # RLIMIT_CPU counts the whole process, so the limit is moved along per job
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    return fn(*args)
+
+# --- Bounded Pool ---
+
+class ComputeBusy(Exception):
+    """Raised when COMPUTE_QUEUE_LIMIT jobs are already running or waiting."""
+
+class ComputeTimeout(Exception):
+    """Raised when a job has not finished within the pool's timeout."""
+
+def _settle(future, result=None, error=None):
+    if future.done():  # the caller timed out
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class ComputePool:
+    def __init__(self, workers: int = COMPUTE_WORKERS, queue_limit: int = COMPUTE_QUEUE_LIMIT,
+                 cpu_seconds: int = COMPUTE_CPU_SECONDS, timeout: float = COMPUTE_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # multiprocessing.Pool, not ProcessPoolExecutor: it replaces a killed
+            # worker and keeps going, where the executor would break for everyone
+            self._pool = spawn_context().Pool(self.workers, initializer=_init_worker)
+        return self._pool
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise ComputeBusy()
+            self._pending += 1
+            pool = self._get_pool()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def deliver(result=None, error=None):
+            # Called on the pool's result thread
+            try:
+                loop.call_soon_threadsafe(_settle, future, result, error)
+            except RuntimeError:
+                pass  # loop already closed
+
+        try:
+            pool.apply_async(_run, (time.time() + self.timeout, self.cpu_seconds, fn, args),
+                             callback=deliver, error_callback=lambda error: deliver(error=error))
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ComputeTimeout() from None
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+pool = ComputePool()
@@ -1,23 +1,31 @@
 # in app/crud.py
 
-import os # Required to support the CI_SKIP_HASH check in security.py
+from collections import defaultdict
+from typing import List
+from datetime import datetime
+from sqlalchemy import ARRAY, Integer, any_, bindparam, delete, insert, select, tuple_, update
 from sqlalchemy.orm import Session
-from app import models, schemas, security 
-from app.logic import get_operation_func # Imports the calculation factory
+from app import models, schemas, security, pagination, stats, encoding
+from app.logic import HEAVY_OPERATIONS, calculate, calculate_exact, evaluate_batch # Imports the calculation factory
 
 # --- User CRUD ---
 
+def get_user(db: Session, user_id: int):
+    return db.get(models.User, user_id)
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
     """Hashes the password (or uses bypass hash) and creates a new user record."""
     
-    # Calls the hashing function which contains the CI bypass logic
-    hashed_password = security.get_password_hash(user.password)
+    # Calls the hashing function which contains the CI bypass logic.
+    # Routes hash ahead of time in the hashing pool so bcrypt never runs here.
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(user.password)
     
     db_user = models.User(
         username=user.username,
@@ -30,24 +38,258 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Stores a re-hashed password (e.g. after BCRYPT_ROUNDS changed)."""
+    db.query(models.User).filter(models.User.id == user_id).update({"password_hash": hashed_password})
+    db.commit()
+
 # --- Calculation CRUD ---
 
-def create_calculation(db: Session, calc: schemas.CalculationCreate, user_id: int):
+def _bump_versions(user_ids):
+    """
+    CTE that bumps calc_version (the ETag source, see etags.py) of the given
+    users. Attached to the write statement itself, so it costs no extra round
+    trip and is rolled back with the write. An array parameter rather than
+    IN (...) so it also works on executemany inserts.
+    """
+    users = models.User.__table__
+    ids = bindparam("bump_user_ids", sorted(set(user_ids)), type_=ARRAY(Integer))
+    return (
+        update(users)
+        .where(users.c.id == any_(ids))
+        .values(calc_version=users.c.calc_version + 1)
+        .cte("bumped_versions")
+    )
+
+def get_calc_version(db: Session, user_id: int):
+    """The user's calc_version: one primary-key lookup, for If-None-Match checks."""
+    return db.execute(select(models.User.calc_version).where(models.User.id == user_id)).scalar()
+
+def _evaluate(calc: schemas.CalculationCreate):
+    """(result, exact) computed here. Routes compute heavy operations in app.compute's pool and pass them in."""
+    if calc.type in HEAVY_OPERATIONS:
+        return calculate_exact(calc.type, calc.a, calc.b, calc.precision)
+    return calculate(calc.type, calc.a, calc.b, calc.expression, calc.variables), None
+
+def calculation_row(calc: schemas.CalculationCreate, user_id: int, computed=None) -> dict:
+    """Computes the result using the factory (unless `computed` is given) and returns the column values of the new row."""
+    result, exact = computed or _evaluate(calc)
+    return {
+        "a": calc.a,
+        "b": calc.b,
+        "type": calc.type.value,
+        "expression": calc.expression,
+        "variables": calc.variables,
+        "result": result,
+        "exact": exact,
+        "user_id": user_id,
+    }
+
+def create_calculation(db: Session, calc: schemas.CalculationCreate, user_id: int, computed=None):
     """
     Computes the result using the factory and saves the calculation record.
+    INSERT ... RETURNING hands back the whole row (id, created_at included),
+    so no refresh SELECT is needed.
     """
-    operation_func = get_operation_func(calc.type)
-    result = operation_func(calc.a, calc.b)
+    values = calculation_row(calc, user_id, computed)
     
-    db_calculation = models.Calculation(
-        a=calc.a,
-        b=calc.b,
-        type=calc.type,
-        result=result,
-        user_id=user_id
-    )
+    calculations = models.Calculation.__table__
+    db_calculation = db.execute(
+        insert(calculations).values(**values).returning(*calculations.c)
+        .add_cte(_bump_versions([user_id]))
+    ).one()
     
-    db.add(db_calculation)
+    stats.record_added(db, user_id, [(values["type"], values["result"])])
+    db.commit()
+    return db_calculation
+
+def insert_calculation_group(db: Session, rows: List[dict]):
+    """
+    Saves rows from calculation_row (any mix of users) with one INSERT ... RETURNING
+    and one commit. Used by group commit. Returns the stored rows in input order.
+    """
+    calculations = models.Calculation.__table__
+    stored = db.execute(
+        insert(calculations).returning(*calculations.c, sort_by_parameter_order=True)
+        .add_cte(_bump_versions(row["user_id"] for row in rows)),
+        rows,
+    ).all()
+    by_user = defaultdict(list)
+    for row in stored:
+        by_user[row.user_id].append((row.type, row.result))
+    # Same user order in every group, so concurrent groups cannot deadlock on the stats rows
+    for user_id in sorted(by_user):
+        stats.record_added(db, user_id, by_user[user_id])
+    db.commit()
+    return stored
+
+def _calculation_columns():
+    return [getattr(models.Calculation, name) for name in encoding.CALCULATION_COLUMNS]
+
+def get_calculations(db: Session, user_id: int, skip: int = 0, limit: int = 100, after: tuple = None):
+    """
+    Returns column tuples in CalculationRead field order (no ORM objects), for encoding.encode_calculations.
+    `after` limits them to rows after a (created_at, id) key, e.g. the last archived one.
+    """
+    Calc = models.Calculation
+    query = select(*_calculation_columns()).where(Calc.user_id == user_id)
+    if after is not None:
+        query = query.where(tuple_(Calc.created_at, Calc.id) > tuple_(*after))
+    return db.execute(query.order_by(Calc.created_at, Calc.id).offset(skip).limit(limit)).all()
+
+def get_calculations_page(db: Session, user_id: int, limit: int = 100, after: tuple = None,
+                          op_type: str = None, created_after: datetime = None, created_before: datetime = None):
+    """
+    Keyset pagination over (created_at, id), served by the
+    (user_id, created_at, id) index. `after` is a decoded cursor.
+    Returns (rows, next_cursor); rows are column tuples like get_calculations.
+    """
+    Calc = models.Calculation
+    query = select(*_calculation_columns()).where(Calc.user_id == user_id)
+    if created_after is not None:
+        query = query.where(Calc.created_at >= created_after)
+    if created_before is not None:
+        query = query.where(Calc.created_at < created_before)
+    if after is not None:
+        query = query.where(tuple_(Calc.created_at, Calc.id) > tuple_(*after))
+    if op_type is not None:
+        query = query.where(Calc.type == op_type)
+
+    # Fetch one extra row to learn whether another page exists
+    rows = db.execute(query.order_by(Calc.created_at, Calc.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+def get_calculation(db: Session, calc_id: int, user_id: int):
+    """
+    Returns the calculation only if it belongs to the user, as a column tuple
+    plus the user's calc_version (joined in, so the ETag costs no extra query).
+    """
+    Calc = models.Calculation
+    return db.execute(
+        select(*_calculation_columns(), models.User.calc_version)
+        .join(models.User, models.User.id == Calc.user_id)
+        .where(Calc.id == calc_id, Calc.user_id == user_id)
+    ).first()
+
+def update_calculation(db: Session, calc_id: int, calc: schemas.CalculationCreate, user_id: int, computed=None):
+    """
+    Recomputes and saves the user's calculation. Returns None if it is not theirs.
+    Ownership check, write, version bump and read-back are one UPDATE ... FROM
+    ... RETURNING; the locked sub-select also hands back the old type/result
+    for the stats. When nothing matched, the rollback undoes the bump.
+    """
+    result, exact = computed or _evaluate(calc)
+
+    calculations = models.Calculation.__table__
+    old = (
+        select(
+            calculations.c.id,
+            calculations.c.type.label("old_type"),
+            calculations.c.result.label("old_result"),
+        )
+        .where(calculations.c.id == calc_id, calculations.c.user_id == user_id)
+        .with_for_update()
+        .subquery()
+    )
+    row = db.execute(
+        update(calculations)
+        .where(calculations.c.id == old.c.id)
+        .values(
+            a=calc.a,
+            b=calc.b,
+            type=calc.type.value,
+            expression=calc.expression,
+            variables=calc.variables,
+            result=result,
+            exact=exact,
+        )
+        .returning(*calculations.c, old.c.old_type, old.c.old_result)
+        .add_cte(_bump_versions([user_id]))
+    ).first()
+    if row is None:
+        db.rollback()
+        return None
+
+    stats.record_replaced(db, user_id, (row.old_type, row.old_result), (row.type, row.result))
+    db.commit()
+    return row
+
+def delete_calculation(db: Session, calc_id: int, user_id: int) -> bool:
+    """Deletes the user's calculation with one owner-scoped DELETE ... RETURNING. Returns False if it is not theirs."""
+    calculations = models.Calculation.__table__
+    row = db.execute(
+        delete(calculations)
+        .where(calculations.c.id == calc_id, calculations.c.user_id == user_id)
+        .returning(calculations.c.type, calculations.c.result)
+        .add_cte(_bump_versions([user_id]))
+    ).first()
+    if row is None:
+        db.rollback()
+        return False
+
+    stats.record_removed(db, user_id, [(row.type, row.result)])
+    db.commit()
+    return True
+
+def create_calculations_batch(db: Session, items: List[schemas.CalculationBase], user_id: int):
+    """
+    Evaluates a whole batch with the vectorized operations and saves every
+    valid row with a single bulk INSERT and a single commit.
+    Returns one result dict per input item, in input order.
+    """
+    results, errors = evaluate_batch(
+        [item.a for item in items],
+        [item.b for item in items],
+        [item.type for item in items],
+        [item.expression for item in items],
+        [item.variables for item in items],
+    )
+
+    valid = [i for i, error in enumerate(errors) if error is None]
+    rows = [
+        {
+            "a": items[i].a,
+            "b": items[i].b,
+            "type": items[i].type.value,
+            "expression": items[i].expression,
+            "variables": items[i].variables,
+            "result": float(results[i]),
+            "user_id": user_id,
+        }
+        for i in valid
+    ]
+
+    ids = []
+    if rows:
+        # insertmanyvalues: one round trip per page of rows, ids in input order
+        calculations = models.Calculation.__table__
+        stmt = insert(calculations).returning(
+            calculations.c.id, sort_by_parameter_order=True
+        ).add_cte(_bump_versions([user_id]))
+        ids = db.scalars(stmt, rows).all()
+        stats.record_added(db, user_id, [(row["type"], row["result"]) for row in rows])
+        db.commit()
+
+    output = [{"index": i, "error": error} for i, error in enumerate(errors)]
+    for i, calc_id in zip(valid, ids):
+        output[i]["id"] = calc_id
+        output[i]["result"] = float(results[i])
+    return output
+
+
+def bulk_insert_calculations(db: Session, rows: List[dict], user_id: int):
+    """
+    Inserts already-computed rows (dicts of a, b, type, expression, variables,
+    result, user_id) with
+    one executemany, updates the stats and commits. Used by the bulk import.
+    """
+    if not rows:
+        return 0
+    db.execute(insert(models.Calculation.__table__).add_cte(_bump_versions([user_id])), rows)
+    stats.record_added(db, user_id, [(row["type"], row["result"]) for row in rows])
     db.commit()
-    db.refresh(db_calculation)
-    return db_calculation
\ No newline at end of file
+    return len(rows)
@@ -1,8 +1,19 @@
 # in app/database.py
+import asyncio
+import itertools
+import logging
 import os
+import threading
+import time
+from fastapi import Request
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
 
 # 1. --- Define Connection Details ---
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
@@ -20,14 +31,275 @@ else:
     # Use the default internal Docker service name "db" for normal running
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
+# Same database through the asyncpg driver, used when DATABASE_MODE=async
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# "sync": routes run their queries on the threadpool with a regular Session
+# "async": routes use an AsyncSession and never hold a thread while waiting on Postgres
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync")
+
+# Connection pool, per engine and per process. Admission control in
+# app/admission.py keeps the requests allowed to use the DB at once within
+# DB_POOL_SIZE + DB_MAX_OVERFLOW.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true") == "true"  # drop connections Postgres has closed
+# false: every session opens and closes its own connection. For the test suite
+# in async mode, where each TestClient call runs on its own event loop and an
+# asyncpg connection cannot move between loops.
+DB_POOL_ENABLED = os.getenv("DB_POOL_ENABLED", "true") == "true"
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+} if DB_POOL_ENABLED else {"poolclass": NullPool}
+
+# Read replicas (comma-separated URLs in the DATABASE_URL format; none by default).
+# See section 6.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))        # read-your-writes window
+REPLICA_EJECT_SECONDS = float(os.getenv("REPLICA_EJECT_SECONDS", "30"))    # how long a failed replica is skipped
+REPLICA_HEALTH_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_INTERVAL_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "0"))  # 0 = do not check replay lag
+
+class RoutingSession(Session):
+    """
+    Sends the statements of a request allowed to read from a replica (see
+    route_for_user) to that replica; everything else goes to the primary.
+    A session scoped to a shard (app/sharding.py) uses that shard only.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self.info.get("shard_bind")
+        if shard is not None:
+            return shard
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing:
+            return replica.bind
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
 # 3. --- Setup SQLAlchemy ---
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+    # expire_on_commit=False: returned rows are serialized after the session is done
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                           sync_session_class=RoutingSession)
+
+# GET/HEAD requests may read from a replica; anything else is a write
+READ_METHODS = ("GET", "HEAD")
+
+def get_db(request: Request):
+    db = SessionLocal(info={"read_only": request.method in READ_METHODS})
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        _after_request(db)
+
+async def get_async_db(request: Request):
+    db = AsyncSessionLocal(info={"read_only": request.method in READ_METHODS})
+    try:
+        yield db
+    finally:
+        await db.close()
+        _after_request(db)
+
+# 4. --- Route Dependency ---
+# Routes depend on get_session and pass it to run_db, so the same route code
+# works in both modes.
+get_session = get_async_db if DATABASE_MODE == "async" else get_db
+
+async def _run(db, fn, *args, **kwargs):
+    if isinstance(db, Session):
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    return await db.run_sync(fn, *args, **kwargs)
+
+async def run_db(db, fn, *args, **kwargs):
+    """
+    Runs a crud function, which is written against a plain Session.
+    With an AsyncSession it runs through run_sync, so every query is awaited
+    on the event loop; with a sync Session it runs on the threadpool.
+    A read that fails because its replica is unreachable is retried once on
+    the primary, and the replica is ejected.
+    """
+    try:
+        return await _run(db, fn, *args, **kwargs)
+    except (OperationalError, OSError):  # asyncpg raises a refused connection as it is
+        replica = db.info.get("replica")
+        if replica is None:
+            raise
+        logger.warning("Replica %s failed; ejected for %ss", replica.name, replicas.eject_seconds)
+        replicas.eject(replica)
+        db.info["replica"] = None
+        if isinstance(db, Session):
+            await run_in_threadpool(db.rollback)
+        else:
+            await db.rollback()
+        return await _run(db, fn, *args, **kwargs)
+
+async def release(db):
+    """
+    Ends the session's transaction and hands its connection back to the pool,
+    if it holds one. For routes that go on to wait for something else that
+    needs a pooled connection (e.g. group commit).
+    """
+    if not db.in_transaction():
+        return
+    if isinstance(db, Session):
+        await run_in_threadpool(db.close)
+    else:
+        await db.close()
+
+# 5. --- Startup / Shutdown ---
+# The app never waits on Postgres to start: main's lifespan calls ping() in
+# the background only to warm the pool, and dispose() on shutdown.
+
+def _ping():
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+
+async def ping():
+    """Opens (and pools) one connection. Raises if the database is unreachable."""
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+    else:
+        await run_in_threadpool(_ping)
+
+async def dispose():
+    engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    await replicas.dispose()
+
+# 6. --- Read Replicas ---
+# With DATABASE_REPLICA_URLS set, GET/HEAD requests of a signed-in user read
+# from a replica, picked round-robin per request; writes, and requests without
+# a user (register, login), always use the primary.
+#
+# Read-your-writes: a user's write requests pin them to the primary for
+# REPLICA_PIN_SECONDS after they finish, which must cover the replication lag.
+# Pins are kept per process, like the rest of the app's in-memory state.
+#
+# Health: a replica whose connection fails is ejected for REPLICA_EJECT_SECONDS
+# (the failed read is answered by the primary). A background check started by
+# main's lifespan also ejects replicas that are down or, with
+# REPLICA_MAX_LAG_SECONDS set, lagging behind, and brings them back once they
+# pass again. With every replica ejected, reads go to the primary.
+
+_LAG_QUERY = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = url.rpartition("@")[2]  # host:port/db, without credentials
+        self.engine = create_engine(url, **POOL_OPTIONS)
+        self.async_engine = None
+        if DATABASE_MODE == "async":
+            from sqlalchemy.ext.asyncio import create_async_engine
+            self.async_engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1), **POOL_OPTIONS)
+        self.ejected_until = 0.0
+
+    @property
+    def bind(self):
+        """What RoutingSession routes to (the async engine's sync facade in async mode)."""
+        return self.async_engine.sync_engine if self.async_engine is not None else self.engine
+
+    def _lag(self) -> float:
+        with self.engine.connect() as conn:
+            return float(conn.exec_driver_sql(_LAG_QUERY).scalar())
+
+class ReplicaSet:
+    def __init__(self, urls, pin_seconds: float = REPLICA_PIN_SECONDS, eject_seconds: float = REPLICA_EJECT_SECONDS,
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS, max_pins: int = 100000):
+        self.replicas = [Replica(url) for url in urls]
+        self.pin_seconds = pin_seconds
+        self.eject_seconds = eject_seconds
+        self.max_lag = max_lag
+        self.max_pins = max_pins
+        self._next = itertools.count()
+        self._pins = {}  # user id -> monotonic time the pin ends
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Next healthy replica, round-robin; None when there is none."""
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            if replica.ejected_until <= now:
+                return replica
+        return None
+
+    def eject(self, replica: Replica, seconds: float = None):
+        replica.ejected_until = time.monotonic() + (self.eject_seconds if seconds is None else seconds)
+
+    def pin(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._pins) >= self.max_pins:
+                self._pins = {uid: until for uid, until in self._pins.items() if until > now}
+            self._pins[user_id] = now + self.pin_seconds
+
+    def pinned(self, user_id: int) -> bool:
+        return self._pins.get(user_id, 0) > time.monotonic()
+
+    async def check(self):
+        """One health check of every replica: eject the failing or lagging ones, readmit the rest."""
+        for replica in self.replicas:
+            try:
+                lag = await run_in_threadpool(replica._lag)
+            except Exception as e:
+                logger.warning("Replica %s is down (%s)", replica.name, e)
+                self.eject(replica)
+                continue
+            if self.max_lag and lag > self.max_lag:
+                logger.warning("Replica %s is %.1fs behind", replica.name, lag)
+                self.eject(replica)
+            else:
+                replica.ejected_until = 0.0
+
+    async def monitor(self, interval: float = REPLICA_HEALTH_INTERVAL_SECONDS):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+
+replicas = ReplicaSet(DATABASE_REPLICA_URLS)
+
+def route_for_user(db, user_id: int):
+    """
+    Called once the request's user is known (before any of its reads).
+    Picks a replica for a read-only request unless the user just wrote.
+    """
+    db.info["user_id"] = user_id
+    if not replicas.replicas:
+        return
+    if not db.info.get("read_only"):
+        # Pinned already while writing: the response may reach the client
+        # before _after_request runs
+        replicas.pin(user_id)
+    elif not replicas.pinned(user_id):
+        db.info["replica"] = replicas.choose()
+
+def _after_request(db):
+    # A finished write pins its user to the primary (read-your-writes),
+    # counted from when it finished
+    user_id = db.info.get("user_id")
+    if user_id is not None and not db.info.get("read_only") and replicas.replicas:
+        replicas.pin(user_id)
@@ -0,0 +1,48 @@
+# in app/encoding.py
+
+import re
+from typing import List
+import orjson
+from pydantic import TypeAdapter
+from app import schemas
+
+# Fast JSON for calculation lists. The list routes select plain column tuples
+# and orjson turns them into the response bytes directly, skipping ORM objects
+# and per-row Pydantic validation. The bytes are the same as FastAPI would
+# produce from List[CalculationRead].
+
+# Same field order as CalculationRead
+CALCULATION_COLUMNS = ("a", "b", "type", "expression", "variables", "id", "result", "exact", "user_id", "created_at")
+
+# orjson writes 1e20 and 0.00001 where Pydantic writes 1e+20 and 1e-05. Output
+# that may contain such a float (a digit followed by "e", or "0.0000") is
+# encoded again by Pydantic; a false positive only costs speed.
+_PYTHON_ONLY_FLOAT = re.compile(rb"\de|0\.0000")
+
+_list_adapter = TypeAdapter(List[schemas.CalculationRead])
+
+_adapter = TypeAdapter(schemas.CalculationRead)
+
+def encode_calculations(rows) -> bytes:
+    """JSON array for rows of CALCULATION_COLUMNS, as List[CalculationRead] would render it."""
+    items = [
+        {"a": a, "b": b, "type": op_type, "expression": expression, "variables": variables,
+         "id": calc_id, "result": result, "exact": exact, "user_id": user_id, "created_at": created_at}
+        for a, b, op_type, expression, variables, calc_id, result, exact, user_id, created_at in rows
+    ]
+    data = orjson.dumps(items, option=orjson.OPT_UTC_Z)
+    if _PYTHON_ONLY_FLOAT.search(data):
+        data = _list_adapter.dump_json(_list_adapter.validate_python(items))
+    return data
+
+def encode_calculation(row) -> bytes:
+    """JSON object for one row with (at least) the CALCULATION_COLUMNS attributes, e.g. from RETURNING *."""
+    item = {name: getattr(row, name) for name in CALCULATION_COLUMNS}
+    data = orjson.dumps(item, option=orjson.OPT_UTC_Z)
+    if _PYTHON_ONLY_FLOAT.search(data):
+        data = _adapter.dump_json(_adapter.validate_python(item))
+    return data
+
+def encode_calculation_page(rows, next_cursor) -> bytes:
+    """JSON for a CalculationPage."""
+    return b'{"items":' + encode_calculations(rows) + b',"next_cursor":' + orjson.dumps(next_cursor) + b"}"
@@ -0,0 +1,33 @@
+# in app/etags.py
+
+from typing import Optional
+
+# Conditional GETs for calculation reads. Every user has a calc_version
+# counter (users.calc_version) that each create/update/delete bumps in the
+# same statement as the write itself. A read's ETag is derived from it, so a
+# client that sends the ETag back in If-None-Match is answered 304 after one
+# primary-key lookup, without running the read query or serializing anything.
+#
+# The ETag covers all of the user's calculations, so any write invalidates
+# every cached list, page and single calculation of that user. Weak tags:
+# the same version always yields the same data, but not necessarily the same
+# bytes (e.g. once compression is involved).
+
+# Revalidate on every use; never store in shared caches (the data is per user)
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(user_id: int, version: Optional[int]) -> str:
+    # The user id is part of the tag: different users fetch the same URLs
+    return f'W/"{user_id}-{version or 0}"'
+
+def headers(user_id: int, version: Optional[int]) -> dict:
+    return {"ETag": make_etag(user_id, version), "Cache-Control": CACHE_CONTROL}
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (a list of tags, or *) against etag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
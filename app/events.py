@@ -0,0 +1,144 @@
+# in app/events.py
+
+import asyncio
+import os
+import time
+import weakref
+from fastapi import HTTPException, status
+from app import encoding
+
+# Live calculation updates for open dashboards, as Server-Sent Events on
+# GET /calculations/events. The write routes publish small deltas:
+#   created / updated   data: the calculation (CalculationRead JSON)
+#   deleted             data: {"id": ...}
+#   reset               the history changed in bulk (batch, import) or the
+#                       stream fell behind: fetch the list again
+# Each event is framed once and the same bytes go to every stream of the user.
+#
+# Per stream: one bounded queue (EVENTS_QUEUE_SIZE events). A stream whose
+# queue is full loses what is buffered and gets a single reset instead, so a
+# slow client never holds more than that. An idle stream costs its queue and
+# one suspended task, plus a comment line every EVENTS_HEARTBEAT_SECONDS that
+# keeps proxies from closing it. Streams end after EVENTS_MAX_STREAM_SECONDS;
+# EventSource reconnects on its own, and the dashboard re-validates its list
+# (a 304 when nothing changed) on every (re)connect, so no delta is missed.
+#
+# Fan-out is in-process: a stream sees the writes handled by its own worker.
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "64"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", "600"))
+EVENTS_MAX_CONNECTIONS = int(os.getenv("EVENTS_MAX_CONNECTIONS", "10000"))
+EVENTS_MAX_PER_USER = int(os.getenv("EVENTS_MAX_PER_USER", "10"))
+EVENTS_RETRY_MS = 3000
+
+_RESET = b"event: reset\ndata: {}\n\n"
+_HEARTBEAT = b": ping\n\n"
+
+def frame(event: str, data: bytes) -> bytes:
+    """One SSE message. `data` is compact JSON, so it is a single line."""
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+class Subscription:
+    """One open stream: a bounded queue of framed events."""
+
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(size)
+
+    def push(self, message: bytes) -> bool:
+        """Queues a message. Returns False when the queue overflowed and was replaced by a reset."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESET)
+            return False
+
+class Broker:
+    """user id -> that user's open streams."""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, max_connections: int = EVENTS_MAX_CONNECTIONS,
+                 max_per_user: int = EVENTS_MAX_PER_USER):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        # Weak: a stream whose body never started (client gone at once) cannot leak its slot
+        self._streams = {}  # user id -> WeakSet of Subscription
+        self.overflows = 0
+
+    @property
+    def connections(self) -> int:
+        return sum(len(streams) for streams in self._streams.values())
+
+    def has_streams(self, user_id: int) -> bool:
+        return bool(self._streams.get(user_id))
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Raises 429 when the user has too many streams open, 503 when the worker does."""
+        streams = self._streams.setdefault(user_id, weakref.WeakSet())
+        if len(streams) >= self.max_per_user:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many open event streams")
+        if self.connections >= self.max_connections:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, please retry",
+                                headers={"Retry-After": str(EVENTS_RETRY_MS // 1000)})
+        subscription = Subscription(self.queue_size)
+        streams.add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id: int, subscription: Subscription):
+        streams = self._streams.get(user_id)
+        if streams is not None:
+            streams.discard(subscription)
+            if not streams:
+                del self._streams[user_id]
+
+    def publish(self, user_id: int, message: bytes):
+        for subscription in list(self._streams.get(user_id, ())):
+            if not subscription.push(message):
+                self.overflows += 1
+
+    async def stream(self, user_id: int, subscription: Subscription):
+        """The response body of one stream; unsubscribes when the client goes away."""
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+            deadline = time.monotonic() + EVENTS_MAX_STREAM_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), min(EVENTS_HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield _HEARTBEAT
+        finally:
+            self.unsubscribe(user_id, subscription)
+
+broker = Broker()
+
+# --- Publishing (called by calc_routes after a successful write) ---
+
+def calculation_changed(user_id: int, event: str, row):
+    """created/updated: `row` has the CalculationRead columns."""
+    if broker.has_streams(user_id):
+        broker.publish(user_id, frame(event, encoding.encode_calculation(row)))
+
+def calculation_deleted(user_id: int, calc_id: int):
+    if broker.has_streams(user_id):
+        broker.publish(user_id, frame("deleted", b'{"id":%d}' % calc_id))
+
+def history_reset(user_id: int):
+    if broker.has_streams(user_id):
+        broker.publish(user_id, _RESET)
+
+def render() -> str:
+    """Stream state in the Prometheus text format, appended to /metrics."""
+    return "\n".join([
+        "# HELP event_streams_open Open calculation event streams.",
+        "# TYPE event_streams_open gauge",
+        f"event_streams_open {broker.connections}",
+        "# HELP event_stream_overflows_total Events dropped for a full stream queue (replaced by a reset).",
+        "# TYPE event_stream_overflows_total counter",
+        f"event_stream_overflows_total {broker.overflows}",
+    ]) + "\n"
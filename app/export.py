@@ -0,0 +1,153 @@
+# in app/export.py
+
+import csv
+import io
+import json
+import zlib
+from sqlalchemy import select, tuple_
+from starlette.concurrency import run_in_threadpool
+from app import archive, database, encoding, models, sharding
+
+# Streaming export of a user's history. Rows come off a server-side cursor in
+# fixed-size chunks and are encoded straight to text, skipping ORM objects and
+# per-row Pydantic validation, so memory stays flat however long the history.
+# Archived rows (app/archive.py) come first, a block at a time, then the table
+# after the last archived key, checked against the segments like app/history.py.
+
+EXPORT_CHUNK_SIZE = 5000
+
+# Same field order as CalculationRead
+EXPORT_COLUMNS = encoding.CALCULATION_COLUMNS
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def _query(user_id: int, after: tuple = None):
+    Calc = models.Calculation
+    columns = [getattr(Calc, name) for name in EXPORT_COLUMNS]
+    query = select(*columns).where(Calc.user_id == user_id)
+    if after is not None:
+        query = query.where(tuple_(Calc.created_at, Calc.id) > tuple_(*after))
+    return query.order_by(Calc.created_at, Calc.id)
+
+def encode_ndjson(rows, header: bool = False) -> bytes:
+    lines = []
+    for a, b, op_type, expression, variables, calc_id, result, exact, user_id, created_at in rows:
+        lines.append(json.dumps({
+            "a": a, "b": b, "type": op_type, "expression": expression, "variables": variables,
+            "id": calc_id, "result": result, "exact": exact,
+            "user_id": user_id, "created_at": created_at.isoformat() if created_at else None,
+        }, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode() if lines else b""
+
+def encode_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(_csv_cell(value) for value in row)
+    return buffer.getvalue().encode()
+
+def _csv_cell(value):
+    if isinstance(value, dict):
+        return json.dumps(value, separators=(",", ":"))
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv}
+
+def _sync_chunks(user_id: int, chunk_size: int):
+    snapshot = archive.snapshot(user_id)
+    yield from snapshot.batches(batch_rows=chunk_size)
+    # Own session (on the user's shard): the response outlives the request's get_db dependency
+    shard, _ = sharding.shards.lookup(user_id)
+    with sharding.shards.session(shard) as db:
+        while True:
+            result = db.execute(_query(user_id, snapshot.last_key).execution_options(yield_per=chunk_size))
+            partitions = result.partitions()
+            first = next(partitions, None)
+            newer = archive.snapshot(user_id)
+            if newer.names == snapshot.names:
+                break
+            # An archive run committed meanwhile: send its rows, then query again
+            result.close()
+            yield from newer.batches(after=snapshot.last_key, batch_rows=chunk_size)
+            snapshot = newer
+        if first is not None:
+            yield first
+        yield from partitions
+
+async def _archived_chunks(snapshot, chunk_size: int, after: tuple = None):
+    batches = snapshot.batches(after=after, batch_rows=chunk_size)
+    while True:
+        rows = await run_in_threadpool(next, batches, None)
+        if rows is None:
+            return
+        yield rows
+
+async def _async_chunks(user_id: int, chunk_size: int):
+    snapshot = archive.snapshot(user_id)
+    async for rows in _archived_chunks(snapshot, chunk_size):
+        yield rows
+    shard, _ = await sharding.shards.lookup_async(user_id)
+    async with sharding.shards.shards[shard].async_engine.connect() as conn:
+        while True:
+            result = await conn.stream(_query(user_id, snapshot.last_key).execution_options(yield_per=chunk_size))
+            partitions = result.partitions()
+            first = await anext(partitions, None)
+            newer = archive.snapshot(user_id)
+            if newer.names == snapshot.names:
+                break
+            await result.close()
+            async for rows in _archived_chunks(newer, chunk_size, after=snapshot.last_key):
+                yield rows
+            snapshot = newer
+        if first is not None:
+            yield first
+        async for rows in partitions:
+            yield rows
+
+def _encode_sync(chunks, fmt: str, compress: bool):
+    encode = ENCODERS[fmt]
+    gz = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip framing
+    # The CSV header goes out first, even when the history is empty
+    first = encode([], header=True) if fmt == "csv" else b""
+    if first:
+        yield gz.compress(first) if gz else first
+    for rows in chunks:
+        data = encode(rows)
+        if gz:
+            data = gz.compress(data)
+        if data:
+            yield data
+    if gz:
+        yield gz.flush()
+
+async def _encode_async(chunks, fmt: str, compress: bool):
+    encode = ENCODERS[fmt]
+    gz = zlib.compressobj(wbits=31) if compress else None
+    first = encode([], header=True) if fmt == "csv" else b""
+    if first:
+        yield gz.compress(first) if gz else first
+    async for rows in chunks:
+        data = encode(rows)
+        if gz:
+            data = gz.compress(data)
+        if data:
+            yield data
+    if gz:
+        yield gz.flush()
+
+def stream_export(user_id: int, fmt: str = "ndjson", compress: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Returns an iterator of encoded (and optionally gzip-compressed) bytes for
+    StreamingResponse: an async generator in DATABASE_MODE=async, a plain
+    generator otherwise (Starlette runs that one on the threadpool).
+    """
+    if database.async_engine is not None:
+        return _encode_async(_async_chunks(user_id, chunk_size), fmt, compress)
+    return _encode_sync(_sync_chunks(user_id, chunk_size), fmt, compress)
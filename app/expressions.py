@@ -0,0 +1,208 @@
+# in app/expressions.py
+
+from __future__ import annotations
+import math
+import os
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np  # imported on first evaluate_many()
+
+# Safe formulas for the "expression" calculation type, e.g. "(a+b)^2/c".
+#
+# Text is tokenized and parsed into a small AST by hand (never eval'd as
+# written). The AST is then turned back into Python source built only from
+# float literals, variable lookups and + - * / ** so it can be compiled once
+# into a plain function. Compiled expressions are cached by their
+# normalized text, so a repeated formula skips parsing entirely, and the
+# same function works element-wise on NumPy arrays.
+
+MAX_EXPRESSION_LENGTH = 255
+MAX_NESTING_DEPTH = 50
+EXPRESSION_CACHE_SIZE = int(os.getenv("EXPRESSION_CACHE_SIZE", "1024"))
+
+class ExpressionError(ValueError):
+    """Raised for expressions that cannot be parsed or evaluated."""
+
+_TOKEN_RE = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_][A-Za-z0-9_]*)|(\*\*|[-+*/^()]))")
+
+def _tokenize(text: str):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            raise ExpressionError(f"Unexpected character at position {pos}: {text[pos]!r}")
+        number, name, op = match.groups()
+        if number is not None:
+            value = float(number)
+            if not math.isfinite(value):
+                # repr(inf) is not a literal the compiled source could use
+                raise ExpressionError(f"Number too large at position {pos}: {number}")
+            tokens.append(("num", value))
+        elif name is not None:
+            tokens.append(("name", name))
+        else:
+            tokens.append(("op", "^" if op == "**" else op))
+        pos = match.end()
+    return tokens
+
+class _Parser:
+    """
+    Recursive descent parser. Grammar (lowest to highest precedence):
+        expr  := term (("+" | "-") term)*
+        term  := unary (("*" | "/") unary)*
+        unary := ("+" | "-") unary | power
+        power := atom ("^" unary)?        # right-associative, -2^2 == -(2^2)
+        atom  := number | name | "(" expr ")"
+    Nodes are tuples: ("num", value), ("var", name), ("neg", node), (op, left, right).
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise ExpressionError(f"Unexpected token {self.tokens[self.pos][1]!r}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take_op(self, *ops):
+        kind, value = self.peek()
+        if kind == "op" and value in ops:
+            self.pos += 1
+            return value
+        return None
+
+    def expr(self):
+        node = self.term()
+        while (op := self.take_op("+", "-")) is not None:
+            node = (op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while (op := self.take_op("*", "/")) is not None:
+            node = (op, node, self.unary())
+        return node
+
+    def unary(self):
+        op = self.take_op("+", "-")
+        if op is None:
+            return self.power()
+        self.enter()
+        operand = self.unary()
+        self.depth -= 1
+        return ("neg", operand) if op == "-" else operand
+
+    def power(self):
+        node = self.atom()
+        if self.take_op("^") is not None:
+            self.enter()
+            node = ("^", node, self.unary())
+            self.depth -= 1
+        return node
+
+    def atom(self):
+        kind, value = self.peek()
+        if kind == "num":
+            self.pos += 1
+            return ("num", value)
+        if kind == "name":
+            self.pos += 1
+            return ("var", value)
+        if self.take_op("(") is not None:
+            self.enter()
+            node = self.expr()
+            self.depth -= 1
+            if self.take_op(")") is None:
+                raise ExpressionError("Missing closing parenthesis")
+            return node
+        raise ExpressionError("Unexpected end of expression" if kind is None else f"Unexpected token {value!r}")
+
+    def enter(self):
+        self.depth += 1
+        if self.depth > MAX_NESTING_DEPTH:
+            raise ExpressionError("Expression is nested too deeply")
+
+_PY_OPS = {"+": "+", "-": "-", "*": "*", "/": "/", "^": "**"}
+
+def _to_source(node, variables: set) -> str:
+    kind = node[0]
+    if kind == "num":
+        return repr(node[1])  # always a float literal, so ^ never runs big-int math
+    if kind == "var":
+        variables.add(node[1])
+        return f"v[{node[1]!r}]"
+    if kind == "neg":
+        return f"(-{_to_source(node[1], variables)})"
+    return f"({_to_source(node[1], variables)} {_PY_OPS[kind]} {_to_source(node[2], variables)})"
+
+class CompiledExpression:
+    """A parsed formula compiled to a function of a {name: value} mapping."""
+
+    def __init__(self, text: str, func, variables):
+        self.text = text
+        self.variables = tuple(sorted(variables))
+        self._func = func
+
+    def _check(self, bindings):
+        missing = [name for name in self.variables if name not in bindings]
+        if missing:
+            raise ExpressionError(f"Missing value for variable(s): {', '.join(missing)}")
+
+    def evaluate(self, bindings: dict) -> float:
+        """Evaluates for one set of variable values."""
+        self._check(bindings)
+        try:
+            result = self._func({name: float(bindings[name]) for name in self.variables})
+        except ZeroDivisionError:
+            raise ExpressionError("Cannot divide by zero")
+        except OverflowError:
+            raise ExpressionError("Result is too large")
+        if isinstance(result, complex):
+            raise ExpressionError("Result is not a real number")
+        return float(result)
+
+    def evaluate_many(self, bindings: dict) -> np.ndarray:
+        """
+        Evaluates for many sets of values at once. `bindings` maps each variable
+        to a sequence of values (all the same length); the compiled function
+        runs once over NumPy arrays. Division by zero and invalid powers give
+        inf/NaN in the matching rows instead of raising.
+        """
+        import numpy as np
+        self._check(bindings)
+        arrays = {name: np.asarray(bindings[name], dtype=np.float64) for name in self.variables}
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            result = self._func(arrays)
+        size = len(next(iter(bindings.values()))) if bindings else 1
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (size,)).copy()
+
+def normalize(text: str) -> str:
+    """Cache key for an expression: the text with all whitespace removed."""
+    return "".join(text.split())
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile_normalized(text: str) -> CompiledExpression:
+    tree = _Parser(_tokenize(text)).parse()
+    variables = set()
+    source = f"lambda v: {_to_source(tree, variables)}"
+    func = eval(compile(source, "<expression>", "eval"), {"__builtins__": {}}, {})
+    return CompiledExpression(text, func, variables)
+
+def compile_expression(text: str) -> CompiledExpression:
+    """Parses and compiles an expression, reusing the cached result for repeated formulas."""
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    return _compile_normalized(normalize(text))
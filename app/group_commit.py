@@ -0,0 +1,140 @@
+# in app/group_commit.py
+
+import asyncio
+import os
+from starlette.concurrency import run_in_threadpool
+from app import crud, database, metrics, sharding
+
+# Commit mode for POST /calculations/:
+#   "strict" (default): every request inserts and commits its own row.
+#   "group": rows wait on an in-process queue and one background flusher per
+#   process writes them together, one INSERT ... RETURNING and one commit (one
+#   fsync) per group. A group is written once GROUP_COMMIT_MAX_ROWS rows are
+#   waiting or GROUP_COMMIT_INTERVAL_MS after its first row arrived (with
+#   shards: one INSERT and commit per shard the group's users live on). Callers
+#   still wait for their group's commit before they get the id and result, so
+#   an acknowledged calculation is never lost.
+CALC_COMMIT_MODE = os.getenv("CALC_COMMIT_MODE", "strict")
+GROUP_COMMIT_INTERVAL_MS = float(os.getenv("GROUP_COMMIT_INTERVAL_MS", "5"))
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "500"))
+
+_STOP = object()
+
+async def _write_shard(shard: int, rows):
+    if database.AsyncSessionLocal is not None:
+        async with sharding.shards.async_session(shard) as db:
+            return await db.run_sync(crud.insert_calculation_group, rows)
+
+    def write():
+        with sharding.shards.session(shard) as db:
+            return crud.insert_calculation_group(db, rows)
+    return await run_in_threadpool(write)
+
+async def _by_shard(group):
+    """Splits a group of (values, future) by the shard its users live on."""
+    if sharding.shards.count == 1:
+        return {0: group}
+    by_shard = {}
+    for values, future in group:
+        try:
+            shard, _ = await sharding.shards.lookup_async(values["user_id"])
+        except Exception as e:
+            _settle(future, error=e)
+            continue
+        by_shard.setdefault(shard, []).append((values, future))
+    return by_shard
+
+def _settle(future, result=None, error=None):
+    # The caller may have gone away (cancelled request) in the meantime
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class GroupCommitter:
+    def __init__(self, interval_ms: float = GROUP_COMMIT_INTERVAL_MS, max_rows: int = GROUP_COMMIT_MAX_ROWS):
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self._loop = None
+        self._queue = None
+        self._full = None
+        self._task = None
+
+    def _ensure_started(self):
+        # Started lazily on the running loop (and again if that loop changed)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, values: dict):
+        """Queues one row from crud.calculation_row and waits for its group's commit. Returns the stored row."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((values, future))
+        if self._queue.qsize() >= self.max_rows:
+            self._full.set()
+        return await future
+
+    async def drain(self):
+        """Writes everything still queued, then stops the flusher. Called on shutdown."""
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop():
+            return
+        self._queue.put_nowait((_STOP, None))
+        self._full.set()
+        await self._task
+
+    async def _run(self):
+        # Statements run here belong to no single request
+        metrics.current_request.set(None)
+        while True:
+            group = [await self._queue.get()]
+            if group[0][0] is _STOP:
+                return
+            # 1. Wait for the interval to pass or for a full group
+            if self._queue.qsize() < self.max_rows:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            # 2. Take whatever is queued, up to max_rows
+            stop = False
+            while len(group) < self.max_rows and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item[0] is _STOP:
+                    stop = True
+                    break
+                group.append(item)
+            await self._flush(group)
+            if stop:
+                return
+
+    async def _flush(self, group):
+        # One INSERT and commit per shard. Each shard's rows succeed or fail on
+        # their own, so a failure never writes rows another shard committed again
+        for shard, items in (await _by_shard(group)).items():
+            await self._flush_shard(shard, items)
+
+    async def _flush_shard(self, shard: int, items):
+        try:
+            stored = await _write_shard(shard, [values for values, _ in items])
+        except Exception:
+            # One bad row (e.g. its user was just deleted) must not fail the
+            # whole group: retry row by row so only that caller gets the error
+            for values, future in items:
+                try:
+                    row = (await _write_shard(shard, [values]))[0]
+                except Exception as e:
+                    _settle(future, error=e)
+                else:
+                    _settle(future, row)
+            return
+        for (_, future), row in zip(items, stored):
+            _settle(future, row)
+
+committer = GroupCommitter()
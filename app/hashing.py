@@ -0,0 +1,100 @@
+# in app/hashing.py
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.process_pools import spawn_context
+
+# bcrypt runs in a small dedicated process pool so a login spike cannot
+# starve the request workers. This module is also what the pool processes
+# import, so it only depends on passlib.
+
+# Cost factor for new hashes. Existing hashes with a different cost are
+# re-hashed transparently the next time their owner logs in.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Most hash/verify jobs allowed to be running or waiting at once; beyond
+# that callers get HashingBusy right away instead of queueing.
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+_contexts = {}
+
+def _context(rounds: int):
+    context = _contexts.get(rounds)
+    if context is None:
+        from passlib.context import CryptContext
+        context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        _contexts[rounds] = context
+    return context
+
+# --- Work functions (run inside the pool processes) ---
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return _context(rounds).hash(password)
+
+def verify_and_update(password: str, hashed_password: str, rounds: int = BCRYPT_ROUNDS):
+    """Returns (valid, new_hash). new_hash is set when the stored hash uses another cost."""
+    return _context(rounds).verify_and_update(password, hashed_password)
+
+# --- Bounded Pool ---
+
+class HashingBusy(Exception):
+    """Raised when HASH_QUEUE_LIMIT jobs are already running or waiting."""
+
+class HashingPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=spawn_context())
+        return self._executor
+
+    def _replace(self, broken):
+        """A fresh executor in place of `broken` (unless another caller replaced it already)."""
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            return self._get_executor()
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise HashingBusy()
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            try:
+                return await asyncio.wrap_future(executor.submit(fn, *args))
+            except BrokenProcessPool:
+                # A worker died (OOM, kill), which breaks the executor for
+                # every later job: start a new one and try once more
+                executor = self._replace(executor)
+                return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+pool = HashingPool()
@@ -0,0 +1,59 @@
+# in app/history.py
+
+from starlette.concurrency import run_in_threadpool
+from app import archive, crud, database, pagination
+
+# Reads of a user's whole history: their archived rows (app/archive.py)
+# followed by their hot rows, which are read after the last archived
+# (created_at, id) key. Each read snapshots the committed segments first and
+# checks them again after the hot query: an archive run that committed in
+# between may have deleted rows the query expected to find, so the read is
+# done again. Decompressing blocks happens on the threadpool.
+
+READ_ATTEMPTS = 3
+
+async def list_calculations(db, user_id: int, skip: int = 0, limit: int = 100):
+    """Offset pagination over the whole history, like crud.get_calculations."""
+    for _ in range(READ_ATTEMPTS):
+        snapshot = archive.snapshot(user_id)
+        rows = []
+        if skip < snapshot.count:
+            rows = await run_in_threadpool(snapshot.take, limit, skip=skip)
+        if len(rows) < limit:
+            rows += await database.run_db(db, crud.get_calculations, user_id=user_id, skip=max(0, skip - snapshot.count),
+                                          limit=limit - len(rows), after=snapshot.last_key)
+        if not snapshot.changed():
+            break
+    return rows
+
+async def calculations_page(db, user_id: int, limit: int = 100, after: tuple = None, **filters):
+    """Keyset pagination over the whole history, like crud.get_calculations_page. Returns (rows, next_cursor)."""
+    for _ in range(READ_ATTEMPTS):
+        snapshot = archive.snapshot(user_id)
+        rows, next_cursor = [], None
+        if snapshot and (after is None or after < snapshot.last_key):
+            # One extra row tells whether the page goes on within the archive
+            rows = await run_in_threadpool(snapshot.take, limit + 1, after=after, **filters)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = pagination.encode_cursor(rows[-1].created_at, rows[-1].id)
+        else:
+            hot_after = snapshot.last_key if after is None or (snapshot and after < snapshot.last_key) else after
+            hot, next_cursor = await database.run_db(
+                db, crud.get_calculations_page, user_id=user_id, limit=max(limit - len(rows), 1), after=hot_after, **filters
+            )
+            if len(rows) == limit:
+                # Full page from the archive; the hot probe only says whether more follows
+                next_cursor = pagination.encode_cursor(rows[-1].created_at, rows[-1].id) if hot else None
+            else:
+                rows += hot
+        if not snapshot.changed():
+            break
+    return rows, next_cursor
+
+async def get_archived(user_id: int, calc_id: int):
+    """The user's archived calculation with that id, or None."""
+    snapshot = archive.snapshot(user_id)
+    if not snapshot:
+        return None
+    return await run_in_threadpool(snapshot.get, calc_id)
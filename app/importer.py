@@ -0,0 +1,97 @@
+# in app/importer.py
+
+import csv
+import json
+from itertools import islice
+from pydantic import ValidationError
+from app import schemas
+from app.logic import HEAVY_OPERATIONS, calculate
+
+# Incremental parsing for bulk imports. The upload is read one record at a
+# time and handed out in fixed-size batches, so memory depends on the batch
+# size, not on the file size.
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+def detect_format(filename: str, requested: str = None) -> str:
+    if requested:
+        return requested
+    return "csv" if (filename or "").lower().endswith(".csv") else "ndjson"
+
+def iter_records(fileobj, fmt: str):
+    """
+    Yields (line_number, record dict or None, error or None) for every data line.
+    The upload is decoded line by line: an NDJSON line that is not UTF-8 is
+    one bad record, while in CSV (where a record may span lines) bad bytes,
+    or rows the reader cannot split, end the file with one error.
+    """
+    if fmt == "ndjson":
+        yield from _ndjson_records(fileobj)
+        return
+    # Any extra columns (e.g. id/result from our own export) are ignored
+    reader = csv.DictReader(raw.decode("utf-8") for raw in fileobj)
+    try:
+        for record in reader:
+            yield reader.line_num, *_from_csv(record)
+    except UnicodeDecodeError:
+        yield reader.line_num + 1, None, "File is not valid UTF-8"
+    except csv.Error as e:
+        yield reader.line_num, None, f"Invalid CSV: {e}"
+
+def _ndjson_records(fileobj):
+    for line_number, raw in enumerate(fileobj, start=1):
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            yield line_number, None, "Line is not valid UTF-8"
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, record, None
+
+def _from_csv(record: dict):
+    """CSV cells are strings: blank optional cells mean None, variables hold JSON."""
+    for key in ("expression", "variables"):
+        if record.get(key) == "":
+            record[key] = None
+    if isinstance(record.get("variables"), str):
+        try:
+            record["variables"] = json.loads(record["variables"])
+        except ValueError:
+            return None, "Invalid JSON in variables"
+    return record, None
+
+def next_batch(records, user_id: int, size: int = IMPORT_CHUNK_SIZE):
+    """
+    Validates and computes the next `size` records.
+    Returns (rows ready to insert, [(line, error)], records consumed).
+    """
+    rows, errors, consumed = [], [], 0
+    for line_number, record, error in islice(records, size):
+        consumed += 1
+        if error is None:
+            try:
+                calc = schemas.CalculationCreate.model_validate(record)
+                if calc.type in HEAVY_OPERATIONS:
+                    # They need the compute pool, one request at a time
+                    raise ValueError(f"{calc.type.value} is not supported in imports, use POST /calculations/")
+                result = calculate(calc.type, calc.a, calc.b, calc.expression, calc.variables)
+            except (ValidationError, ValueError) as e:
+                error = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+        if error is not None:
+            errors.append((line_number, error))
+            continue
+        rows.append({
+            "a": calc.a, "b": calc.b, "type": calc.type.value, "expression": calc.expression,
+            "variables": calc.variables, "result": result, "user_id": user_id,
+        })
+    return rows, errors, consumed
@@ -1,6 +1,23 @@
 # in app/logic.py
 
+from __future__ import annotations
 import enum
+import math
+import os
+import sys
+from decimal import Decimal, localcontext
+from typing import TYPE_CHECKING
+from app.expressions import compile_expression
+
+# NumPy is only needed by batch requests, so it is imported on first use
+# instead of slowing down every process start.
+if TYPE_CHECKING:
+    import numpy as np
+
+def _np():
+    """The numpy module, imported on the first call."""
+    import numpy
+    return numpy
 
 # 1. Use an Enum for strong typing of operation types
 class OperationType(str, enum.Enum):
@@ -8,6 +25,10 @@ class OperationType(str, enum.Enum):
     SUBTRACT = "subtract"
     MULTIPLY = "multiply"
     DIVIDE = "divide"
+    EXPRESSION = "expression"  # formula text evaluated by app.expressions
+    POWER = "power"            # a ** b
+    FACTORIAL = "factorial"    # a! (b is ignored)
+    ROOT = "root"              # b-th root of a
 
 # 2. Define the individual logic functions
 def add(a: float, b: float) -> float:
@@ -25,12 +46,73 @@ def divide(a: float, b: float) -> float:
         raise ValueError("Cannot divide by zero")
     return a / b
 
+# 2b. Heavy operations. These compute exactly, with big integers or with
+# Decimals of `precision` significant digits, and can take seconds of CPU
+# (a 10,000-digit fractional power does), so routes run them in app.compute's
+# process pool. The full digits are kept next to the float result, which
+# still has to fit the result column.
+HEAVY_OPERATIONS = frozenset({OperationType.POWER, OperationType.FACTORIAL, OperationType.ROOT})
+DEFAULT_PRECISION = 50
+MAX_PRECISION = int(os.getenv("MAX_PRECISION", "10000"))
+_MAX_LOG10 = math.log10(sys.float_info.max)
+
+def _whole(x: float) -> bool:
+    return float(x).is_integer()
+
+def _decimal(x: float) -> Decimal:
+    # repr() gives the digits the user typed (0.1, not 0.1000000000000000055...)
+    return Decimal(repr(float(x)))
+
+def _check_size(log10_magnitude: float):
+    if log10_magnitude > _MAX_LOG10:
+        raise ValueError("Result is too large (the largest storable result is about 1.8e308)")
+
+def power(a: float, b: float, precision: int = DEFAULT_PRECISION):
+    if a == 0 and b < 0:
+        raise ValueError("Cannot raise zero to a negative power")
+    if a < 0 and not _whole(b):
+        raise ValueError("A negative number has no real power with a fractional exponent")
+    # Checked before computing, so 2 ** 1e15 fails at once instead of filling memory
+    if a != 0:
+        _check_size(b * math.log10(abs(a)))
+    if _whole(a) and _whole(b) and b >= 0:
+        return int(a) ** int(b)
+    with localcontext() as ctx:
+        ctx.prec = precision
+        return _decimal(a) ** _decimal(b)
+
+def factorial(a: float, b: float = None, precision: int = None):
+    if a < 0 or not _whole(a):
+        raise ValueError("Factorial needs a non-negative whole number")
+    _check_size(math.lgamma(a + 1) / math.log(10))
+    return math.factorial(int(a))
+
+def root(a: float, b: float, precision: int = DEFAULT_PRECISION):
+    if b < 1 or not _whole(b):
+        raise ValueError("Root degree must be a positive whole number")
+    n = int(b)
+    if a < 0 and n % 2 == 0:
+        raise ValueError("A negative number has no real even root")
+    with localcontext() as ctx:
+        ctx.prec = precision
+        x = _decimal(abs(a))
+        value = x.sqrt() if n == 2 else x ** (Decimal(1) / n)
+    if _whole(a):
+        # Perfect powers come back as exact integers (27 -> 3, not 3.000...001)
+        guess = int(value.to_integral_value())
+        if guess ** n == abs(int(a)):
+            value = guess
+    return -value if a < 0 else value
+
 # 3. Create the "Factory" - a simple dictionary mapping
 OPERATION_FACTORY = {
     OperationType.ADD: add,
     OperationType.SUBTRACT: subtract,
     OperationType.MULTIPLY: multiply,
     OperationType.DIVIDE: divide,
+    OperationType.POWER: power,
+    OperationType.FACTORIAL: factorial,
+    OperationType.ROOT: root,
 }
 
 def get_operation_func(op_type: OperationType):
@@ -41,4 +123,128 @@ def get_operation_func(op_type: OperationType):
     func = OPERATION_FACTORY.get(op_type)
     if func is None:
         raise ValueError(f"Invalid operation type: {op_type}")
-    return func
\ No newline at end of file
+    return func
+
+def calculate(op_type: OperationType, a: float, b: float, expression: str = None, variables: dict = None) -> float:
+    """
+    Computes one calculation of any type. Expressions see a and b as
+    variables, plus any extra named variables.
+    """
+    if op_type == OperationType.EXPRESSION:
+        return compile_expression(expression).evaluate({**(variables or {}), "a": a, "b": b})
+    if op_type in HEAVY_OPERATIONS:
+        return calculate_exact(op_type, a, b)[0]
+    result = get_operation_func(op_type)(a, b)
+    if not math.isfinite(result):  # e.g. 1e308 * 10
+        raise ValueError("Result is not a finite number")
+    return result
+
+def calculate_exact(op_type: OperationType, a: float, b: float, precision: int = None):
+    """
+    Computes one heavy operation. Returns (result, exact): the nearest float,
+    and every digit as text (whole for integers, `precision` significant
+    digits otherwise). This is what runs in app.compute's pool processes.
+    """
+    value = get_operation_func(op_type)(a, b, precision or DEFAULT_PRECISION)
+    # The log10 estimate lets the boundary through (2 ** 1024): big ints raise
+    # OverflowError and Decimals round to inf past the float range
+    try:
+        result = float(value)
+    except OverflowError:
+        result = math.inf
+    if math.isinf(result):
+        _check_size(math.inf)
+    return result, str(value)
+
+# 4. Vectorized versions of the same operations, used for batch requests.
+# Each one takes two NumPy arrays and returns the element-wise result.
+def add_many(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return _np().add(a, b)
+
+def subtract_many(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return _np().subtract(a, b)
+
+def multiply_many(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return _np().multiply(a, b)
+
+def divide_many(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    np = _np()
+    # Rows with b == 0 are left as NaN; evaluate_batch reports them as errors
+    out = np.full_like(a, np.nan)
+    return np.divide(a, b, out=out, where=b != 0)
+
+VECTORIZED_OPERATION_FACTORY = {
+    OperationType.ADD: add_many,
+    OperationType.SUBTRACT: subtract_many,
+    OperationType.MULTIPLY: multiply_many,
+    OperationType.DIVIDE: divide_many,
+}
+
+def evaluate_batch(a_values, b_values, op_types, expressions=None, variables=None):
+    """
+    Evaluates many calculations at once, grouped by operation type.
+    Expression rows are grouped by formula, and each formula is compiled
+    once and run over all of its rows together.
+    Returns (results, errors): a float array and a list holding an error
+    message (or None) for every input row.
+    """
+    np = _np()
+    a = np.asarray(a_values, dtype=np.float64)
+    b = np.asarray(b_values, dtype=np.float64)
+    types = np.asarray([OperationType(t).value for t in op_types])
+
+    results = np.empty_like(a)
+    with np.errstate(over="ignore", invalid="ignore"):  # reported per row below
+        for op_type, func in VECTORIZED_OPERATION_FACTORY.items():
+            mask = types == op_type.value
+            if mask.any():
+                results[mask] = func(a[mask], b[mask])
+
+    errors = [None] * len(a)
+    for i in np.flatnonzero((types == OperationType.DIVIDE.value) & (b == 0)):
+        errors[i] = "Cannot divide by zero"
+    # Heavy operations need the compute pool; a batch would tie it up for too long
+    for i in np.flatnonzero(np.isin(types, [op_type.value for op_type in HEAVY_OPERATIONS])):
+        errors[i] = f"{types[i]} is not supported in batches, use POST /calculations/"
+
+    expression_rows = np.flatnonzero(types == OperationType.EXPRESSION.value)
+    if len(expression_rows):
+        _evaluate_expression_rows(expression_rows, a, b, expressions, variables or [None] * len(a), results, errors)
+
+    # Overflow (1e308 * 10) or NaN from any operation; rows with an error already hold no result
+    for i in np.flatnonzero(~np.isfinite(results)):
+        if errors[i] is None:
+            errors[i] = "Result is not a finite number"
+    return results, errors
+
+def _evaluate_expression_rows(rows, a, b, expressions, variables, results, errors):
+    by_formula = {}
+    for i in rows:
+        by_formula.setdefault(expressions[i], []).append(i)
+
+    for text, idx in by_formula.items():
+        try:
+            if not text:
+                raise ValueError("Expression is required for the expression type")
+            compiled = compile_expression(text)
+        except ValueError as e:
+            for i in idx:
+                errors[i] = str(e)
+            continue
+
+        # Rows missing one of the formula's variables fail on their own
+        usable = []
+        for i in idx:
+            missing = [name for name in compiled.variables if name not in ("a", "b") and name not in (variables[i] or {})]
+            if missing:
+                errors[i] = f"Missing value for variable(s): {', '.join(missing)}"
+            else:
+                usable.append(i)
+        if not usable:
+            continue
+
+        bindings = {"a": a[usable], "b": b[usable]}
+        for name in compiled.variables:
+            if name not in bindings:
+                bindings[name] = [variables[i][name] for i in usable]
+        results[usable] = compiled.evaluate_many(bindings)
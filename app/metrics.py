@@ -0,0 +1,157 @@
+# in app/metrics.py
+
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+
+# Low-overhead request metrics in the Prometheus text format.
+#
+# MetricsMiddleware is plain ASGI (no BaseHTTPMiddleware task/stream overhead).
+# All registry updates happen in the middleware on the event loop thread, so
+# no locks are needed. DB statements are counted by SQLAlchemy cursor events
+# into a per-request object found through a ContextVar; the threadpool and
+# AsyncSession.run_sync both carry that context along.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true") == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestStats:
+    """DB work done on behalf of the current request."""
+    __slots__ = ("statements", "db_seconds", "scope", "repeats")
+
+    def __init__(self, scope: dict = None):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.scope = scope    # the ASGI scope; the router adds the matched route to it
+        self.repeats = None   # statement text -> runs, kept by app.profiler when it is on
+
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+class Registry:
+    def __init__(self):
+        self.latency = {}      # (method, route) -> Histogram
+        self.statements = {}   # (method, route) -> Histogram
+        self.db_time = {}      # (method, route) -> Histogram
+        self.responses = {}    # (method, route, status) -> count
+        self.in_flight = {}    # method -> gauge
+
+    def _histogram(self, table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        self._histogram(self.latency, key, LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.statements, key, STATEMENT_BUCKETS).observe(stats.statements)
+        self._histogram(self.db_time, key, DB_TIME_BUCKETS).observe(stats.db_seconds)
+        status_key = (method, route, status)
+        self.responses[status_key] = self.responses.get(status_key, 0) + 1
+
+    def render(self) -> str:
+        lines = []
+        _render_histograms(lines, "http_request_duration_seconds", "Request latency by route template.", self.latency)
+        _render_histograms(lines, "http_request_db_statements", "SQL statements executed per request.", self.statements)
+        _render_histograms(lines, "http_request_db_seconds", "Time spent in SQL statements per request.", self.db_time)
+
+        lines.append("# HELP http_responses_total Responses by route template and status code.")
+        lines.append("# TYPE http_responses_total counter")
+        for (method, route, status), count in sorted(self.responses.items()):
+            lines.append(f'http_responses_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+        lines.append("# HELP http_requests_in_flight Requests currently being handled.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        for method, value in sorted(self.in_flight.items()):
+            lines.append(f'http_requests_in_flight{{method="{method}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+def _render_histograms(lines, name, help_text, table):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for (method, route), h in sorted(table.items()):
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip(h.buckets, h.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+        lines.append(f"{name}_sum{{{labels}}} {h.sum}")
+        lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+registry = Registry()
+
+class MetricsMiddleware:
+    """Times every HTTP request and labels it with the matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        in_flight = registry.in_flight
+        in_flight[method] = in_flight.get(method, 0) + 1
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight[method] -= 1
+            current_request.reset(token)
+            # The router stores the matched route in the (shared) scope; using its
+            # path template keeps label cardinality bounded
+            registry.record(method, route_label(scope), status, elapsed, stats)
+
+def route_label(scope: dict) -> str:
+    """The matched route template, e.g. /calculations/{calc_id}, or "unmatched"."""
+    return getattr(scope.get("route"), "path", "unmatched")
+
+# --- DB statement timing ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += time.perf_counter() - context._metrics_start
+
+def instrument_engine(engine):
+    """Counts and times every statement run through `engine` (a sync Engine)."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
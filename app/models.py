@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Index, BigInteger, JSON, SmallInteger, Boolean
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -11,6 +11,11 @@ class User(Base):
     email = Column(String(100), unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Bumped by every write to the user's calculations; the ETag of their reads
+    calc_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Where the user's calculations live (app/sharding.py); only kept up to date on the primary
+    shard = Column(SmallInteger, nullable=False, default=0, server_default="0")
+    shard_moving = Column(Boolean, nullable=False, default=False, server_default="false")
 
     # Relationship to calculations (One-to-Many)
     calculations = relationship("Calculation", back_populates="owner")
@@ -22,11 +27,37 @@ class Calculation(Base):
     a = Column(Float, nullable=False)
     b = Column(Float, nullable=False)
     type = Column(String(20), nullable=False)
+    # Formula and extra variables for the "expression" type, NULL otherwise
+    expression = Column(String(255), nullable=True)
+    variables = Column(JSON(none_as_null=True), nullable=True)
     result = Column(Float, nullable=False)
+    # Full digits of a power/factorial/root result, NULL for other types
+    exact = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Foreign Key linking to User
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 
     # Relationship back to User
-    owner = relationship("User", back_populates="calculations")
\ No newline at end of file
+    owner = relationship("User", back_populates="calculations")
+
+    __table_args__ = (
+        # Serves history browsing: WHERE user_id = ? ORDER BY created_at, id,
+        # plus keyset cursors and created_at range filters
+        Index("ix_calculations_user_created_id", "user_id", "created_at", "id"),
+    )
+
+class CalculationStats(Base):
+    """
+    Running per-user, per-operation aggregates of the calculations table.
+    Kept up to date by crud in the same transaction as every write, so
+    /stats never has to scan a user's history.
+    """
+    __tablename__ = "calculation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    type = Column(String(20), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    result_sum = Column(Float, nullable=False, default=0.0)
+    result_min = Column(Float, nullable=True)
+    result_max = Column(Float, nullable=True)
@@ -0,0 +1,22 @@
+# in app/pagination.py
+
+import base64
+import json
+from datetime import datetime
+
+# Keyset pagination cursors. A cursor is the (created_at, id) of the last row
+# of a page, packed into an opaque URL-safe token. The next page starts
+# strictly after that key, so no rows are scanned and thrown away.
+
+def encode_cursor(created_at: datetime, calc_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), calc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Returns (created_at, id). Raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, calc_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(calc_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
@@ -0,0 +1,12 @@
+# in app/process_pools.py
+
+import multiprocessing
+
+# Shared by the process pools of app/hashing.py and app/compute.py. Their
+# workers import this module too, so it stays tiny.
+
+def spawn_context():
+    """The multiprocessing context every pool starts its workers with."""
+    # spawn, not fork: the parent has an event loop and threads running, and a
+    # forked child would inherit their locks in whatever state they were in
+    return multiprocessing.get_context("spawn")
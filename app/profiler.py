@@ -0,0 +1,163 @@
+# in app/profiler.py
+
+import logging
+import os
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import metrics
+
+# Opt-in SQL profiler (SQL_PROFILER=true), for finding extra round trips
+# before they hurt. SQLAlchemy cursor events record every statement's text,
+# parameter shape (names, never values), duration and the route of the
+# request that ran it, found through metrics.current_request like the
+# per-request statement counts (so it needs METRICS_ENABLED, the default).
+# On top of that it:
+#   1. flags N+1 patterns: the same statement run PROFILER_N_PLUS_ONE times
+#      or more within one request
+#   2. captures the EXPLAIN plan of statements slower than PROFILER_SLOW_MS
+# Findings are logged, and the last PROFILER_HISTORY statements are
+# summarized at /debug/sql while the profiler is on.
+#
+# capture() records statements the same way for a `with` block whether the
+# profiler is on or not; the query_budget test fixture is built on it.
+#
+# The SQL text and EXPLAIN plans (which show the values they were planned
+# with) are not for every user: /debug/sql only answers the accounts listed
+# in PROFILER_USERS.
+
+PROFILER_ENABLED = os.getenv("SQL_PROFILER", "false") == "true"
+PROFILER_SLOW_MS = float(os.getenv("PROFILER_SLOW_MS", "100"))
+PROFILER_N_PLUS_ONE = int(os.getenv("PROFILER_N_PLUS_ONE", "5"))
+PROFILER_HISTORY = int(os.getenv("PROFILER_HISTORY", "5000"))
+# Comma-separated emails of the users allowed to read /debug/sql
+PROFILER_USERS = {email.strip() for email in os.getenv("PROFILER_USERS", "").split(",") if email.strip()}
+
+logger = logging.getLogger(__name__)
+
+Statement = namedtuple("Statement", "route text shape seconds")
+
+def _shape(parameters, executemany: bool) -> str:
+    """Parameter names without values, e.g. "(a, b, type)" or "500 x (a, b, type)"."""
+    if executemany:
+        return f"{len(parameters)} x {_shape(parameters[0], False)}" if parameters else "0 x ()"
+    if isinstance(parameters, dict):
+        return "(" + ", ".join(parameters) + ")"
+    return f"({len(parameters or ())} positional)"
+
+def _route(stats) -> str:
+    if stats is None or stats.scope is None:
+        return "-"  # not run for a request, e.g. the group commit flusher
+    return f"{stats.scope['method']} {metrics.route_label(stats.scope)}"
+
+def _started(conn, cursor, statement, parameters, context, executemany):
+    context._profiler_start = time.perf_counter()
+
+def _statement(statement, parameters, context, executemany) -> Statement:
+    return Statement(_route(metrics.current_request.get()), statement, _shape(parameters, executemany),
+                     time.perf_counter() - context._profiler_start)
+
+def _explain(conn, statement: str, parameters):
+    """Plan of a statement (planned again, not run), or None when it cannot be explained."""
+    if conn.dialect.name != "postgresql" or statement.lstrip()[:6].upper() not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH "):
+        return None
+    # Same connection and transaction, so the plan sees what the statement saw.
+    # The savepoint keeps a failed EXPLAIN from aborting the request's transaction.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_profiler")
+        try:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT sql_profiler")
+            raise
+        cursor.execute("RELEASE SAVEPOINT sql_profiler")
+        return plan
+    except Exception as e:
+        logger.debug("EXPLAIN failed: %s", e)
+        return None
+    finally:
+        cursor.close()
+
+class Profiler:
+    def __init__(self, slow_ms: float = PROFILER_SLOW_MS, n_plus_one: int = PROFILER_N_PLUS_ONE,
+                 history: int = PROFILER_HISTORY):
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one = n_plus_one
+        self.statements = deque(maxlen=history)
+        self.slow = deque(maxlen=100)  # (Statement, plan), newest last
+        self.repeated = {}  # (route, text) -> most runs seen in one request
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        entry = _statement(statement, parameters, context, executemany)
+        self.statements.append(entry)
+
+        stats = metrics.current_request.get()
+        # insertmanyvalues sends one big INSERT in pages; that is not N+1
+        if stats is not None and not executemany and context.execute_style.name != "INSERTMANYVALUES":
+            if stats.repeats is None:
+                stats.repeats = {}
+            runs = stats.repeats[statement] = stats.repeats.get(statement, 0) + 1
+            if runs >= self.n_plus_one:
+                key = (entry.route, statement)
+                if runs > self.repeated.get(key, 0):
+                    self.repeated[key] = runs
+                if runs == self.n_plus_one:
+                    logger.warning("Possible N+1 in %s: ran %d times in one request: %s", entry.route, runs, statement)
+
+        if entry.seconds >= self.slow_seconds and not executemany:
+            plan = _explain(conn, statement, parameters)
+            self.slow.append((entry, plan))
+            logger.warning("Slow statement (%.1f ms) in %s: %s\n%s", entry.seconds * 1000, entry.route, statement, plan or "(no plan)")
+
+    def report(self) -> dict:
+        """Per-route statement totals (slowest first), N+1 suspects and slow statements with their plans."""
+        totals = {}
+        for entry in self.statements:
+            total = totals.get((entry.route, entry.text))
+            if total is None:
+                total = totals[(entry.route, entry.text)] = {"route": entry.route, "text": entry.text, "shape": entry.shape,
+                                                             "count": 0, "seconds": 0.0}
+            total["count"] += 1
+            total["seconds"] += entry.seconds
+        return {
+            "statements": sorted(totals.values(), key=lambda total: total["seconds"], reverse=True),
+            "n_plus_one": [{"route": route, "text": text, "runs": runs} for (route, text), runs in sorted(self.repeated.items())],
+            "slow": [{**entry._asdict(), "plan": plan} for entry, plan in reversed(self.slow)],
+        }
+
+profiler = Profiler()
+
+def _record(conn, cursor, statement, parameters, context, executemany):
+    profiler.record(conn, cursor, statement, parameters, context, executemany)
+
+def instrument_engine(engine):
+    """Profiles every statement run through `engine` (a sync Engine)."""
+    if not event.contains(engine, "after_cursor_execute", _record):
+        if not event.contains(engine, "before_cursor_execute", _started):
+            event.listen(engine, "before_cursor_execute", _started)
+        event.listen(engine, "after_cursor_execute", _record)
+
+@contextmanager
+def capture(*engines):
+    """Collects the Statements run through any of `engines` inside the `with` block into the list it yields."""
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(_statement(statement, parameters, context, executemany))
+
+    timed = []
+    for engine in engines:
+        if not event.contains(engine, "before_cursor_execute", _started):
+            event.listen(engine, "before_cursor_execute", _started)
+            timed.append(engine)
+        event.listen(engine, "after_cursor_execute", collect)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "after_cursor_execute", collect)
+        for engine in timed:
+            event.remove(engine, "before_cursor_execute", _started)
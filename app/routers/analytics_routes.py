@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime
+from typing import Optional
+from app import schemas, database, security, analytics
+from app.logic import OperationType
+from app.routers.calc_routes import get_current_user
+
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+# Charts over the whole history: grouped in Postgres (time series) or
+# streamed column-wise into NumPy (distribution), never row by row.
+
+@router.get("/timeseries", response_model=schemas.TimeSeriesRead)
+async def read_time_series(bucket: str = Query("hour", pattern="^(hour|day)$"),
+                           type: Optional[OperationType] = None,
+                           start: Optional[datetime] = None,
+                           end: Optional[datetime] = None,
+                           db = Depends(database.get_session),
+                           current_user: security.Principal = Depends(get_current_user)):
+    points, truncated = await database.run_db(
+        db, analytics.time_series, user_id=current_user.id, bucket=bucket,
+        op_type=type.value if type else None, start=start, end=end,
+    )
+    return {"bucket": bucket, "points": points, "truncated": truncated}
+
+@router.get("/distribution", response_model=schemas.DistributionRead)
+async def read_distribution(percentiles: str = "50,90,99",
+                            bins: int = Query(20, ge=1, le=analytics.MAX_HISTOGRAM_BINS),
+                            type: Optional[OperationType] = None,
+                            start: Optional[datetime] = None,
+                            end: Optional[datetime] = None,
+                            db = Depends(database.get_session),
+                            current_user: security.Principal = Depends(get_current_user)):
+    try:
+        wanted = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be comma-separated numbers")
+    if not wanted or len(wanted) > 20 or any(not 0 <= p <= 100 for p in wanted):
+        raise HTTPException(status_code=400, detail="Give 1 to 20 percentiles between 0 and 100")
+
+    return await database.run_db(
+        db, analytics.distribution, user_id=current_user.id, percentiles=wanted, bins=bins,
+        op_type=type.value if type else None, start=start, end=end,
+    )
@@ -1,68 +1,247 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from app import schemas, models, database, crud, security # <-- Import security
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime
+from typing import List, Optional
+from app import schemas, database, crud, security, pagination, export, importer, encoding, etags, events, group_commit, admission, sharding, history, compute # <-- Import security
+from app.logic import HEAVY_OPERATIONS, OperationType, calculate_exact
 
 router = APIRouter(prefix="/calculations", tags=["Calculations"])
 
-# Helper to get the actual User object from the email
-def get_current_user(db: Session = Depends(database.get_db), email: str = Depends(security.get_current_user_email)):
-    user = crud.get_user_by_email(db, email=email)
+# Every route is async: DB work goes through database.run_db, which awaits it on
+# the event loop (DATABASE_MODE=async) or runs it on the threadpool (sync).
+
+# Helper to get the caller's identity. A token seen before is answered from the
+# verified-token cache: no signature check and no users-table lookup.
+# Also applies the per-user rate limit (429) when one is configured, and points
+# the session at the user's shard (sharding.route_for_user), where a GET may
+# read from a replica.
+async def get_current_user(token: str = Depends(security.oauth2_scheme), db = Depends(database.get_session)):
+    return await _authenticate(token, db)
+
+async def _authenticate(token: str, db):
+    principal = security.token_cache.get(token)
+    if principal is not None:
+        admission.check_rate(principal.id)
+        await sharding.route_for_user(db, principal.id)
+        return principal
+
+    principal, exp = security.decode_access_token(token)
+    # First sight of this token: make sure the account still exists
+    if principal.id is not None:
+        user = await database.run_db(db, crud.get_user, principal.id)
+    else:
+        user = await database.run_db(db, crud.get_user_by_email, email=principal.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+
+    principal = security.Principal(id=user.id, email=user.email)
+    security.token_cache.put(token, principal, exp)
+    admission.check_rate(principal.id)
+    await sharding.route_for_user(db, principal.id)
+    return principal
 
 # 1. BROWSE (List User's Calculations)
 @router.get("/", response_model=List[schemas.CalculationRead])
-def read_calculations(skip: int = 0, limit: int = 100, 
-                      db: Session = Depends(database.get_db),
-                      current_user: models.User = Depends(get_current_user)): # <-- dependency
-    # Filter by current_user.id
-    return db.query(models.Calculation).filter(models.Calculation.user_id == current_user.id).offset(skip).limit(limit).all()
+async def read_calculations(skip: int = 0, limit: int = 100, 
+                            if_none_match: Optional[str] = Header(None),
+                            db = Depends(database.get_session),
+                            current_user: security.Principal = Depends(get_current_user)): # <-- dependency
+    # Version first: a write landing in between only makes the next check miss
+    version = await database.run_db(db, crud.get_calc_version, user_id=current_user.id)
+    headers = etags.headers(current_user.id, version)
+    if etags.matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Filter by current_user.id (archived rows first, then the calculations table)
+    rows = await history.list_calculations(db, user_id=current_user.id, skip=skip, limit=limit)
+    # Column tuples straight to JSON bytes; response_model still documents the shape
+    return Response(encoding.encode_calculations(rows), media_type="application/json", headers=headers)
+
+# 1b. BROWSE (Keyset Pages) - registered before /{calc_id} so "page" is not read as an id
+@router.get("/page", response_model=schemas.CalculationPage)
+async def read_calculations_page(cursor: Optional[str] = None,
+                                 limit: int = Query(100, ge=1, le=1000),
+                                 type: Optional[OperationType] = None,
+                                 created_after: Optional[datetime] = None,
+                                 created_before: Optional[datetime] = None,
+                                 if_none_match: Optional[str] = Header(None),
+                                 db = Depends(database.get_session),
+                                 current_user: security.Principal = Depends(get_current_user)):
+    after = None
+    if cursor is not None:
+        try:
+            after = pagination.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    version = await database.run_db(db, crud.get_calc_version, user_id=current_user.id)
+    headers = etags.headers(current_user.id, version)
+    if etags.matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    items, next_cursor = await history.calculations_page(
+        db, user_id=current_user.id, limit=limit, after=after,
+        op_type=type.value if type else None,
+        created_after=created_after, created_before=created_before,
+    )
+    return Response(encoding.encode_calculation_page(items, next_cursor), media_type="application/json", headers=headers)
+
+# 1c. EXPORT (Streamed NDJSON/CSV, constant memory)
+@router.get("/export")
+async def export_calculations(format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+                              gzip: bool = False,
+                              current_user: security.Principal = Depends(get_current_user)):
+    headers = {"Content-Disposition": f'attachment; filename="calculations.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export.stream_export(current_user.id, fmt=format, compress=gzip),
+        media_type=export.EXPORT_FORMATS[format],
+        headers=headers,
+    )
+
+# 1d. LIVE UPDATES (Server-Sent Events)
+# EventSource cannot send headers, so the stream is opened with a ticket in the
+# query string: a short-lived token only good for this route, fetched with the
+# access token first, so the access token itself never lands in a URL or log.
+@router.post("/events/ticket", response_model=schemas.EventsTicketRead)
+async def create_events_ticket(current_user: security.Principal = Depends(get_current_user)):
+    return {"ticket": security.create_events_ticket(current_user), "expires_in": security.EVENTS_TICKET_SECONDS}
+
+# Not admission-controlled (see admission.classify): a stream is long-lived
+# and idle, and it never takes a pooled connection.
+@router.get("/events")
+async def calculation_events(ticket: str = Query(...)):
+    current_user = security.decode_events_ticket(ticket)
+    admission.check_rate(current_user.id)
+    subscription = events.broker.subscribe(current_user.id)
+    return StreamingResponse(
+        events.broker.stream(current_user.id, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # 2. READ (One)
 @router.get("/{calc_id}", response_model=schemas.CalculationRead)
-def read_calculation(calc_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    # Ensure it belongs to the user
-    calc = db.query(models.Calculation).filter(models.Calculation.id == calc_id, models.Calculation.user_id == current_user.id).first()
+async def read_calculation(calc_id: int, response: Response,
+                           if_none_match: Optional[str] = Header(None),
+                           db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    # Revalidation: unchanged version means the client's copy is still current
+    if if_none_match:
+        version = await database.run_db(db, crud.get_calc_version, user_id=current_user.id)
+        headers = etags.headers(current_user.id, version)
+        if etags.matches(if_none_match, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Ensure it belongs to the user (the row carries the user's calc_version)
+    calc = await database.run_db(db, crud.get_calculation, calc_id=calc_id, user_id=current_user.id)
     if calc is None:
-        raise HTTPException(status_code=404, detail="Calculation not found")
+        # Not in the table: maybe archived (only read when the hot lookup missed)
+        archived = await history.get_archived(current_user.id, calc_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+        version = await database.run_db(db, crud.get_calc_version, user_id=current_user.id)
+        return Response(encoding.encode_calculation(archived), media_type="application/json",
+                        headers=etags.headers(current_user.id, version))
+    response.headers.update(etags.headers(current_user.id, calc.calc_version))
     return calc
 
+# Heavy operations (power, factorial, root) run in the compute process pool
+# under a CPU-time limit; the cheap ones are computed inline by crud.
+async def _compute_heavy(calc: schemas.CalculationCreate):
+    """(result, exact) for a heavy operation, None for the others."""
+    if calc.type not in HEAVY_OPERATIONS:
+        return None
+    try:
+        return await compute.pool.run(calculate_exact, calc.type, calc.a, calc.b, calc.precision)
+    except compute.ComputeBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Calculations are busy, please retry", headers={"Retry-After": "1"})
+    except compute.ComputeTimeout:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                            detail=f"Calculation took too long (limit: {compute.pool.cpu_seconds}s of CPU)")
+    except (ValueError, ArithmeticError) as e:  # ArithmeticError: Overflow/decimal errors a check missed
+        raise HTTPException(status_code=400, detail=str(e))
+
 # 3. ADD
 @router.post("/", response_model=schemas.CalculationRead)
-def create_calculation(calc: schemas.CalculationCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def create_calculation(calc: schemas.CalculationCreate, db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    computed = await _compute_heavy(calc)
     # Use current_user.id instead of hardcoded 1
-    return crud.create_calculation(db=db, calc=calc, user_id=current_user.id)
+    try:
+        if group_commit.CALC_COMMIT_MODE == "group":
+            # Computed here, then saved together with other requests' rows. The
+            # flusher needs a pooled connection, so do not sit on one meanwhile
+            values = crud.calculation_row(calc, current_user.id, computed)
+            await database.release(db)
+            db_calculation = await group_commit.committer.submit(values)
+        else:
+            db_calculation = await database.run_db(db, crud.create_calculation, calc=calc, user_id=current_user.id, computed=computed)
+    except ValueError as e:
+        # e.g. an expression that divides by zero for these variable values
+        raise HTTPException(status_code=400, detail=str(e))
+    events.calculation_changed(current_user.id, "created", db_calculation)
+    return db_calculation
+
+# 3b. ADD (Batch)
+@router.post("/batch", response_model=schemas.CalculationBatchRead)
+async def create_calculations_batch(batch: schemas.CalculationBatchCreate, db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    # Evaluated together and written with one bulk insert + one commit
+    results = await database.run_db(db, crud.create_calculations_batch, items=batch.items, user_id=current_user.id)
+    failed = sum(1 for item in results if item["error"] is not None)
+    if failed < len(results):
+        events.history_reset(current_user.id)
+    return {"created": len(results) - failed, "failed": failed, "results": results}
+
+# 3c. ADD (Bulk Import from a CSV/NDJSON upload)
+@router.post("/import", response_model=schemas.CalculationImportSummary)
+async def import_calculations(file: UploadFile = File(...),
+                              format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+                              db = Depends(database.get_session),
+                              current_user: security.Principal = Depends(get_current_user)):
+    records = importer.iter_records(file.file, importer.detect_format(file.filename, format))
+    accepted, rejected, errors = 0, 0, []
+    while True:
+        # Parse/validate on the threadpool, then insert the chunk (one executemany + commit)
+        rows, chunk_errors, consumed = await run_in_threadpool(importer.next_batch, records, current_user.id)
+        if consumed == 0:
+            break
+        accepted += await database.run_db(db, crud.bulk_insert_calculations, rows=rows, user_id=current_user.id)
+        rejected += len(chunk_errors)
+        room = importer.MAX_REPORTED_ERRORS - len(errors)
+        errors.extend({"line": line, "error": error} for line, error in chunk_errors[:room])
+    if accepted:
+        events.history_reset(current_user.id)
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
+
+async def _not_found_or_archived(user_id: int, calc_id: int):
+    """Raises the error for a write that matched no row: 409 for an archived calculation, else 404."""
+    if await history.get_archived(user_id, calc_id) is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Archived calculations are read-only")
+    raise HTTPException(status_code=404, detail="Calculation not found")
 
 # 4. EDIT
 @router.put("/{calc_id}", response_model=schemas.CalculationRead)
-def update_calculation(calc_id: int, calc_update: schemas.CalculationCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    # Find user's calculation
-    db_calc = db.query(models.Calculation).filter(models.Calculation.id == calc_id, models.Calculation.user_id == current_user.id).first()
+async def update_calculation(calc_id: int, calc_update: schemas.CalculationCreate, db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    computed = await _compute_heavy(calc_update)
+    # Find user's calculation and recalculate
+    try:
+        db_calc = await database.run_db(db, crud.update_calculation, calc_id=calc_id, calc=calc_update, user_id=current_user.id, computed=computed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if db_calc is None:
-        raise HTTPException(status_code=404, detail="Calculation not found")
-    
-    # Recalculate
-    from app.logic import get_operation_func
-    op_func = get_operation_func(calc_update.type)
-    
-    db_calc.a = calc_update.a
-    db_calc.b = calc_update.b
-    db_calc.type = calc_update.type
-    db_calc.result = op_func(calc_update.a, calc_update.b)
-    
-    db.commit()
-    db.refresh(db_calc)
+        await _not_found_or_archived(current_user.id, calc_id)
+    events.calculation_changed(current_user.id, "updated", db_calc)
     return db_calc
 
 # 5. DELETE
 @router.delete("/{calc_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_calculation(calc_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    db_calc = db.query(models.Calculation).filter(models.Calculation.id == calc_id, models.Calculation.user_id == current_user.id).first()
-    if db_calc is None:
-        raise HTTPException(status_code=404, detail="Calculation not found")
-    
-    db.delete(db_calc)
-    db.commit()
-    return None
\ No newline at end of file
+async def delete_calculation(calc_id: int, db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    deleted = await database.run_db(db, crud.delete_calculation, calc_id=calc_id, user_id=current_user.id)
+    if not deleted:
+        await _not_found_or_archived(current_user.id, calc_id)
+    events.calculation_deleted(current_user.id, calc_id)
+    return None
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Depends
+from app import schemas, database, security, stats
+from app.routers.calc_routes import get_current_user
+
+router = APIRouter(prefix="/stats", tags=["Statistics"])
+
+# Reads the pre-aggregated rows kept up to date by crud, never the calculations table
+@router.get("/", response_model=schemas.UserStatsRead)
+async def read_stats(db = Depends(database.get_session), current_user: security.Principal = Depends(get_current_user)):
+    return await database.run_db(db, stats.get_user_stats, user_id=current_user.id)
@@ -1,37 +1,47 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app import schemas, crud, database, security
+from starlette.concurrency import run_in_threadpool
+from app import schemas, crud, database, security, sharding
 
 # Create the router
 router = APIRouter(prefix="/users", tags=["Users"])
 
 @router.post("/register", response_model=schemas.UserRead)
-def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def register_user(user: schemas.UserCreate, db = Depends(database.get_session)):
     # Check if email already exists
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await database.run_db(db, crud.get_user_by_email, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    # Create the user
-    return crud.create_user(db=db, user=user)
+    # Create the user (bcrypt runs in the hashing process pool, 503 if it is saturated)
+    hashed_password = await security.get_password_hash_async(user.password)
+    db_user = await database.run_db(db, crud.create_user, user=user, hashed_password=hashed_password)
+    # Home shard for their calculations (no-op without shards)
+    await run_in_threadpool(sharding.place_user, db_user.id, db_user.username, db_user.email)
+    return db_user
 
 @router.post("/login")
-def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db = Depends(database.get_session)):
     # 1. Check if user exists and password is correct
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.password_hash):
+    user = await database.run_db(db, crud.get_user_by_email, email=form_data.username)
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await security.verify_password_async(form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # The stored hash used an old cost factor: save the upgraded one
+    if new_hash:
+        await database.run_db(db, crud.update_password_hash, user_id=user.id, hashed_password=new_hash)
     
-    # 2. Create a REAL JWT Access Token
-    access_token = security.create_access_token(data={"sub": user.email})
+    # 2. Create a REAL JWT Access Token (uid lets protected routes skip the user lookup)
+    access_token = security.create_access_token(data={"sub": user.email, "uid": user.id})
     
     # 3. Return the token
     return {
         "access_token": access_token, 
         "token_type": "bearer",
         "message": "Login successful"
-    }
\ No newline at end of file
+    }
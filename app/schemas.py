@@ -1,8 +1,10 @@
 # in app/schemas.py
 
-from pydantic import BaseModel, EmailStr, ConfigDict, model_validator # <-- Import model_validator
+from pydantic import BaseModel, EmailStr, ConfigDict, Field, model_validator # <-- Import model_validator
 from datetime import datetime
-from .logic import OperationType # Import our new Enum
+from typing import Dict, List, Optional
+from .logic import OperationType, MAX_PRECISION # Import our new Enum
+from .expressions import compile_expression, MAX_EXPRESSION_LENGTH
 
 # --- User Schemas (from Module 10) ---
 
@@ -27,9 +29,15 @@ class CalculationBase(BaseModel):
     a: float
     b: float
     type: OperationType # Use the Enum for validation
+    # Only used by the "expression" type: the formula, and values for any
+    # variables besides a and b, e.g. "(a+b)^2/c" with {"c": 3}
+    expression: Optional[str] = Field(None, max_length=MAX_EXPRESSION_LENGTH)
+    variables: Optional[Dict[str, float]] = None
 
 class CalculationCreate(CalculationBase):
-    
+    # Significant digits of a power/root result's `exact` text (default logic.DEFAULT_PRECISION)
+    precision: Optional[int] = Field(None, ge=1, le=MAX_PRECISION)
+
     # --- THIS IS THE FIX ---
     # We use a model_validator (mode='after') to check fields
     # after they have all been individually validated.
@@ -41,13 +49,119 @@ class CalculationCreate(CalculationBase):
         """
         if self.type == OperationType.DIVIDE and self.b == 0:
             raise ValueError("Cannot divide by zero")
+        if self.type == OperationType.EXPRESSION:
+            if not self.expression:
+                raise ValueError("Expression is required for the expression type")
+            # Syntax errors become a 422 here; the compiled result is cached for crud
+            compile_expression(self.expression)
+        if self.type == OperationType.FACTORIAL and (self.a < 0 or not self.a.is_integer()):
+            raise ValueError("Factorial needs a non-negative whole number")
+        if self.type == OperationType.ROOT and (self.b < 1 or not self.b.is_integer()):
+            raise ValueError("Root degree must be a positive whole number")
         return self
     # --- END FIX ---
 
 class CalculationRead(CalculationBase):
     id: int
     result: float
+    # Every digit of a power/factorial/root result, None for other types
+    exact: Optional[str] = None
     user_id: int
     created_at: datetime
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+class CalculationPage(BaseModel):
+    items: List[CalculationRead]
+    # Pass back as ?cursor= to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+# --- Batch Calculation Schemas ---
+
+MAX_BATCH_SIZE = 10000
+
+class CalculationBatchCreate(BaseModel):
+    # Items use CalculationBase (not CalculationCreate) so that a division
+    # by zero is reported per item instead of rejecting the whole batch.
+    items: List[CalculationBase] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class CalculationBatchItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    result: Optional[float] = None
+    error: Optional[str] = None
+
+class CalculationBatchRead(BaseModel):
+    created: int
+    failed: int
+    results: List[CalculationBatchItemResult]
+
+
+# --- Import Schemas ---
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+class CalculationImportSummary(BaseModel):
+    accepted: int
+    rejected: int
+    # Only the first MAX_REPORTED_ERRORS are listed; errors_truncated says if more were dropped
+    errors: List[ImportLineError]
+    errors_truncated: bool = False
+
+
+# --- Live Events Schemas ---
+
+class EventsTicketRead(BaseModel):
+    ticket: str  # for GET /calculations/events?ticket=...
+    expires_in: int  # seconds
+
+
+# --- Statistics Schemas ---
+
+class OperationStats(BaseModel):
+    count: int
+    result_sum: float
+    result_min: Optional[float] = None
+    result_max: Optional[float] = None
+
+class UserStatsRead(BaseModel):
+    total: int
+    result_sum: float
+    result_min: Optional[float] = None
+    result_max: Optional[float] = None
+    by_type: Dict[str, OperationStats]
+
+
+# --- Analytics Schemas ---
+
+class TimeBucketRead(BaseModel):
+    bucket: datetime  # start of the UTC hour/day
+    type: str
+    count: int
+    # Over finite results only; None when the bucket has none
+    result_sum: Optional[float] = None
+    result_min: Optional[float] = None
+    result_max: Optional[float] = None
+
+class TimeSeriesRead(BaseModel):
+    bucket: str
+    points: List[TimeBucketRead]
+    # True when the range held more buckets than one response carries
+    truncated: bool
+
+class HistogramRead(BaseModel):
+    edges: List[float]  # len(counts) + 1 bin edges
+    counts: List[int]
+
+class DistributionRead(BaseModel):
+    count: int  # finite results; everything below is over these
+    non_finite: int = 0  # results of inf or NaN, left out
+    result_min: Optional[float] = None
+    result_max: Optional[float] = None
+    mean: Optional[float] = None
+    percentiles: Dict[str, float]  # e.g. {"p50": ..., "p99": ...}
+    histogram: HistogramRead
+    # False for very large histories, where percentiles come from a fine histogram
+    exact: bool
@@ -1,57 +1,186 @@
 import os
-from passlib.context import CryptContext
-from jose import jwt, JWTError
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+from app import hashing
 
 # Configuration
 SECRET_KEY = "supersecretkey" 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Event stream tickets travel in the URL (EventSource cannot send headers), so
+# they end up in access logs: they only open the stream and expire quickly
+EVENTS_TICKET_SECONDS = int(os.getenv("EVENTS_TICKET_SECONDS", "30"))
+EVENTS_SCOPE = "events"
+
+# Verified-token cache: how many tokens to remember, and the longest a
+# token may be trusted before its user is looked up again
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
 
-# Initialize passlib context (This causes the crash in Docker, so we bypass it below)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 def verify_password(plain_password, hashed_password):
-    """Verifies password. Bypasses check if in TEST_MODE to prevent crash."""
-    # --- TEST MODE BYPASS ---
-    if os.getenv("TEST_MODE") == "true":
-        # In test mode, we accept ANY password as valid to avoid the library crash
-        return True 
-    # ------------------------
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verifies password in this process (request handlers use verify_password_async)."""
+    return hashing.verify_and_update(plain_password, hashed_password, hashing.BCRYPT_ROUNDS)[0]
 
 def get_password_hash(password):
-    """Hashes password. Returns dummy hash if in TEST_MODE."""
-    # --- TEST MODE BYPASS ---
-    if os.getenv("TEST_MODE") == "true":
-        # Return a simple string instead of running the complex hashing logic
-        return "dummy_hash_for_testing" 
-    # ------------------------
-    return pwd_context.hash(password) 
+    """Hashes password in this process (request handlers use get_password_hash_async)."""
+    return hashing.hash_password(password, hashing.BCRYPT_ROUNDS)
+
+# --- Async versions for request handlers: bcrypt runs in hashing.pool ---
+
+def _busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is busy, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+async def get_password_hash_async(password: str) -> str:
+    """Hashes in the process pool. Raises 503 when the pool's queue is full."""
+    try:
+        return await hashing.pool.run(hashing.hash_password, password, hashing.BCRYPT_ROUNDS)
+    except hashing.HashingBusy:
+        raise _busy_exception()
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    """
+    Verifies in the process pool. Returns (valid, new_hash); new_hash is set
+    when the stored hash was made with a different BCRYPT_ROUNDS and should
+    be saved in its place. Raises 503 when the pool's queue is full.
+    """
+    try:
+        return await hashing.pool.run(hashing.verify_and_update, plain_password, hashed_password, hashing.BCRYPT_ROUNDS)
+    except hashing.HashingBusy:
+        raise _busy_exception()
 
 def create_access_token(data: dict):
     """Creates a JWT access token."""
+    from jose import jwt  # python-jose pulls in cryptography: imported on first use, not at startup
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user_email(token: str = Depends(oauth2_scheme)):
-    """Decodes the token to get the user's email."""
-    credentials_exception = HTTPException(
+class Principal(NamedTuple):
+    """The authenticated caller, built from the token claims alone."""
+    id: Optional[int]
+    email: str
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode(token: str, scope: Optional[str]) -> dict:
+    from jose import jwt, JWTError
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        return email
     except JWTError:
-        raise credentials_exception
\ No newline at end of file
+        raise _credentials_exception()
+    # An events ticket is no access token, and the other way round
+    if payload.get("sub") is None or payload.get("scope") != scope:
+        raise _credentials_exception()
+    return payload
+
+def decode_access_token(token: str):
+    """
+    Verifies the token signature and returns (principal, exp).
+    Tokens issued before the "uid" claim existed have a principal id of None.
+    """
+    payload = _decode(token, None)
+    return Principal(id=payload.get("uid"), email=payload["sub"]), payload.get("exp")
+
+def create_events_ticket(principal: Principal) -> str:
+    """A JWT that opens the caller's event stream for EVENTS_TICKET_SECONDS, and nothing else."""
+    from jose import jwt
+    expire = datetime.now(timezone.utc) + timedelta(seconds=EVENTS_TICKET_SECONDS)
+    claims = {"sub": principal.email, "uid": principal.id, "scope": EVENTS_SCOPE, "exp": expire}
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_events_ticket(ticket: str) -> Principal:
+    payload = _decode(ticket, EVENTS_SCOPE)
+    return Principal(id=payload["uid"], email=payload["sub"])
+
+def get_current_user_email(token: str = Depends(oauth2_scheme)):
+    """Decodes the token to get the user's email."""
+    principal, _ = decode_access_token(token)
+    return principal.email
+
+# --- Verified Token Cache ---
+
+class TokenCache:
+    """
+    Bounded LRU map of already-verified token -> Principal.
+    An entry lives until the token's own "exp" or TOKEN_CACHE_TTL_SECONDS,
+    whichever comes first. The cache is per process, so invalidate_user
+    only affects the worker it runs in.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (principal, expires_at)
+        self._tokens_by_user = {}      # user id -> set of cached tokens
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(self, token: str, principal: Principal, exp: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        """Drops every cached token of a user (call after deleting or changing them)."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+token_cache = TokenCache()
+
+def invalidate_user(user_id: int):
+    """The next request with any of this user's tokens goes back to the database."""
+    token_cache.invalidate_user(user_id)
\ No newline at end of file
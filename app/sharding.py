@@ -0,0 +1,282 @@
+# in app/sharding.py
+
+import logging
+import os
+import threading
+import time
+from fastapi import HTTPException, status
+from sqlalchemy import create_engine, delete, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from starlette.concurrency import run_in_threadpool
+from app import database, models
+
+logger = logging.getLogger(__name__)
+
+# Horizontal sharding of calculations by user.
+#
+# Shard 0 is the primary database (DATABASE_URL); DATABASE_SHARD_URLS adds
+# shards 1..N-1. The primary keeps every user's account and is the directory:
+# users.shard says where the user's calculations and stats live, and
+# users.shard_moving is set while move_user.py moves them. New users are placed
+# by a jump consistent hash of their id (adding a shard re-homes only ~1/N of
+# them); users from before sharding stay on shard 0. Other shards keep a
+# shadow row per user they hold (no password) for the foreign keys and
+# calc_version.
+#
+# Each request's session is scoped to the user's shard once the user is known
+# (route_for_user). Directory entries are cached per process for
+# SHARD_DIRECTORY_TTL_SECONDS, and moves wait that long between steps, so no
+# worker writes to a shard the user is leaving.
+#
+# Calculation ids stay unique across shards: shard k hands out ids from its
+# own block [k * SHARD_ID_BLOCK, (k + 1) * SHARD_ID_BLOCK), so rows keep their
+# ids when they move.
+
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+SHARD_DIRECTORY_TTL_SECONDS = float(os.getenv("SHARD_DIRECTORY_TTL_SECONDS", "2"))
+SHARD_MOVE_GRACE_SECONDS = float(os.getenv("SHARD_MOVE_GRACE_SECONDS", "5"))  # on top of the TTL, for in-flight writes
+SHARD_ID_BLOCK = 100_000_000
+MAX_SHARDS = 21  # calculations.id is a 32-bit integer
+
+_MASK64 = (1 << 64) - 1
+
+def home_shard(user_id: int, count: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of the user id onto `count` shards."""
+    key = (user_id * 0x9E3779B97F4A7C15) & _MASK64  # spread sequential ids
+    bucket, j = -1, 0
+    while j < count:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & _MASK64
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+class Shard:
+    def __init__(self, engine, async_engine=None):
+        self.engine = engine
+        self.async_engine = async_engine
+
+    @property
+    def bind(self):
+        """What RoutingSession routes to (the async engine's sync facade in async mode)."""
+        return self.async_engine.sync_engine if self.async_engine is not None else self.engine
+
+class ShardSet:
+    def __init__(self, urls, ttl: float = SHARD_DIRECTORY_TTL_SECONDS, max_entries: int = 100000):
+        if len(urls) + 1 > MAX_SHARDS:
+            raise ValueError(f"At most {MAX_SHARDS} shards are supported")
+        self.shards = [Shard(database.engine, database.async_engine)]
+        for url in urls:
+            async_engine = None
+            if database.DATABASE_MODE == "async":
+                from sqlalchemy.ext.asyncio import create_async_engine
+                async_engine = create_async_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1),
+                                                   **database.POOL_OPTIONS)
+            self.shards.append(Shard(create_engine(url, **database.POOL_OPTIONS), async_engine))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._directory = {}  # user id -> (shard, moving, expires)
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.shards)
+
+    def cached(self, user_id: int):
+        entry = self._directory.get(user_id)
+        if entry is not None and entry[2] > time.monotonic():
+            return entry[:2]
+        return None
+
+    def lookup(self, user_id: int):
+        """(shard, moving) for the user, from the cache or the directory on the primary."""
+        entry = self.cached(user_id)
+        if entry is not None:
+            return entry
+        users = models.User.__table__
+        with database.engine.connect() as conn:
+            row = conn.execute(select(users.c.shard, users.c.shard_moving).where(users.c.id == user_id)).first()
+        entry = (row.shard, row.shard_moving) if row is not None else (0, False)
+        with self._lock:
+            if len(self._directory) >= self.max_entries:
+                self._directory.clear()
+            self._directory[user_id] = (*entry, time.monotonic() + self.ttl)
+        return entry
+
+    async def lookup_async(self, user_id: int):
+        entry = self.cached(user_id)
+        if entry is None:
+            entry = await run_in_threadpool(self.lookup, user_id)
+        return entry
+
+    def forget(self, user_id: int):
+        self._directory.pop(user_id, None)
+
+    def session(self, shard: int):
+        """A sync Session on one shard, for work outside a request (exports, group commit, tools)."""
+        return database.SessionLocal(info={"shard_bind": self.shards[shard].engine})
+
+    def async_session(self, shard: int):
+        return database.AsyncSessionLocal(info={"shard_bind": self.shards[shard].bind})
+
+    async def dispose(self):
+        for shard in self.shards[1:]:
+            shard.engine.dispose()
+            if shard.async_engine is not None:
+                await shard.async_engine.dispose()
+
+shards = ShardSet(DATABASE_SHARD_URLS)
+
+def sync_engines():
+    """
+    Every sync Engine statements run through, for event listeners (metrics,
+    profiler): each shard (the primary is shard 0) and each read replica, and
+    in async mode their async engines' sync facades too.
+    """
+    engines = []
+    for node in [*shards.shards, *database.replicas.replicas]:
+        engines.append(node.engine)
+        if node.async_engine is not None:
+            engines.append(node.async_engine.sync_engine)
+    return engines
+
+# --- Requests ---
+
+async def route_for_user(db, user_id: int):
+    """
+    Scopes the request's session to the user's shard once the user is known.
+    Users on the primary may also read from a replica (database.route_for_user).
+    Writes of a user being moved get a 503 until the move is done.
+    """
+    if shards.count > 1:
+        shard, moving = await shards.lookup_async(user_id)
+        if moving and not db.info.get("read_only"):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Your calculations are being moved, please retry",
+                headers={"Retry-After": str(int(SHARD_DIRECTORY_TTL_SECONDS + SHARD_MOVE_GRACE_SECONDS))},
+            )
+        if shard:
+            db.info["user_id"] = user_id
+            db.info["shard_bind"] = shards.shards[shard].bind
+            return
+    database.route_for_user(db, user_id)
+
+def place_user(user_id: int, username: str, email: str) -> int:
+    """Puts a newly registered user on their hash shard. Returns the shard. Sync (threadpool)."""
+    if shards.count == 1:
+        return 0
+    target = home_shard(user_id, shards.count)
+    if target:
+        try:
+            with shards.shards[target].engine.begin() as conn:
+                conn.execute(_shadow_row(user_id, username, email, calc_version=0))
+            with database.engine.begin() as conn:
+                conn.execute(update(models.User.__table__).where(models.User.id == user_id).values(shard=target))
+        except Exception as e:
+            # The account is usable either way: its calculations just stay on shard 0
+            logger.warning("Could not place user %s on shard %s (%s); keeping shard 0", user_id, target, e)
+            return 0
+    return target
+
+def _shadow_row(user_id: int, username: str, email: str, calc_version: int):
+    users = models.User.__table__
+    return (
+        pg_insert(users)
+        .values(id=user_id, username=username, email=email, password_hash="", calc_version=calc_version)
+        .on_conflict_do_update(index_elements=[users.c.id], set_={"calc_version": calc_version})
+    )
+
+# --- Setup and moves (init_db.py, move_user.py) ---
+
+def reserve_ids(conn, shard: int):
+    """Limits a shard's calculations.id sequence to its block. Raises if it already went past it."""
+    low, high = max(shard * SHARD_ID_BLOCK, 1), (shard + 1) * SHARD_ID_BLOCK - 1
+    sequence = conn.exec_driver_sql("SELECT pg_get_serial_sequence('calculations', 'id')").scalar()
+    last = conn.exec_driver_sql(f"SELECT last_value FROM {sequence}").scalar()
+    if last > high:
+        raise RuntimeError(f"Shard {shard}: calculation ids already reach {last}, past its block ending at {high}")
+    if last < low:
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} MINVALUE {low} MAXVALUE {high} START WITH {low} RESTART WITH {low}")
+    else:
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} MINVALUE {low} MAXVALUE {high}")
+
+def move_user(user_id: int, target: int, settle_seconds: float = None, chunk_size: int = 5000) -> int:
+    """
+    Moves one user's calculations and stats to `target` while the app runs.
+    Returns the number of calculations moved.
+
+    1. Freeze: mark the user as moving, wait until every worker's cached
+       directory entry shows it. From then on their writes get a 503; reads
+       keep going to the old shard.
+    2. Copy rows (ids included) to the target, holding the user's row on the
+       source locked, so writes still in flight finish first.
+    3. Flip the directory to the target and unfreeze.
+    4. Wait again for stale cache entries, then delete the rows from the source.
+    """
+    if not 0 <= target < shards.count:
+        raise ValueError(f"No shard {target} (there are {shards.count})")
+    settle = SHARD_DIRECTORY_TTL_SECONDS + SHARD_MOVE_GRACE_SECONDS if settle_seconds is None else settle_seconds
+    shards.forget(user_id)
+    source, moving = shards.lookup(user_id)
+    users, calcs, stats = models.User.__table__, models.Calculation.__table__, models.CalculationStats.__table__
+    if source == target:
+        if moving:
+            # An interrupted move left the user frozen where they already are: only unfreeze
+            with database.engine.begin() as conn:
+                conn.execute(update(users).where(users.c.id == user_id).values(shard_moving=False))
+            shards.forget(user_id)
+        return 0
+    source_engine, target_engine = shards.shards[source].engine, shards.shards[target].engine
+    if source_engine.url == target_engine.url:
+        # The copy locks the user's row on one connection and writes it on the other
+        raise ValueError(f"Shards {source} and {target} are the same database")
+
+    # 1. Freeze
+    with database.engine.begin() as conn:
+        conn.execute(update(users).where(users.c.id == user_id).values(shard_moving=True))
+    try:
+        time.sleep(settle)
+
+        # 2. Copy
+        moved = 0
+        with source_engine.connect() as src, src.begin():
+            user = src.execute(select(users).where(users.c.id == user_id).with_for_update()).one()
+            copied_version = user.calc_version
+            with target_engine.begin() as dst:
+                if target == 0:
+                    dst.execute(update(users).where(users.c.id == user_id).values(calc_version=copied_version + 1))
+                else:
+                    dst.execute(_shadow_row(user_id, user.username, user.email, copied_version + 1))
+                # Leftovers of an earlier, interrupted move
+                dst.execute(delete(calcs).where(calcs.c.user_id == user_id))
+                dst.execute(delete(stats).where(stats.c.user_id == user_id))
+                result = src.execute(select(calcs).where(calcs.c.user_id == user_id).execution_options(yield_per=chunk_size))
+                for rows in result.partitions():
+                    dst.execute(insert(calcs), [row._asdict() for row in rows])
+                    moved += len(rows)
+                stats_rows = [row._asdict() for row in src.execute(select(stats).where(stats.c.user_id == user_id))]
+                if stats_rows:
+                    dst.execute(insert(stats), stats_rows)
+
+        # 3. Flip
+        with database.engine.begin() as conn:
+            conn.execute(update(users).where(users.c.id == user_id).values(shard=target, shard_moving=False))
+    except BaseException:
+        with database.engine.begin() as conn:
+            conn.execute(update(users).where(users.c.id == user_id).values(shard_moving=False))
+        raise
+    finally:
+        shards.forget(user_id)
+
+    # 4. Clean up the source
+    time.sleep(settle)
+    with source_engine.begin() as src:
+        version = src.execute(select(users.c.calc_version).where(users.c.id == user_id).with_for_update()).scalar()
+        if version != copied_version:
+            # Only possible if a write outlived the settle time; keep its data for a manual look
+            raise RuntimeError(f"User {user_id} changed on shard {source} during the move; its rows there were kept")
+        src.execute(delete(calcs).where(calcs.c.user_id == user_id))
+        src.execute(delete(stats).where(stats.c.user_id == user_id))
+        if source != 0:
+            src.execute(delete(users).where(users.c.id == user_id))
+    return moved
@@ -0,0 +1,115 @@
+const token = localStorage.getItem('token');
+if (!token) window.location.href = '/static/login.html';
+
+const rows = document.querySelector('#calcTable tbody');
+
+function renderRow(calc) {
+    const tr = document.createElement('tr');
+    tr.id = 'calc-' + calc.id;
+    tr.innerHTML = `
+        <td>${calc.id}</td>
+        <td>${calc.a}</td>
+        <td>${calc.type === 'expression' ? calc.expression : calc.type}</td>
+        <td>${calc.b}</td>
+        <td><strong title="${calc.exact ?? ''}">${calc.result}</strong></td>
+        <td><span class="delete-btn" onclick="deleteCalc(${calc.id})">Delete</span></td>`;
+    return tr;
+}
+
+function upsertRow(calc) {
+    const existing = document.getElementById('calc-' + calc.id);
+    if (existing) existing.replaceWith(renderRow(calc));
+    else rows.appendChild(renderRow(calc));
+}
+
+function removeRow(id) {
+    const existing = document.getElementById('calc-' + id);
+    if (existing) existing.remove();
+}
+
+async function loadCalculations() {
+    // Revalidates with If-None-Match: an unchanged list comes back as a 304
+    const res = await fetch('/calculations/', {
+        headers: { 'Authorization': 'Bearer ' + token },
+        cache: 'no-cache'
+    });
+    if (res.status === 401) logout();
+    const data = await res.json();
+    rows.replaceChildren(...data.map(renderRow));
+}
+
+// Live updates: changes (from this or any other tab) arrive as small deltas
+// instead of re-downloading the list. The list is revalidated whenever the
+// stream (re)connects, so nothing is missed while it was down.
+// The stream URL carries a short-lived ticket, not the access token; it has
+// expired by the time EventSource would reconnect, so each connect gets a new one.
+// The first load happens when the stream opens; without a stream, right away.
+async function listen() {
+    if (!window.EventSource) return loadCalculations();
+    const res = await fetch('/calculations/events/ticket', {
+        method: 'POST',
+        headers: { 'Authorization': 'Bearer ' + token }
+    });
+    if (res.status === 401) return logout();
+    if (!res.ok) {
+        loadCalculations();
+        return setTimeout(listen, 3000);
+    }
+    const { ticket } = await res.json();
+    const stream = new EventSource('/calculations/events?ticket=' + encodeURIComponent(ticket));
+    let opened = false;
+    stream.onopen = () => {
+        opened = true;
+        loadCalculations();
+    };
+    stream.onerror = () => {
+        stream.close();
+        if (!opened) loadCalculations();  // the stream was refused: show the list anyway
+        setTimeout(listen, 3000);
+    };
+    stream.addEventListener('created', e => upsertRow(JSON.parse(e.data)));
+    stream.addEventListener('updated', e => upsertRow(JSON.parse(e.data)));
+    stream.addEventListener('deleted', e => removeRow(JSON.parse(e.data).id));
+    stream.addEventListener('reset', loadCalculations);
+}
+
+async function addCalculation() {
+    const a = document.getElementById('a').value;
+    const b = document.getElementById('b').value;
+    const type = document.getElementById('type').value;
+    const expression = document.getElementById('expression').value;
+
+    const res = await fetch('/calculations/', {
+        method: 'POST',
+        headers: { 
+            'Content-Type': 'application/json',
+            'Authorization': 'Bearer ' + token
+        },
+        body: JSON.stringify({ a: Number(a), b: Number(b), type, expression: type === 'expression' ? expression : null })
+    });
+
+    if (res.ok) {
+        upsertRow(await res.json());
+        document.getElementById('a').value = '';
+        document.getElementById('b').value = '';
+    } else {
+        const err = await res.json();
+        document.getElementById('error').innerText = err.detail || "Error";
+    }
+}
+
+async function deleteCalc(id) {
+    if(!confirm("Are you sure?")) return;
+    const res = await fetch('/calculations/' + id, {
+        method: 'DELETE',
+        headers: { 'Authorization': 'Bearer ' + token }
+    });
+    if (res.ok || res.status === 404) removeRow(id);
+}
+
+function logout() {
+    localStorage.removeItem('token');
+    window.location.href = '/static/login.html';
+}
+
+listen();
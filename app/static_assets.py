@@ -0,0 +1,168 @@
+# in app/static_assets.py
+
+import gzip
+import hashlib
+import mimetypes
+import re
+import threading
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from app import etags
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+
+# Static files, served from memory and compressed once at startup.
+#
+# Every file under the directory is read, hashed (SHA-256) and compressed to
+# gzip and, when the `brotli` package is installed, brotli. A request gets the
+# best variant its Accept-Encoding allows (br, then gzip), with a strong ETag
+# per variant and Vary: Accept-Encoding, so a revalidation is a 304 without
+# a body and nothing is compressed per request.
+#
+# Each file is also served under a fingerprinted name (dashboard.js ->
+# dashboard.<hash>.js) with a one-year immutable Cache-Control: the name
+# changes whenever the content does, so browsers never ask for it again.
+# HTML pages reference other assets by those names (rewritten at startup);
+# the pages themselves keep their plain URLs, which browsers revalidate on
+# every visit (no-cache).
+#
+# Compressing takes a moment (brotli at its best quality), so it is not done
+# at import: main.py's lifespan starts build() on a worker thread, and a
+# request arriving before it finished waits for it.
+
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+def _compressors():
+    if brotli is not None:
+        yield "br", lambda body: brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+    # mtime=0: the same file always gives the same bytes (and ETag)
+    yield "gzip", lambda body: gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL, mtime=0)
+
+def _accepted_encodings(accept_encoding: str) -> dict:
+    """Accept-Encoding -> {coding: q}."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding.strip():
+            accepted[coding.strip()] = q
+    return accepted
+
+class Asset:
+    """One file: its bytes per content coding, each with a strong ETag."""
+
+    def __init__(self, body: bytes, media_type: str):
+        digest = hashlib.sha256(body).hexdigest()
+        self.fingerprint = digest[:12]
+        self.media_type = media_type
+        # coding -> (body, ETag); compressed variants only when they are smaller
+        self.variants = {"identity": (body, f'"{digest[:20]}"')}
+        for coding, compress in _compressors():
+            data = compress(body)
+            if len(data) < len(body):
+                self.variants[coding] = (data, f'"{digest[:20]}-{coding}"')
+
+    def choose(self, accept_encoding: str) -> str:
+        accepted = _accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.variants and accepted.get(coding, accepted.get("*", 0)) > 0:
+                return coding
+        return "identity"
+
+class StaticAssets:
+    """ASGI app serving every file under `directory`, mounted at `prefix` (see above)."""
+
+    def __init__(self, directory: str, prefix: str = "/static"):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.files = {}  # path under the mount -> (Asset, Cache-Control)
+        self.urls = {}   # plain URL -> fingerprinted URL
+        self.built = False
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Reads, fingerprints and compresses every file. Runs once; later calls return at once."""
+        with self._lock:
+            if not self.built:
+                self._build(self.directory)
+                self.built = True
+
+    def _build(self, root: Path):
+        paths = sorted(path for path in root.rglob("*") if path.is_file())
+        # 1. Assets first, so pages can point at their fingerprinted names
+        for path in paths:
+            if path.suffix != ".html":
+                self._add(root, path, path.read_bytes())
+        # 2. Pages, with asset references rewritten (links between pages stay plain)
+        assets = dict(self.urls)
+        reference = re.compile(re.escape(self.prefix) + r"/[\w./-]+")
+        for path in paths:
+            if path.suffix == ".html":
+                text = reference.sub(lambda m: assets.get(m.group(0), m.group(0)), path.read_text(encoding="utf-8"))
+                self._add(root, path, text.encode("utf-8"))
+
+    def _add(self, root: Path, path: Path, body: bytes):
+        name = path.relative_to(root).as_posix()
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type += "; charset=utf-8"
+        asset = Asset(body, media_type)
+        stem, dot, extension = name.rpartition(".")
+        fingerprinted = f"{stem}.{asset.fingerprint}.{extension}" if dot else f"{name}.{asset.fingerprint}"
+        self.files["/" + name] = (asset, REVALIDATE)
+        self.files["/" + fingerprinted] = (asset, IMMUTABLE)
+        self.urls[f"{self.prefix}/{name}"] = f"{self.prefix}/{fingerprinted}"
+
+    async def __call__(self, scope, receive, send):
+        if not self.built:
+            await run_in_threadpool(self.build)
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        entry = self.files.get(path)
+        if scope["method"] not in ("GET", "HEAD"):
+            await self._send(send, 405, [(b"allow", b"GET, HEAD")], b"Method Not Allowed")
+            return
+        if entry is None:
+            await self._send(send, 404, [], b"Not Found")
+            return
+
+        asset, cache_control = entry
+        request_headers = Headers(scope=scope)
+        coding = asset.choose(request_headers.get("accept-encoding", ""))
+        body, etag = asset.variants[coding]
+        headers = [(b"etag", etag.encode()), (b"cache-control", cache_control.encode())]
+        if len(asset.variants) > 1:
+            headers.append((b"vary", b"Accept-Encoding"))
+
+        if etags.matches(request_headers.get("if-none-match"), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if coding != "identity":
+            headers.append((b"content-encoding", coding.encode()))
+        headers.append((b"content-type", asset.media_type.encode()))
+        await self._send(send, 200, headers, b"" if scope["method"] == "HEAD" else body, len(body))
+
+    @staticmethod
+    async def _send(send, status: int, headers: list, body: bytes, length: int = None):
+        if not any(name == b"content-type" for name, _ in headers):
+            headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        headers.append((b"content-length", str(len(body) if length is None else length).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
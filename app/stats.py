@@ -0,0 +1,199 @@
+# in app/stats.py
+
+from collections import defaultdict
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app import archive, models
+
+# Incrementally maintained statistics. Every write in crud calls record_added /
+# record_removed / record_replaced before its commit, so the aggregates always match the rows in
+# the same transaction. rebuild() and verify() recompute from scratch.
+#
+# Archived rows (app/archive.py) stay counted: archiving deletes them from
+# calculations without touching the aggregates, and rebuild/verify/bounds add
+# the per-type aggregates kept in the segment footers.
+
+def _group(rows):
+    """(type, result) pairs -> {type: [count, sum, min, max]}"""
+    groups = defaultdict(lambda: [0, 0.0, None, None])
+    for op_type, result in rows:
+        g = groups[op_type]
+        g[0] += 1
+        g[1] += result
+        g[2] = result if g[2] is None else min(g[2], result)
+        g[3] = result if g[3] is None else max(g[3], result)
+    return groups
+
+def record_added(db: Session, user_id: int, rows):
+    """Adds (type, result) pairs to the user's aggregates with a single upsert."""
+    _merge(db, user_id, _group(rows))
+
+def _merge(db: Session, user_id: int, groups):
+    """Adds {type: [count, sum, min, max]} to the user's aggregates."""
+    if not groups:
+        return
+    Stats = models.CalculationStats
+    stmt = pg_insert(Stats).values([
+        {"user_id": user_id, "type": op_type, "count": g[0], "result_sum": g[1], "result_min": g[2], "result_max": g[3]}
+        for op_type, g in sorted(groups.items())  # fixed lock order
+    ])
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Stats.user_id, Stats.type],
+        set_={
+            "count": Stats.count + new["count"],
+            "result_sum": Stats.result_sum + new.result_sum,
+            "result_min": case((Stats.result_min.is_(None) | (new.result_min < Stats.result_min), new.result_min), else_=Stats.result_min),
+            "result_max": case((Stats.result_max.is_(None) | (new.result_max > Stats.result_max), new.result_max), else_=Stats.result_max),
+        },
+    )
+    db.execute(stmt)
+
+def record_removed(db: Session, user_id: int, rows):
+    """
+    Takes (type, result) pairs out of the user's aggregates, normally with one
+    UPDATE ... RETURNING per type. Must run after the rows are deleted/changed
+    in this transaction: when a removed value was the current min or max, that
+    bound is recomputed from what is left.
+    """
+    stats = models.CalculationStats.__table__
+    for op_type, g in _group(rows).items():
+        where = (stats.c.user_id == user_id) & (stats.c.type == op_type)
+        remaining = db.execute(
+            update(stats).where(where)
+            .values(count=stats.c.count - g[0], result_sum=stats.c.result_sum - g[1])
+            .returning(stats.c.count, stats.c.result_min, stats.c.result_max)
+        ).first()
+        if remaining is None:
+            continue
+        count, result_min, result_max = remaining
+        if count <= 0:
+            db.execute(delete(stats).where(where))
+        elif g[2] <= result_min or g[3] >= result_max:
+            _recompute_bounds(db, user_id, op_type)
+
+def record_replaced(db: Session, user_id: int, old, new):
+    """
+    Swaps one (type, result) for another, as an edit does. Same type: a single
+    UPDATE moves the sum and widens the bounds. Different types: a removal and
+    an addition.
+    """
+    if old[0] != new[0]:
+        record_removed(db, user_id, [old])
+        record_added(db, user_id, [new])
+        return
+    stats = models.CalculationStats.__table__
+    op_type, old_result, new_result = old[0], old[1], new[1]
+    bounds = db.execute(
+        update(stats).where((stats.c.user_id == user_id) & (stats.c.type == op_type))
+        .values(
+            result_sum=stats.c.result_sum - old_result + new_result,
+            result_min=case((stats.c.result_min > new_result, new_result), else_=stats.c.result_min),
+            result_max=case((stats.c.result_max < new_result, new_result), else_=stats.c.result_max),
+        )
+        .returning(stats.c.result_min, stats.c.result_max)
+    ).first()
+    if bounds is None:
+        return
+    # The old value was an extreme and the new one moved inward: look it up again
+    if (old_result <= bounds[0] and new_result > old_result) or (old_result >= bounds[1] and new_result < old_result):
+        _recompute_bounds(db, user_id, op_type)
+
+def _recompute_bounds(db: Session, user_id: int, op_type: str):
+    Calc = models.Calculation
+    stats = models.CalculationStats.__table__
+    mine = (Calc.user_id == user_id) & (Calc.type == op_type)
+    # LEAST/GREATEST skip NULLs: either side may have no rows of this type
+    _, _, archived_min, archived_max = archive.snapshot(user_id).aggregates().get(op_type, (0, 0.0, None, None))
+    db.execute(
+        update(stats).where((stats.c.user_id == user_id) & (stats.c.type == op_type))
+        .values(
+            result_min=func.least(select(func.min(Calc.result)).where(mine).scalar_subquery(), archived_min),
+            result_max=func.greatest(select(func.max(Calc.result)).where(mine).scalar_subquery(), archived_max),
+        )
+    )
+
+def get_user_stats(db: Session, user_id: int):
+    """Reads the user's aggregates: one primary-key range read, at most one row per operation type."""
+    rows = db.scalars(select(models.CalculationStats).where(models.CalculationStats.user_id == user_id)).all()
+    by_type = {
+        row.type: {"count": row.count, "result_sum": row.result_sum, "result_min": row.result_min, "result_max": row.result_max}
+        for row in rows
+    }
+    mins = [row.result_min for row in rows if row.result_min is not None]
+    maxes = [row.result_max for row in rows if row.result_max is not None]
+    return {
+        "total": sum(row.count for row in rows),
+        "result_sum": sum(row.result_sum for row in rows),
+        "result_min": min(mins) if mins else None,
+        "result_max": max(maxes) if maxes else None,
+        "by_type": by_type,
+    }
+
+def _recomputed(user_id: int = None):
+    Calc = models.Calculation
+    query = select(
+        Calc.user_id, Calc.type, func.count(), func.sum(Calc.result), func.min(Calc.result), func.max(Calc.result)
+    ).group_by(Calc.user_id, Calc.type)
+    if user_id is not None:
+        query = query.where(Calc.user_id == user_id)
+    return query
+
+def _archived(user_id: int = None, archived_users=None):
+    """{user id: {type: [count, sum, min, max]}} of archived rows, for one user, the given ones, or all."""
+    if archived_users is None:
+        archived_users = [user_id] if user_id is not None else archive.archived_users()
+    found = {}
+    for archived_user in archived_users:
+        groups = archive.snapshot(archived_user).aggregates()
+        if groups:
+            found[archived_user] = groups
+    return found
+
+def rebuild(db: Session, user_id: int = None, archived_users=None):
+    """
+    Throws away the stored aggregates (all users, or one) and recomputes them
+    from calculations plus the archive. `archived_users` limits the archive to
+    users whose rows live in this database (see rebuild_stats.py).
+    """
+    Stats = models.CalculationStats
+    cleanup = delete(Stats)
+    if user_id is not None:
+        cleanup = cleanup.where(Stats.user_id == user_id)
+    db.execute(cleanup)
+    db.execute(insert(Stats).from_select(
+        ["user_id", "type", "count", "result_sum", "result_min", "result_max"], _recomputed(user_id)
+    ))
+    for archived_user, groups in _archived(user_id, archived_users).items():
+        _merge(db, archived_user, groups)
+    db.commit()
+
+def verify(db: Session, user_id: int = None, tolerance: float = 1e-6, archived_users=None):
+    """
+    Compares the stored aggregates with a fresh GROUP BY (plus the archive).
+    Returns a list of human-readable mismatches (empty when everything agrees).
+    """
+    Stats = models.CalculationStats
+    expected = {(row[0], row[1]): row[2:] for row in db.execute(_recomputed(user_id))}
+    for archived_user, groups in _archived(user_id, archived_users).items():
+        for op_type, g in groups.items():
+            hot = expected.get((archived_user, op_type))
+            merged = archive.merge_aggregates([{op_type: g}] + ([{op_type: hot}] if hot else []))
+            expected[(archived_user, op_type)] = tuple(merged[op_type])
+    query = select(Stats)
+    if user_id is not None:
+        query = query.where(Stats.user_id == user_id)
+    stored = {(s.user_id, s.type): (s.count, s.result_sum, s.result_min, s.result_max) for s in db.scalars(query)}
+
+    def close(x, y):
+        if x is None or y is None:
+            return x is y
+        return abs(x - y) <= tolerance * max(1.0, abs(x), abs(y))
+
+    problems = []
+    for key in sorted(set(expected) | set(stored)):
+        want, got = expected.get(key), stored.get(key)
+        if want is None or got is None or want[0] != got[0] or not all(close(w, g) for w, g in zip(want[1:], got[1:])):
+            problems.append(f"user {key[0]} type {key[1]}: expected {want}, stored {got}")
+    return problems
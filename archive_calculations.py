@@ -0,0 +1,51 @@
+import argparse
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from app import archive, models, sharding
+
+# Moves calculations older than ARCHIVE_AFTER_DAYS out of the calculations
+# table into per-user archive files (see app/archive.py). Safe to run while
+# the app is serving, and again at any time (e.g. nightly from cron):
+#
+#   python archive_calculations.py                       # archive everything older than ARCHIVE_AFTER_DAYS
+#   python archive_calculations.py --older-than-days 30
+#   python archive_calculations.py --user-id 42 --dry-run
+
+def candidates(engine, cutoff: datetime, user_id: int = None):
+    """(user id, rows to archive) for users with calculations older than the cutoff."""
+    Calc = models.Calculation
+    query = select(Calc.user_id, func.count()).where(Calc.created_at < cutoff).group_by(Calc.user_id).order_by(Calc.user_id)
+    if user_id is not None:
+        query = query.where(Calc.user_id == user_id)
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old calculations to compressed columnar files")
+    parser.add_argument("--older-than-days", type=float, default=archive.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    args = parser.parse_args()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+
+    total = 0
+    try:
+        for index, shard in enumerate(sharding.shards.shards):
+            for user_id, count in candidates(shard.engine, cutoff, args.user_id):
+                if args.dry_run:
+                    print(f"user {user_id}: {count} calculations")
+                    total += count
+                    continue
+                archived = archive.archive_user(shard.engine, user_id, cutoff)
+                print(f"✅ user {user_id}: {archived} calculations archived")
+                total += archived
+    except Exception as e:
+        print(f"❌ Archiving failed: {e}")
+        sys.exit(1)
+    print(f"{total} calculations {'to archive' if args.dry_run else 'archived'} (created before {cutoff.isoformat()})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_archive.py
+#
+# Size and read cost of archived history (app/archive.py):
+#   1. bytes per row on disk, against the raw column bytes
+#   2. a full scan (what an export of the archive does)
+#   3. one 100-row keyset page at a random position: only the blocks it
+#      touches are decompressed, so this stays flat as the archive grows
+# Needs no database server: rows are generated and written to a temp dir.
+#
+#   python -m benchmarks.bench_archive --rows 1000000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import archive
+
+USER_ID = 1
+RAW_BYTES_PER_ROW = 8 + 8 + 8 + 1 + 8 + 8  # id, a, b, type, result, created_at
+
+
+def make_rows(count: int):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    types = ("add", "subtract", "multiply", "divide")
+    for i in range(count):
+        a, b = float(random.randint(-1000, 1000)), float(random.randint(1, 100))
+        yield archive.ArchivedRow(a, b, types[i % 4], None, None, i + 1, a * b, None, USER_ID,
+                                  start + timedelta(seconds=i * 7))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive size and read cost")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive.ARCHIVE_DIR = directory
+        started = time.perf_counter()
+        writer = archive.SegmentWriter(USER_ID, "00000001.seg")
+        writer.add(make_rows(args.rows))
+        writer.close()
+        writer.commit()
+        written = time.perf_counter() - started
+        size = os.path.getsize(writer.path)
+        print(f"rows: {args.rows}, write: {written:.2f}s, {size / args.rows:.1f} bytes/row "
+              f"(raw columns {RAW_BYTES_PER_ROW})")
+
+        snapshot = archive.snapshot(USER_ID)
+        started = time.perf_counter()
+        scanned = sum(len(batch) for batch in snapshot.batches(batch_rows=5000))
+        scan = time.perf_counter() - started
+        print(f"full scan: {scan:.2f}s ({scanned / scan / 1e6:.2f}M rows/s)")
+
+        keys = [(archive.from_micros(archive.to_micros(datetime(2025, 1, 1, tzinfo=timezone.utc)) + i * 7_000_000), i + 1)
+                for i in random.sample(range(args.rows), args.pages)]
+        started = time.perf_counter()
+        for key in keys:
+            snapshot.take(101, after=key)
+        print(f"100-row page: {(time.perf_counter() - started) / args.pages * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
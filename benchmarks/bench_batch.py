@@ -0,0 +1,79 @@
+# benchmarks/bench_batch.py
+#
+# Compares single-item POST /calculations/ against POST /calculations/batch.
+# Needs the same database settings as the tests, e.g.:
+#
+#   POSTGRES_HOST=localhost BCRYPT_ROUNDS=4 python -m benchmarks.bench_batch --count 2000
+
+import argparse
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from main import app
+from app.database import engine, Base
+
+OPERATIONS = ["add", "subtract", "multiply", "divide"]
+
+
+def make_items(count: int):
+    """Random operations; roughly 1 in 20 divisions is by zero."""
+    items = []
+    for _ in range(count):
+        op = random.choice(OPERATIONS)
+        b = 0 if op == "divide" and random.random() < 0.05 else random.uniform(1, 100)
+        items.append({"a": random.uniform(-100, 100), "b": b, "type": op})
+    return items
+
+
+def login(client: TestClient) -> dict:
+    rand_id = random.randint(100000, 999999)
+    email = f"bench_{rand_id}@test.com"
+    client.post("/users/register", json={
+        "username": f"bench_{rand_id}",
+        "email": email,
+        "password": "benchpassword"
+    })
+    res = client.post("/users/login", data={"username": email, "password": "benchpassword"})
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+def bench_single(client: TestClient, headers: dict, items: list) -> float:
+    start = time.perf_counter()
+    for item in items:
+        # The single-item route rejects b == 0 for divide, same as a real client would see
+        client.post("/calculations/", json=item, headers=headers)
+    return time.perf_counter() - start
+
+
+def bench_batch(client: TestClient, headers: dict, items: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(items), batch_size):
+        res = client.post("/calculations/batch", json={"items": items[i:i + batch_size]}, headers=headers)
+        res.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single vs batch calculation throughput")
+    parser.add_argument("--count", type=int, default=2000, help="number of calculations")
+    parser.add_argument("--batch-size", type=int, default=1000, help="items per batch request")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    client = TestClient(app)
+    headers = login(client)
+    items = make_items(args.count)
+
+    single = bench_single(client, headers, items)
+    batch = bench_batch(client, headers, items, args.batch_size)
+
+    print(f"{'mode':<10}{'seconds':>10}{'items/s':>12}")
+    print(f"{'single':<10}{single:>10.3f}{args.count / single:>12.0f}")
+    print(f"{'batch':<10}{batch:>10.3f}{args.count / batch:>12.0f}")
+    print(f"speedup: {single / batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_concurrency.py
+#
+# Requests per second at increasing numbers of concurrent clients, against a
+# running server. Start the server once per mode and compare:
+#
+#   DATABASE_MODE=sync  uvicorn main:app --port 8000
+#   DATABASE_MODE=async uvicorn main:app --port 8000
+#
+#   python -m benchmarks.bench_concurrency --base-url http://localhost:8000
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    rand_id = random.randint(100000, 999999)
+    email = f"bench_{rand_id}@test.com"
+    await client.post("/users/register", json={
+        "username": f"bench_{rand_id}",
+        "email": email,
+        "password": "benchpassword"
+    })
+    res = await client.post("/users/login", data={"username": email, "password": "benchpassword"})
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+async def run_level(client: httpx.AsyncClient, headers: dict, concurrency: int, requests_per_client: int):
+    """Each client alternates a create and a browse, back to back."""
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for i in range(requests_per_client):
+            if i % 2 == 0:
+                res = await client.post("/calculations/", json={"a": i, "b": 2, "type": "multiply"}, headers=headers)
+            else:
+                res = await client.get("/calculations/", params={"limit": 10}, headers=headers)
+            if res.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    total = concurrency * requests_per_client
+    return total / elapsed, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrency benchmark for the sync and async DB paths")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--levels", default="50,200,1000", help="comma separated client counts")
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        headers = await login(client)
+        print(f"{'clients':>8}{'req/s':>12}{'errors':>8}")
+        for level in (int(x) for x in args.levels.split(",")):
+            rps, errors = await run_level(client, headers, level, args.requests_per_client)
+            print(f"{level:>8}{rps:>12.0f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+# benchmarks/bench_group_commit.py
+#
+# POST /calculations/ throughput with many concurrent clients, in strict
+# (one commit per request) and group commit mode, in the same process
+# against the same database. Needs the same database settings as the tests:
+#
+#   POSTGRES_HOST=localhost BCRYPT_ROUNDS=4 python -m benchmarks.bench_group_commit \
+#       --clients 10 --requests 100 --interval-ms 5
+#
+# In DATABASE_MODE=sync keep --clients within the connection pool (15 by
+# default); DATABASE_MODE=async handles e.g. --clients 50.
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+from main import app
+from app import group_commit
+from app.database import engine, Base
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    rand_id = random.randint(10**8, 10**9)
+    email = f"bench_{rand_id}@test.com"
+    await client.post("/users/register", json={
+        "username": f"bench_{rand_id}", "email": email, "password": "benchpassword"
+    })
+    res = await client.post("/users/login", data={"username": email, "password": "benchpassword"})
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+async def client_loop(client: httpx.AsyncClient, headers: dict, count: int, latencies: list):
+    for i in range(count):
+        start = time.perf_counter()
+        res = await client.post("/calculations/", json={"a": i, "b": 2, "type": "multiply"}, headers=headers)
+        res.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(mode: str, clients: int, requests: int):
+    group_commit.CALC_COMMIT_MODE = mode
+    transport = httpx.ASGITransport(app=app)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=60) as client:
+        headers = await asyncio.gather(*(login(client) for _ in range(clients)))
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, h, requests, latencies) for h in headers))
+        elapsed = time.perf_counter() - start
+        await group_commit.committer.drain()
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / elapsed, statistics.median(latencies), p99
+
+
+async def compare(clients: int, requests: int) -> dict:
+    return {mode: await run(mode, clients, requests) for mode in ("strict", "group")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Strict vs group commit insert throughput")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="inserts per client")
+    parser.add_argument("--interval-ms", type=float, default=group_commit.GROUP_COMMIT_INTERVAL_MS)
+    parser.add_argument("--max-rows", type=int, default=group_commit.GROUP_COMMIT_MAX_ROWS)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    group_commit.committer = group_commit.GroupCommitter(args.interval_ms, args.max_rows)
+
+    # One event loop for both runs: asyncpg connections are tied to the loop they were opened on
+    results = asyncio.run(compare(args.clients, args.requests))
+    print(f"{'mode':<8}{'inserts/s':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    for mode, (rps, p50, p99) in results.items():
+        print(f"{mode:<8}{rps:>11.0f}{p50 * 1000:>9.1f}{p99 * 1000:>9.1f}")
+    print(f"group / strict: {results['group'][0] / results['strict'][0]:.2f}x "
+          f"({args.clients} clients, interval {args.interval_ms} ms, max {args.max_rows} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# benchmarks/bench_login.py
+#
+# Login throughput with real bcrypt, plus the latency of a cheap request
+# (GET /) measured while the logins are running. With hashing in the process
+# pool, the cheap request should stay fast even when logins saturate it.
+#
+#   POSTGRES_HOST=localhost BCRYPT_ROUNDS=12 HASH_WORKERS=2 \
+#       python -m benchmarks.bench_login --logins 200 --concurrency 50
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+from main import app
+from app import hashing
+from app.database import engine, Base
+
+
+async def login_loop(client: httpx.AsyncClient, email: str, count: int, outcomes: dict):
+    for _ in range(count):
+        res = await client.post("/users/login", data={"username": email, "password": "benchpassword"})
+        outcomes[res.status_code] = outcomes.get(res.status_code, 0) + 1
+
+
+async def probe_loop(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def run(logins: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        rand_id = random.randint(100000, 999999)
+        email = f"bench_{rand_id}@test.com"
+        await client.post("/users/register", json={
+            "username": f"bench_{rand_id}",
+            "email": email,
+            "password": "benchpassword"
+        })
+
+        outcomes, latencies = {}, []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_loop(client, stop, latencies))
+        per_client = max(1, logins // concurrency)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login_loop(client, email, per_client, outcomes) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    total = per_client * concurrency
+    print(f"bcrypt rounds:    {hashing.BCRYPT_ROUNDS}")
+    print(f"hash workers:     {hashing.HASH_WORKERS} (queue limit {hashing.HASH_QUEUE_LIMIT})")
+    print(f"logins:           {total} in {elapsed:.2f}s -> {total / elapsed:.1f}/s")
+    print(f"status codes:     {dict(sorted(outcomes.items()))}")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"GET / during run: p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput with real bcrypt")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    try:
+        asyncio.run(run(args.logins, args.concurrency))
+    finally:
+        hashing.pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_metrics.py
+#
+# Measures what the always-on instrumentation costs. Needs no database:
+#   1. the same tiny FastAPI route with and without MetricsMiddleware
+#   2. the same SQL statement on an in-memory SQLite engine with and without
+#      the statement-timing events
+#
+#   python -m benchmarks.bench_metrics --requests 5000 --statements 50000
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+
+from app import metrics
+
+
+def make_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        return {"id": item_id}
+
+    return app
+
+
+async def time_requests(app: FastAPI, count: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):  # warm-up
+            await client.get(f"/items/{i}")
+        start = time.perf_counter()
+        for i in range(count):
+            await client.get(f"/items/{i}")
+        return time.perf_counter() - start
+
+
+def time_statements(instrumented: bool, count: int) -> float:
+    engine = create_engine("sqlite://")
+    if instrumented:
+        metrics.instrument_engine(engine)
+    token = metrics.current_request.set(metrics.RequestStats())
+    try:
+        with engine.connect() as conn:
+            stmt = text("SELECT 1")
+            start = time.perf_counter()
+            for _ in range(count):
+                conn.execute(stmt)
+            return time.perf_counter() - start
+    finally:
+        metrics.current_request.reset(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead of the metrics middleware and DB statement events")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--statements", type=int, default=50000)
+    args = parser.parse_args()
+
+    plain = asyncio.run(time_requests(make_app(False), args.requests))
+    instrumented = asyncio.run(time_requests(make_app(True), args.requests))
+    per_request = (instrumented - plain) / args.requests * 1e6
+    print(f"request:   plain {plain / args.requests * 1e6:8.1f} us   "
+          f"instrumented {instrumented / args.requests * 1e6:8.1f} us   "
+          f"overhead {per_request:6.1f} us ({(instrumented / plain - 1) * 100:+.1f}%)")
+
+    plain = time_statements(False, args.statements)
+    instrumented = time_statements(True, args.statements)
+    per_statement = (instrumented - plain) / args.statements * 1e6
+    print(f"statement: plain {plain / args.statements * 1e6:8.1f} us   "
+          f"instrumented {instrumented / args.statements * 1e6:8.1f} us   "
+          f"overhead {per_statement:6.1f} us ({(instrumented / plain - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
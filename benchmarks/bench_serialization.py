@@ -0,0 +1,90 @@
+# benchmarks/bench_serialization.py
+#
+# Per-row cost of a calculation list response, query + JSON encoding:
+#   1. the old path: ORM Calculation objects, validated against
+#      List[CalculationRead] with from_attributes and dumped by Pydantic
+#      (what FastAPI does for a response_model)
+#   2. the fast path: column tuples encoded by app.encoding (orjson)
+# Needs no database server: rows live in an in-memory SQLite database.
+#
+#   python -m benchmarks.bench_serialization --rows 10000 --page-sizes 100,1000,10000
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import crud, encoding, models, schemas
+from app.database import Base
+
+USER_ID = 1
+
+
+def make_session(rows: int) -> Session:
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = Session(engine)
+    db.execute(insert(models.User.__table__).values(
+        id=USER_ID, username="bench", email="bench@test.com", password_hash="x"
+    ))
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    db.execute(insert(models.Calculation.__table__), [
+        {"a": random.uniform(-1000, 1000), "b": random.uniform(1, 1000), "type": "multiply",
+         "result": random.uniform(-1e6, 1e6), "user_id": USER_ID,
+         "created_at": start + timedelta(seconds=i)}
+        for i in range(rows)
+    ])
+    db.commit()
+    return db
+
+
+def old_path(db: Session, limit: int, adapter) -> bytes:
+    calcs = (
+        db.query(models.Calculation)
+        .filter(models.Calculation.user_id == USER_ID)
+        .order_by(models.Calculation.created_at, models.Calculation.id)
+        .limit(limit).all()
+    )
+    return adapter.dump_json(adapter.validate_python(calcs, from_attributes=True))
+
+
+def fast_path(db: Session, limit: int, adapter) -> bytes:
+    return encoding.encode_calculations(crud.get_calculations(db, USER_ID, limit=limit))
+
+
+def per_row_us(fn, db: Session, limit: int, adapter, repeat: int) -> float:
+    fn(db, limit, adapter)  # warm-up
+    best = float("inf")
+    for _ in range(repeat):
+        db.expunge_all()  # no identity-map reuse between rounds
+        start = time.perf_counter()
+        fn(db, limit, adapter)
+        best = min(best, time.perf_counter() - start)
+    return best / limit * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row cost of calculation list serialization")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--page-sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = make_session(args.rows)
+    adapter = TypeAdapter(List[schemas.CalculationRead])
+    print(f"{'rows':>7}{'old us/row':>13}{'fast us/row':>13}{'speed-up':>10}")
+    for size in (int(s) for s in args.page_sizes.split(",")):
+        size = min(size, args.rows)
+        old = per_row_us(old_path, db, size, adapter, args.repeat)
+        fast = per_row_us(fast_path, db, size, adapter, args.repeat)
+        print(f"{size:>7}{old:>13.2f}{fast:>13.2f}{old / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
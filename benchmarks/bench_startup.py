@@ -0,0 +1,76 @@
+# benchmarks/bench_startup.py
+#
+# Cold-start cost of a worker, measured in fresh processes:
+#   1. import time of main (python -c "import main")
+#   2. time-to-first-request: from spawning uvicorn until GET / answers 200
+# The app does no DB round trip at startup, so this also works (and should
+# give the same numbers) with the database down:
+#
+#   POSTGRES_HOST=localhost python -m benchmarks.bench_startup --runs 5
+#   POSTGRES_HOST=127.0.0.1 POSTGRES_PORT=1 python -m benchmarks.bench_startup --runs 5
+
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_seconds() -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"],
+        check=True, capture_output=True, text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_request_seconds(timeout: float) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while time.perf_counter() - start < timeout:
+                if proc.poll() is not None:
+                    raise SystemExit(f"uvicorn exited with code {proc.returncode} before serving a request")
+                try:
+                    if client.get("/").status_code == 200:
+                        return time.perf_counter() - start
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+        raise SystemExit(f"no response within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def report(name: str, values):
+    print(f"{name:<22} median {statistics.median(values) * 1000:7.0f} ms   "
+          f"min {min(values) * 1000:7.0f} ms   max {max(values) * 1000:7.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and time-to-first-request of a fresh worker")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    report("import main", [import_seconds() for _ in range(args.runs)])
+    report("first request", [first_request_seconds(args.timeout) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# benchmarks/loadtest.py
+#
+# HTTP load and latency benchmark for the whole user flow:
+# register -> login -> (create -> browse -> read -> update -> delete) x N
+#
+# By default it drives main.app in-process (httpx ASGI transport) against the
+# database configured by the usual POSTGRES_* variables. Use --base-url to hit
+# a running server instead.
+#
+#   POSTGRES_HOST=localhost BCRYPT_ROUNDS=4 python -m benchmarks.loadtest \
+#       --clients 50 --iterations 20 --output results.json
+#
+#   # later, fail (exit 1) if any route got >20% slower or lost >20% throughput
+#   python -m benchmarks.loadtest --clients 50 --iterations 20 \
+#       --baseline results.json --threshold 0.2
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROUTES = [
+    "POST /users/register",
+    "POST /users/login",
+    "POST /calculations/",
+    "GET /calculations/",
+    "GET /calculations/{calc_id}",
+    "PUT /calculations/{calc_id}",
+    "DELETE /calculations/{calc_id}",
+]
+
+
+class Recorder:
+    """Collects latencies and error counts per route template."""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+
+    async def call(self, route: str, request, expected: int = 200):
+        start = time.perf_counter()
+        try:
+            res = await request
+        except httpx.HTTPError:
+            res = None
+        self.latencies[route].append(time.perf_counter() - start)
+        if res is None or res.status_code != expected:
+            self.errors[route] += 1
+        return res
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def virtual_client(client: httpx.AsyncClient, rec: Recorder, iterations: int):
+    rand_id = random.randint(10**8, 10**9)
+    email = f"load_{rand_id}@test.com"
+    await rec.call("POST /users/register", client.post("/users/register", json={
+        "username": f"load_{rand_id}", "email": email, "password": "loadpassword"
+    }))
+    res = await rec.call("POST /users/login", client.post("/users/login", data={
+        "username": email, "password": "loadpassword"
+    }))
+    if res is None or res.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+    for i in range(iterations):
+        res = await rec.call("POST /calculations/", client.post(
+            "/calculations/", json={"a": i, "b": 3, "type": "multiply"}, headers=headers))
+        if res is None or res.status_code != 200:
+            continue
+        calc_id = res.json()["id"]
+        await rec.call("GET /calculations/", client.get("/calculations/", params={"limit": 20}, headers=headers))
+        await rec.call("GET /calculations/{calc_id}", client.get(f"/calculations/{calc_id}", headers=headers))
+        await rec.call("PUT /calculations/{calc_id}", client.put(
+            f"/calculations/{calc_id}", json={"a": i, "b": 4, "type": "add"}, headers=headers))
+        await rec.call("DELETE /calculations/{calc_id}", client.delete(
+            f"/calculations/{calc_id}", headers=headers), expected=204)
+
+
+def summarize(rec: Recorder, elapsed: float, args) -> dict:
+    routes = {}
+    for route in ROUTES:
+        values = sorted(rec.latencies[route])
+        if not values:
+            continue
+        routes[route] = {
+            "count": len(values),
+            "errors": rec.errors[route],
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "rps": len(values) / elapsed,
+        }
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "target": args.base_url or "in-process",
+        "clients": args.clients,
+        "iterations": args.iterations,
+        "elapsed_s": elapsed,
+        "total_rps": sum(r["count"] for r in routes.values()) / elapsed,
+        "routes": routes,
+    }
+
+
+def print_report(results: dict):
+    print(f"{'route':<34}{'count':>7}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+    for route, r in results["routes"].items():
+        print(f"{route:<34}{r['count']:>7}{r['errors']:>7}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['rps']:>9.1f}")
+    print(f"total: {results['total_rps']:.1f} req/s over {results['elapsed_s']:.2f}s "
+          f"({results['clients']} clients x {results['iterations']} iterations)")
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Returns a list of regressions: p95 up or throughput down by more than `threshold`."""
+    regressions = []
+    for route, base in baseline.get("routes", {}).items():
+        now = results["routes"].get(route)
+        if now is None:
+            continue
+        if now["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {base['p95_ms']:.1f} -> {now['p95_ms']:.1f} ms")
+        if now["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{route}: {base['rps']:.1f} -> {now['rps']:.1f} req/s")
+    return regressions
+
+
+async def run(args) -> dict:
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from main import app
+        from app.database import engine, Base
+        Base.metadata.create_all(bind=engine)
+        transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    rec = Recorder()
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_client(client, rec, args.iterations) for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+    return summarize(rec, elapsed, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the calculator API")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent virtual clients")
+    parser.add_argument("--iterations", type=int, default=10, help="create/browse/read/update/delete rounds per client")
+    parser.add_argument("--base-url", default=None, help="hit a running server instead of main.app in-process")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"❌ regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ no route regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
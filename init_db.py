@@ -1,13 +1,83 @@
+import argparse
+import sys
+import time
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+
 from app.database import engine, Base
-from app import models
+from app import models, sharding, stats
+
+# Schema setup and migrations. The app never touches the schema at startup,
+# so run this once per deploy, before starting uvicorn:
+#
+#   python init_db.py              # create missing tables, apply upgrades
+#   python init_db.py --wait 60    # first wait up to 60s for Postgres to come up
+#
+# With DATABASE_SHARD_URLS set, every shard gets the same schema, and each its
+# own block of calculation ids (see app/sharding.py).
+#
+# Every step is idempotent, so running it again is harmless.
+
+# Columns and indexes added after the first release. create_all() only creates
+# missing tables, so databases created before these existed get them here.
+UPGRADES = [
+    "ALTER TABLE calculations ADD COLUMN IF NOT EXISTS expression VARCHAR(255)",
+    "ALTER TABLE calculations ADD COLUMN IF NOT EXISTS variables JSON",
+    "CREATE INDEX IF NOT EXISTS ix_calculations_user_created_id ON calculations (user_id, created_at, id)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS calc_version BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS shard_moving BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE calculations ADD COLUMN IF NOT EXISTS exact TEXT",
+]
+
+def wait_for_db(timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with engine.connect():
+                return
+        except OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            print("Postgres is unavailable - sleeping")
+            time.sleep(1)
+
+def init_shard(index: int):
+    shard_engine = sharding.shards.shards[index].engine
+    # 1. Tables that do not exist yet
+    had_stats = inspect(shard_engine).has_table(models.CalculationStats.__tablename__)
+    Base.metadata.create_all(bind=shard_engine)
+
+    # 2. Columns/indexes for tables created by an older version
+    with shard_engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.exec_driver_sql(statement)
+        if sharding.shards.count > 1:
+            sharding.reserve_ids(conn, index)
+
+    # 3. A brand-new stats table starts empty: fill it from existing history
+    if not had_stats:
+        with sharding.shards.session(index) as db:
+            stats.rebuild(db)
 
 def init():
     print("Creating database tables...")
+    for index in range(sharding.shards.count):
+        init_shard(index)
+    print("✅ Tables created successfully!")
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema")
+    parser.add_argument("--wait", type=float, default=0, help="seconds to wait for the database to accept connections")
+    args = parser.parse_args()
     try:
-        Base.metadata.create_all(bind=engine)
-        print("✅ Tables created successfully!")
+        if args.wait:
+            wait_for_db(args.wait)
+        init()
     except Exception as e:
         print(f"❌ Error creating tables: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    init()
\ No newline at end of file
+    main()
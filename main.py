@@ -1,22 +1,100 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from app.database import engine, Base
-# Import models so tables are created by SQLAlchemy
-from app import models 
-from app.routers import user_routes, calc_routes
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse
+from app import database
+from app.routers import user_routes, calc_routes, stats_routes, analytics_routes
+from app import admission, compute, events, group_commit, hashing, metrics, profiler, sharding, static_assets
 
-# Create database tables on startup
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# --- STARTUP / SHUTDOWN ---
+# Tables are created and upgraded by `python init_db.py`, not here, so a
+# worker starts without any DB round trip. The pool is warmed in the
+# background; if Postgres is not up yet, only requests that need it fail
+# until it is.
+async def _warm_up():
+    try:
+        await database.ping()
+    except Exception as e:
+        logger.warning("Database not reachable at startup (%s); continuing", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up = asyncio.create_task(_warm_up())
+    # Static files are compressed off the event loop while the first requests come in
+    build_static = asyncio.create_task(asyncio.to_thread(static_files.build))
+    # Ejects/readmits read replicas by health (and lag); none configured by default
+    monitor = asyncio.create_task(database.replicas.monitor()) if database.replicas.replicas else None
+    yield
+    warm_up.cancel()
+    if monitor is not None:
+        monitor.cancel()
+    await build_static
+    # Grouped calculation inserts still waiting are written before exit
+    await group_commit.committer.drain()
+    hashing.pool.shutdown()
+    compute.pool.shutdown()
+    await database.dispose()
+    await sharding.shards.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+# --- COMPRESSION ---
+# gzip for API responses of at least GZIP_MINIMUM_SIZE bytes (calculation
+# lists, pages, exports). Innermost, so compression time is measured and
+# admitted like the rest of the request. Static files are precompressed and
+# already carry a Content-Encoding, so they pass through untouched.
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+
+# --- ADMISSION CONTROL ---
+# Per-class concurrency limits with bounded wait queues (503 + Retry-After
+# when full). Added before the metrics middleware so rejections are measured too.
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware)
+
+# --- METRICS ---
+# Per-route latency histograms, status counters, in-flight gauges and
+# per-request DB statement counts/time, served at /metrics
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    for sync_engine in sharding.sync_engines():
+        metrics.instrument_engine(sync_engine)
+
+# --- SQL PROFILER ---
+# Opt-in (SQL_PROFILER=true): text, parameter shape, duration and route of
+# every statement, N+1 warnings and EXPLAIN plans of slow statements. The
+# summary is served at /debug/sql, to the users in PROFILER_USERS only.
+if profiler.PROFILER_ENABLED:
+    for sync_engine in sharding.sync_engines():
+        profiler.instrument_engine(sync_engine)
+
+    @app.get("/debug/sql", include_in_schema=False)
+    def read_sql_profile(current_user = Depends(calc_routes.get_current_user)):
+        if current_user.email not in profiler.PROFILER_USERS:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read the SQL profile")
+        return profiler.profiler.report()
 
 # --- MOUNT STATIC FILES ---
-# This allows the API to serve your HTML/CSS/JS files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# This allows the API to serve your HTML/CSS/JS files: precompressed (gzip/br),
+# strong ETags, immutable caching under fingerprinted names
+static_files = static_assets.StaticAssets("app/static", prefix="/static")
+app.mount("/static", static_files, name="static")
 
 # --- REGISTER ROUTERS ---
 app.include_router(user_routes.router)
 app.include_router(calc_routes.router)
+app.include_router(stats_routes.router)
+app.include_router(analytics_routes.router)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return metrics.registry.render() + admission.render() + events.render()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,51 @@
+import argparse
+import sys
+
+from sqlalchemy import select
+
+from app import database, models, sharding
+
+# Moves users' calculations between shards while the app keeps running
+# (see sharding.move_user). The user's writes get a 503 for the few seconds
+# the move takes; reads keep working throughout.
+#
+#   python move_user.py 42 2                  # move user 42 to shard 2
+#   python move_user.py --rebalance --dry-run # list users not on their hash shard
+#   python move_user.py --rebalance           # ...and move them there (e.g. after adding a shard)
+
+def rebalance(dry_run: bool):
+    users = models.User.__table__
+    with database.engine.connect() as conn:
+        placements = conn.execute(select(users.c.id, users.c.shard).order_by(users.c.id)).all()
+    misplaced = [(user_id, shard, sharding.home_shard(user_id, sharding.shards.count))
+                 for user_id, shard in placements]
+    misplaced = [entry for entry in misplaced if entry[1] != entry[2]]
+    for user_id, source, target in misplaced:
+        if dry_run:
+            print(f"user {user_id}: shard {source} -> {target}")
+        else:
+            moved = sharding.move_user(user_id, target)
+            print(f"✅ user {user_id}: {moved} calculations moved from shard {source} to {target}")
+    print(f"{len(misplaced)} of {len(placements)} users {'to move' if dry_run else 'moved'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users' calculations between shards")
+    parser.add_argument("user_id", type=int, nargs="?")
+    parser.add_argument("shard", type=int, nargs="?")
+    parser.add_argument("--rebalance", action="store_true", help="move every user to the shard its id hashes to")
+    parser.add_argument("--dry-run", action="store_true", help="with --rebalance: only list the moves")
+    args = parser.parse_args()
+    if not args.rebalance and (args.user_id is None or args.shard is None):
+        parser.error("give USER_ID SHARD, or --rebalance")
+    try:
+        if args.rebalance:
+            rebalance(args.dry_run)
+        else:
+            moved = sharding.move_user(args.user_id, args.shard)
+            print(f"✅ user {args.user_id}: {moved} calculations on shard {args.shard}")
+    except Exception as e:
+        print(f"❌ Move failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
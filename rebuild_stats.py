@@ -0,0 +1,47 @@
+import argparse
+import sys
+
+from app import archive, sharding, stats
+
+# Recomputes (or just checks) the per-user aggregates behind /stats from the
+# calculations table.
+#
+#   python rebuild_stats.py --verify          # report drift, exit 1 if any
+#   python rebuild_stats.py                   # rebuild everything
+#   python rebuild_stats.py --user-id 42      # rebuild one user
+#
+# Archived calculations (app/archive.py) are included. With shards
+# configured, each shard is checked against its own calculations and the
+# archives of the users it holds.
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify the calculation statistics table")
+    parser.add_argument("--verify", action="store_true", help="only compare, do not write")
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.user_id is not None:
+        indexes = [sharding.shards.lookup(args.user_id)[0]]
+    else:
+        indexes = range(sharding.shards.count)
+    problems = []
+    for index in indexes:
+        archived_users = None
+        if sharding.shards.count > 1 and args.user_id is None:
+            archived_users = [user_id for user_id in archive.archived_users() if sharding.shards.lookup(user_id)[0] == index]
+        with sharding.shards.session(index) as db:
+            if args.verify:
+                problems += stats.verify(db, user_id=args.user_id, archived_users=archived_users)
+            else:
+                stats.rebuild(db, user_id=args.user_id, archived_users=archived_users)
+    if args.verify:
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ Statistics match the calculations table")
+    else:
+        print("✅ Statistics rebuilt")
+
+if __name__ == "__main__":
+    main()
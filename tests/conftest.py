@@ -0,0 +1,26 @@
+import pytest
+from contextlib import contextmanager
+from app import hashing, profiler, sharding
+
+@pytest.fixture(autouse=True)
+def fast_hashing(monkeypatch):
+    """Real bcrypt at the lowest cost, so registering and logging in stay cheap."""
+    monkeypatch.setattr(hashing, "BCRYPT_ROUNDS", 4)
+
+@pytest.fixture
+def query_budget():
+    """
+    Fails the test when the `with` block runs more SQL statements than its
+    budget (on any shard or replica), listing each one with the route that ran it:
+
+        with query_budget(1):
+            client.get(f"/calculations/{calc_id}", headers=headers)
+    """
+    @contextmanager
+    def budget(limit: int):
+        with profiler.capture(*sharding.sync_engines()) as statements:
+            yield statements
+        if len(statements) > limit:
+            listed = "\n".join(f"  {statement.route}: {statement.text}" for statement in statements)
+            pytest.fail(f"{len(statements)} SQL statements, budget is {limit}:\n{listed}", pytrace=False)
+    return budget
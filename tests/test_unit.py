@@ -1,24 +1,23 @@
 import pytest
 from pydantic import ValidationError
-import os # <-- REQUIRED FOR TEST_MODE CHECK
+import os
 
 # Import all the things we need to test
+import asyncio
+import time
+from app import compute, hashing
 from app.security import get_password_hash, verify_password
-from app.logic import OperationType, get_operation_func
+from app.security import create_access_token, decode_access_token, Principal, TokenCache
+from app.logic import OperationType, get_operation_func, evaluate_batch, calculate, calculate_exact
 from app.schemas import CalculationCreate
+from app.expressions import compile_expression, ExpressionError
 
 # --- Security Unit Tests ---
 
 def test_password_hashing():
     """
     Tests the password hashing and verification functions.
-    This test is SKIPPED if TEST_MODE is active because the hashing logic is bypassed.
     """
-    # --- CRITICAL FIX: SKIP TEST IF BYPASS IS ACTIVE ---
-    if os.getenv("TEST_MODE") == "true":
-        pytest.skip("Skipping password hashing unit test because TEST_MODE bypass is active.")
-    # ---------------------------------------------------
-
     password = "mysecretpassword123"
     
     # Test that a hash is created
@@ -34,6 +33,85 @@ def test_password_hashing():
     # Test that verification fails for an incorrect password
     assert verify_password("wrongpassword", hashed_password) == False
 
+def test_password_rehash_on_cost_change():
+    """Test that a hash made with another cost is verified and upgraded."""
+    old_hash = hashing.hash_password("mysecretpassword123", rounds=4)
+    assert hashing.verify_and_update("mysecretpassword123", old_hash, rounds=4) == (True, None)
+
+    valid, new_hash = hashing.verify_and_update("mysecretpassword123", old_hash, rounds=5)
+    assert valid
+    assert new_hash.startswith("$2b$05$")
+    assert hashing.verify_and_update("wrongpassword", old_hash, rounds=5) == (False, None)
+
+def test_hashing_pool_runs_and_sheds_load():
+    """Test that the pool hashes in a worker process and refuses work past its queue limit."""
+    pool = hashing.HashingPool(workers=1, queue_limit=1)
+    try:
+        hashed = asyncio.run(pool.run(hashing.hash_password, "mysecretpassword123", 4))
+        assert hashing.verify_and_update("mysecretpassword123", hashed, rounds=4)[0]
+    finally:
+        pool.shutdown()
+
+    full = hashing.HashingPool(workers=1, queue_limit=0)
+    with pytest.raises(hashing.HashingBusy):
+        asyncio.run(full.run(hashing.hash_password, "mysecretpassword123", 4))
+
+def test_hashing_pool_recovers_from_a_dead_worker():
+    """Test that a worker that dies breaks only its own job, not every later one."""
+    from concurrent.futures.process import BrokenProcessPool
+    pool = hashing.HashingPool(workers=1, queue_limit=2)
+    try:
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(pool.run(os._exit, 1))  # dies again on the retry
+        hashed = asyncio.run(pool.run(hashing.hash_password, "mysecretpassword123", 4))
+        assert hashing.verify_and_update("mysecretpassword123", hashed, rounds=4)[0]
+    finally:
+        pool.shutdown()
+
+def test_access_token_carries_user_id():
+    """Test that the token round-trips the user id and email claims."""
+    token = create_access_token(data={"sub": "claims@test.com", "uid": 42})
+    principal, exp = decode_access_token(token)
+    assert principal == Principal(id=42, email="claims@test.com")
+    assert exp > time.time()
+
+def test_events_ticket_is_scoped_and_short_lived(monkeypatch):
+    """Test that an events ticket only decodes as a ticket, and not once it has expired."""
+    from fastapi import HTTPException
+    from app import security
+    ticket = security.create_events_ticket(Principal(id=42, email="claims@test.com"))
+    assert security.decode_events_ticket(ticket) == Principal(id=42, email="claims@test.com")
+    with pytest.raises(HTTPException):
+        decode_access_token(ticket)
+    monkeypatch.setattr(security, "EVENTS_TICKET_SECONDS", -1)
+    with pytest.raises(HTTPException):
+        security.decode_events_ticket(security.create_events_ticket(Principal(id=42, email="claims@test.com")))
+
+def test_token_cache_respects_exp_and_size():
+    """Test that the token cache expires entries and evicts the least recently used one."""
+    cache = TokenCache(maxsize=2, ttl=60)
+    cache.put("expired", Principal(1, "a@test.com"), exp=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache.put("t1", Principal(1, "a@test.com"))
+    cache.put("t2", Principal(2, "b@test.com"))
+    cache.get("t1")  # t2 is now the least recently used
+    cache.put("t3", Principal(3, "c@test.com"))
+    assert cache.get("t2") is None
+    assert cache.get("t1") == Principal(1, "a@test.com")
+    assert len(cache) == 2
+
+def test_token_cache_invalidate_user():
+    """Test that invalidating a user drops all of their cached tokens only."""
+    cache = TokenCache(maxsize=10, ttl=60)
+    cache.put("t1", Principal(1, "a@test.com"))
+    cache.put("t2", Principal(1, "a@test.com"))
+    cache.put("t3", Principal(2, "b@test.com"))
+    cache.invalidate_user(1)
+    assert cache.get("t1") is None
+    assert cache.get("t2") is None
+    assert cache.get("t3") is not None
+
 # --- Calculation Unit Tests ---
 
 def test_logic_factory():
@@ -56,6 +134,66 @@ def test_logic_divide_by_zero_exception():
     with pytest.raises(ValueError, match="Cannot divide by zero"):
         div_func(10, 0)
 
+def test_logic_evaluate_batch():
+    """Test that the vectorized batch matches the scalar factory and flags divide-by-zero per row."""
+    a = [2, 10, 5, 10, 7]
+    b = [3, 5, 5, 0, 2]
+    types = ["add", "subtract", "multiply", "divide", "divide"]
+    results, errors = evaluate_batch(a, b, types)
+
+    assert list(results[:3]) == [5, 5, 25]
+    assert results[4] == 3.5
+    assert errors == [None, None, None, "Cannot divide by zero", None]
+
+    # Overflow is an error of its row, for the vectorized operations like for expressions
+    _, errors = evaluate_batch([1e308, 1e308, 1], [10, 10, 1], ["multiply", "expression", "add"], [None, "a*b", None])
+    assert errors == ["Result is not a finite number", "Result is not a finite number", None]
+    with pytest.raises(ValueError, match="not a finite number"):
+        calculate(OperationType.MULTIPLY, 1e308, 10)
+
+def test_logic_heavy_operations_are_exact_and_bounded():
+    """Test power/factorial/root digits, domain errors and the result-size limit."""
+    assert calculate_exact(OperationType.POWER, 3, 40) == (3.0 ** 40, "12157665459056928801")
+    assert calculate_exact(OperationType.FACTORIAL, 25, 0)[1] == "15511210043330985984000000"
+    assert calculate_exact(OperationType.ROOT, -27, 3) == (-3.0, "-3")
+    result, exact = calculate_exact(OperationType.ROOT, 2, 2, 30)
+    assert result == 2 ** 0.5 and exact == "1.41421356237309504880168872421"
+    assert calculate_exact(OperationType.POWER, 0.1, 2)[1] == "0.01"
+
+    with pytest.raises(ValueError, match="too large"):
+        calculate_exact(OperationType.POWER, 2, 1e15)  # refused before computing
+    with pytest.raises(ValueError, match="too large"):
+        calculate_exact(OperationType.POWER, 2, 1024)  # on the boundary of the estimate
+    with pytest.raises(ValueError, match="too large"):
+        calculate_exact(OperationType.FACTORIAL, 171, 0)
+    with pytest.raises(ValueError, match="even root"):
+        calculate_exact(OperationType.ROOT, -4, 2)
+    with pytest.raises(ValidationError):
+        CalculationCreate(a=2.5, b=0, type="factorial")
+
+    # Batches report heavy operations per item instead of running them
+    _, errors = evaluate_batch([2, 2], [3, 3], ["add", "power"])
+    assert errors[0] is None and "not supported in batches" in errors[1]
+
+def test_compute_pool_runs_and_sheds_load():
+    """Test that heavy operations run in a worker process and the pool refuses work past its queue limit."""
+    pool = compute.ComputePool(workers=1, queue_limit=1)
+    try:
+        assert asyncio.run(pool.run(calculate_exact, OperationType.POWER, 2, 10, None)) == (1024.0, "1024")
+        with pytest.raises(ValueError, match="non-negative whole number"):
+            asyncio.run(pool.run(calculate_exact, OperationType.FACTORIAL, -1, 0, None))
+    finally:
+        pool.shutdown()
+
+    full = compute.ComputePool(workers=1, queue_limit=0)
+    with pytest.raises(compute.ComputeBusy):
+        asyncio.run(full.run(calculate_exact, OperationType.POWER, 2, 10, None))
+
+def test_schema_validation_rejects_overflowing_literal():
+    """Test that a literal beyond the float range is a validation error, not a crash when evaluated."""
+    with pytest.raises(ValidationError, match="Number too large"):
+        CalculationCreate(a=1, b=1, type="expression", expression="a*1e999")
+
 def test_schema_validation_divide_by_zero():
     """Test that the Pydantic schema validation catches division by zero."""
     with pytest.raises(ValidationError) as e:
@@ -70,4 +208,177 @@ def test_schema_validation_good_data():
     assert calc.b == 5
     
     calc_add = CalculationCreate(a=10, b=0, type=OperationType.ADD)
-    assert calc_add.b == 0
\ No newline at end of file
+    assert calc_add.b == 0
+
+# --- Expression Unit Tests ---
+
+def test_expression_precedence_and_variables():
+    """Test operator precedence, right-associative power and named variables."""
+    assert compile_expression("1 + 2 * 3").evaluate({}) == 7
+    assert compile_expression("2^3^2").evaluate({}) == 512
+    assert compile_expression("-2^2").evaluate({}) == -4
+    assert compile_expression("(a+b)**2/c").evaluate({"a": 1, "b": 2, "c": 3}) == 3
+
+def test_expression_cache_uses_normalized_text():
+    """Test that formulas differing only by whitespace share one compiled expression."""
+    assert compile_expression("a + b") is compile_expression("a+b")
+
+def test_expression_evaluate_many():
+    """Test evaluating one compiled formula over many bindings at once."""
+    values = compile_expression("a * x + b").evaluate_many({"a": [1, 2, 3], "b": [0, 0, 1], "x": [10, 10, 10]})
+    assert list(values) == [10, 20, 31]
+
+def test_expression_rejects_unsafe_or_bad_input():
+    """Test that only arithmetic is accepted and evaluation errors are clean."""
+    for text in ["__import__('os')", "a.b", "(1", "1 +", "a[0]", "a*1e999"]:
+        with pytest.raises(ExpressionError):
+            compile_expression(text)
+    with pytest.raises(ExpressionError, match="Cannot divide by zero"):
+        compile_expression("a/b").evaluate({"a": 1, "b": 0})
+    with pytest.raises(ExpressionError, match="Missing value"):
+        compile_expression("a*c").evaluate({"a": 1})
+
+# --- Fast List Encoding Unit Tests ---
+
+def test_fast_list_encoding_matches_pydantic():
+    """Test that the orjson list path produces the same bytes as List[CalculationRead]."""
+    from datetime import datetime, timedelta, timezone
+    from app.encoding import encode_calculations, encode_calculation_page, _list_adapter
+
+    utc, plus2 = timezone.utc, timezone(timedelta(hours=2))
+    common = [
+        (1.0, 3.0, "divide", None, None, 1, 1 / 3, None, 7, datetime(2026, 1, 2, 3, 4, 5, 120, tzinfo=utc)),
+        (2.0, 3.0, "expression", "a*b+c", {"c": 1.5}, 2, 7.5, None, 7, datetime(2026, 1, 2, 3, 4, 5, tzinfo=plus2)),
+        (2.0, 2.0, "root", None, None, 5, 2 ** 0.5, "1.4142135623730950488", 7, datetime(2026, 1, 2, tzinfo=utc)),
+    ]
+    exponents = common + [
+        (1e20, 3.0, "multiply", None, None, 3, 3e20, None, 7, datetime(2026, 1, 2, tzinfo=utc)),
+        (1e-5, 1.5e-7, "add", None, None, 4, 1.015e-5, None, 7, datetime(2026, 1, 2, tzinfo=utc)),
+    ]
+    for rows in ([], common, exponents):
+        expected = _list_adapter.dump_json(_list_adapter.validate_python([dict(zip(
+            ("a", "b", "type", "expression", "variables", "id", "result", "exact", "user_id", "created_at"), row
+        )) for row in rows]))
+        assert encode_calculations(rows) == expected
+    assert encode_calculation_page(common, None).startswith(b'{"items":[{"a":1.0,')
+    assert encode_calculation_page([], "abc") == b'{"items":[],"next_cursor":"abc"}'
+
+# --- Startup Unit Tests ---
+
+def test_app_starts_without_database():
+    """Test that importing and starting the app needs no database and skips heavy imports."""
+    import subprocess
+    import sys
+    script = (
+        "import sys\n"
+        "import main\n"
+        "assert 'numpy' not in sys.modules and 'jose' not in sys.modules\n"
+        "from fastapi.testclient import TestClient\n"
+        "with TestClient(main.app) as client:\n"
+        "    assert client.get('/').status_code == 200\n"
+    )
+    # Port 1 on localhost refuses connections right away
+    env = {**os.environ, "POSTGRES_HOST": "127.0.0.1", "POSTGRES_PORT": "1"}
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+# --- Admission Control Unit Tests ---
+
+def test_admission_gate_queues_then_sheds():
+    """Test that a full gate queues up to its limit, hands slots over in order, and times out."""
+    from app.admission import Gate, Rejected
+
+    async def scenario():
+        gate = Gate(limit=1, queue_limit=1, timeout=0.05)
+        await gate.acquire()
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.waiting == 1
+        with pytest.raises(Rejected):
+            await gate.acquire()  # queue is full: rejected right away
+        gate.release()  # slot goes to the waiter
+        await waiter
+        assert gate.active == 1 and gate.waiting == 0
+        with pytest.raises(Rejected):
+            await gate.acquire()  # waits 50 ms, then gives up
+        assert gate.waiting == 0
+        gate.release()
+        assert gate.active == 0
+        assert gate.rejected == 2
+
+    asyncio.run(scenario())
+
+def test_token_bucket_per_user():
+    """Test that each user gets `burst` requests at once and then `rate` per second."""
+    from app.admission import TokenBucket
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take(1) == 0 and bucket.take(1) == 0
+    wait = bucket.take(1)
+    assert 0 < wait <= 0.1
+    assert bucket.take(2) == 0  # another user is not affected
+    time.sleep(0.11)
+    assert bucket.take(1) == 0
+
+def test_event_broker_bounds_streams_and_queues():
+    """Test per-user/worker stream limits, per-user fan-out, and overflow turning into one reset."""
+    from fastapi import HTTPException
+    from app.events import Broker, frame
+
+    async def scenario():
+        broker = Broker(queue_size=2, max_connections=3, max_per_user=2)
+        first, second = broker.subscribe(1), broker.subscribe(1)
+        with pytest.raises(HTTPException) as e:
+            broker.subscribe(1)
+        assert e.value.status_code == 429
+        other = broker.subscribe(2)
+        with pytest.raises(HTTPException) as e:
+            broker.subscribe(3)
+        assert e.value.status_code == 503
+
+        broker.publish(1, frame("deleted", b'{"id":1}'))
+        assert first.queue.get_nowait() == b'event: deleted\ndata: {"id":1}\n\n'
+        assert other.queue.empty()
+        # second never read: 1 buffered + 2 more overflows its queue of 2
+        broker.publish(1, frame("deleted", b'{"id":2}'))
+        broker.publish(1, frame("deleted", b'{"id":3}'))
+        assert second.queue.qsize() == 1 and second.queue.get_nowait().startswith(b"event: reset")
+        assert broker.overflows == 1
+
+        broker.unsubscribe(2, other)
+        assert broker.connections == 2 and not broker.has_streams(2)
+
+    asyncio.run(scenario())
+
+# --- Archive Unit Tests ---
+
+def test_archive_segments_round_trip_and_skip_blocks(tmp_path, monkeypatch):
+    """Test that segments give back the exact rows, in order, with filters, offsets and id lookups."""
+    from datetime import datetime, timedelta, timezone
+    from app import archive
+
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        archive.ArchivedRow(float(i), 2.0, "expression" if i % 10 == 0 else ("add", "multiply")[i % 2],
+                            "a*b" if i % 10 == 0 else None, {"c": i} if i % 10 == 0 else None,
+                            i + 1, float(i * 3), None, 7, start + timedelta(seconds=i // 2, microseconds=i))
+        for i in range(50)
+    ]
+    for name, part in (("00000001.seg", rows[:30]), ("00000002.seg", rows[30:])):
+        writer = archive.SegmentWriter(7, name, block_rows=8)
+        writer.add(part)
+        writer.close()
+        writer.commit()
+
+    snapshot = archive.snapshot(7)
+    assert snapshot.count == 50 and snapshot.last_key == (rows[-1].created_at, rows[-1].id)
+    assert [row for batch in snapshot.batches(batch_rows=7) for row in batch] == rows
+    assert snapshot.take(5, skip=17) == rows[17:22]
+    assert snapshot.take(4, after=(rows[9].created_at, rows[9].id)) == rows[10:14]
+    assert snapshot.take(100, op_type="expression") == [row for row in rows if row.type == "expression"]
+    window = snapshot.take(100, created_after=rows[12].created_at, created_before=rows[20].created_at)
+    assert window == rows[12:20]
+    assert snapshot.get(33) == rows[32] and snapshot.get(999) is None
+    assert snapshot.aggregates()["add"] == [20, sum(r.result for r in rows if r.type == "add"), 6.0, 144.0]
+    assert not snapshot.changed()
+    assert archive.archived_users() == [7] and not archive.snapshot(8)